@@ -0,0 +1,205 @@
+"""A persistent index of the ancestor DAG in both directions.
+
+Built from the ancestor files of a shape and collinearity type it holds
+every polyomino as an integer node (its position in the sorted ids) and the
+edges in compressed sparse row (CSR) form, with the removal point as edge data.
+The arrays are saved as .npy files in an index folder alongside the ancestor
+files and memory mapped when queried, so finding the parents or children of a
+polyomino only reads the few rows it needs rather than whole levels.
+
+    ids.bin             the sorted ids concatenated
+    id_offsets.npy      where each id starts in ids.bin (one extra at the end)
+    levels.npy          n,k for each node
+    parents_*.npy       indptr, indices and points for the edges to the parents
+    children_*.npy      indptr, indices and points for the edges to the children
+    digests.json        the digest of each level in the index (see LevelDigest),
+                        so a level created or rebuilt since is known not to be
+"""
+
+import json
+import os
+import numpy as np
+from classes import Ancestor, CollinearityType, PolyShape
+from generation import get_level_digest, load_ancestors_nk
+from storage import get_storage
+
+
+def get_index_folder(poly_class: PolyShape, collinearity: CollinearityType) -> str:
+    """Return the folder the index is kept in"""
+    file_path = poly_class.get_file_path(collinearity, Ancestor, 1, 1)
+    return os.path.join(os.path.dirname(file_path), "index")
+
+
+def to_csr(rows: np.ndarray, cols: np.ndarray, points: np.ndarray, nodes: int):
+    """Return the indptr, indices and points of the edges grouped by row"""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=nodes), out=indptr[1:])
+    return indptr, cols[order], points[order]
+
+
+def build_index(poly_class: PolyShape, collinearity: CollinearityType, max_n: int):
+    """Build the index from the levels in storage up to max_n.
+    Levels not created (e.g. beyond a k limit) are left out"""
+    storage = get_storage()
+    levels = []
+    for n in range(1, max_n + 1):
+        for k in range(1, n + 1):
+            if storage.exists(poly_class, collinearity, n, k):
+                levels.append((n, k))
+
+    # first pass for the nodes
+    node_levels = {}
+    for n, k in levels:
+        for id in load_ancestors_nk(poly_class, collinearity, n, k):
+            node_levels[id] = (n, k)
+    ids = sorted(node_levels)
+    nodes = {id: node for node, id in enumerate(ids)}
+
+    # second pass for the edges from child to parent
+    children = []
+    parents = []
+    points = []
+    for n, k in levels:
+        for id, ancestors in load_ancestors_nk(poly_class, collinearity, n, k).items():
+            for a_id, removal_point in ancestors.items():
+                children.append(nodes[id])
+                parents.append(nodes[a_id])
+                points.append(removal_point)
+
+    children = np.array(children, dtype=np.int32)
+    parents = np.array(parents, dtype=np.int32)
+    points = np.array(points, dtype=np.int16).reshape(-1, poly_class.dimensions)
+
+    folder = get_index_folder(poly_class, collinearity)
+    os.makedirs(folder, exist_ok=True)
+    digests = {
+        f"{n},{k}": get_level_digest(poly_class, collinearity, n, k) for n, k in levels
+    }
+    with open(os.path.join(folder, "digests.json"), "w") as file_obj:
+        json.dump(digests, file_obj)
+
+    encoded = [id.encode() for id in ids]
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    with open(os.path.join(folder, "ids.bin"), "wb") as file_obj:
+        file_obj.write(b"".join(encoded))
+    np.save(os.path.join(folder, "id_offsets.npy"), offsets)
+    np.save(
+        os.path.join(folder, "levels.npy"),
+        np.array([node_levels[id] for id in ids], dtype=np.int16).reshape(-1, 2),
+    )
+
+    for name, rows, cols in (
+        ("parents", children, parents),
+        ("children", parents, children),
+    ):
+        indptr, indices, edge_points = to_csr(rows, cols, points, len(ids))
+        np.save(os.path.join(folder, f"{name}_indptr.npy"), indptr)
+        np.save(os.path.join(folder, f"{name}_indices.npy"), indices)
+        np.save(os.path.join(folder, f"{name}_points.npy"), edge_points)
+
+
+class AdjacencyIndex:
+    """Queries against a built index, the arrays are memory mapped"""
+
+    def __init__(self, poly_class: PolyShape, collinearity: CollinearityType):
+        folder = get_index_folder(poly_class, collinearity)
+        if not os.path.isfile(os.path.join(folder, "id_offsets.npy")):
+            raise RuntimeError(
+                f"Index for {poly_class.file_name} {collinearity.file_name} not found"
+            )
+        self.poly_class = poly_class
+        self.collinearity = collinearity
+        try:
+            with open(os.path.join(folder, "digests.json"), "r") as file_obj:
+                self.digests = json.load(file_obj)
+        except FileNotFoundError:
+            self.digests = {}
+        load = lambda name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+        self.id_offsets = load("id_offsets")
+        self.id_bytes = np.memmap(os.path.join(folder, "ids.bin"), dtype=np.uint8)
+        self.levels = load("levels")
+        self.edges = {
+            name: (
+                load(f"{name}_indptr"),
+                load(f"{name}_indices"),
+                load(f"{name}_points"),
+            )
+            for name in ("parents", "children")
+        }
+
+    def __len__(self):
+        return len(self.id_offsets) - 1
+
+    def get_id(self, node: int) -> str:
+        """Return the id of a node"""
+        start, end = self.id_offsets[node], self.id_offsets[node + 1]
+        return self.id_bytes[start:end].tobytes().decode()
+
+    def get_node(self, id: str):
+        """Return the node of an id by binary search or None if it is not in the index"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_id(mid) < id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.get_id(lo) == id:
+            return lo
+        return None
+
+    def __contains__(self, id: str):
+        return self.get_node(id) is not None
+
+    def covers(self, n: int, k: int) -> bool:
+        """Return True if the level n,k is in the index as it is now,
+        not created or rebuilt since the index was built"""
+        digest = self.digests.get(f"{n},{k}")
+        return digest is not None and digest == get_level_digest(
+            self.poly_class, self.collinearity, n, k
+        )
+
+    def get_level(self, id: str) -> tuple:
+        """Return the n,k of the polyomino"""
+        node = self.require_node(id)
+        n, k = self.levels[node]
+        return int(n), int(k)
+
+    def require_node(self, id: str) -> int:
+        node = self.get_node(id)
+        if node is None:
+            raise KeyError(id)
+        return node
+
+    def get_edges(self, name: str, node: int) -> dict:
+        indptr, indices, points = self.edges[name]
+        start, end = indptr[node], indptr[node + 1]
+        return {
+            self.get_id(int(other)): tuple(int(x) for x in point)
+            for other, point in zip(indices[start:end], points[start:end])
+        }
+
+    def get_parents(self, id: str) -> dict:
+        """Return the parents of the polyomino keyed on id, the value being
+        the removal point from the polyomino to get to the parent"""
+        return self.get_edges("parents", self.require_node(id))
+
+    def get_children(self, id: str) -> dict:
+        """Return the children the polyomino grows in to keyed on id,
+        the value being the removal point from the child back to the polyomino"""
+        return self.get_edges("children", self.require_node(id))
+
+    def get_lineage(self, id: str) -> dict:
+        """Return every ancestor back to the monomino as a DAG keyed on id
+        where the value is the dict of its parents"""
+        lineage = {}
+        todo = [id]
+        while todo:
+            u = todo.pop()
+            if u in lineage:
+                continue
+            lineage[u] = self.get_parents(u)
+            todo.extend(lineage[u])
+        return lineage
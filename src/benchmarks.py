@@ -0,0 +1,246 @@
+"""Benchmarks for comparing the trade offs of different implementation choices.
+These work on real levels so the data for them needs to be created first"""
+
+import os
+import subprocess
+import sys
+from time import perf_counter
+from classes import (
+    COMPRESSION_EXTENSIONS,
+    Ancestor,
+    CollinearityType,
+    PatternIdCache,
+    PolyShape,
+    ShapeKernel,
+    create_folder_structure,
+)
+from generation import (
+    expand_parent,
+    load_ancestors_nk,
+    load_parents_nk,
+    load_polyomino_patterns_nk,
+)
+
+
+def benchmark_compression(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Compare the file size and read throughput of an ancestor file for each of the
+    compression formats. Copies of the level are written to a benchmark folder
+    within the current data folder"""
+    data_folder = os.environ.get("POLYOMINO_DATA_FOLDER", "data")
+    compression = os.environ.get("POLYOMINO_COMPRESSION", "none")
+    silent = os.environ.get("POLYOMINO_SILENT")
+    os.environ["POLYOMINO_SILENT"] = "1"
+
+    ancestors = load_ancestors_nk(poly_class, collinearity, n, k)
+
+    print()
+    print(
+        f"Compression of {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k} rows={len(ancestors)}"
+    )
+    print()
+    print("Format        Size (bytes)    Ratio    Write (s)    Read (s)    Rows/s")
+    print("-" * 74)
+
+    os.environ["POLYOMINO_DATA_FOLDER"] = f"{data_folder}/benchmark"
+    create_folder_structure()
+    raw_size = None
+    try:
+        for fmt in COMPRESSION_EXTENSIONS:
+            os.environ["POLYOMINO_COMPRESSION"] = fmt
+            file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+
+            start = perf_counter()
+            poly_class.save_to_file(collinearity, Ancestor, n, k, ancestors)
+            write_time = perf_counter() - start
+
+            start = perf_counter()
+            load_ancestors_nk(poly_class, collinearity, n, k)
+            read_time = perf_counter() - start
+
+            size = os.path.getsize(file_path)
+            if raw_size is None:
+                raw_size = size
+            rate = len(ancestors) / read_time if read_time else 0
+            print(
+                f"{fmt:10s}{size:16d}{raw_size / size:9.2f}{write_time:13.3f}{read_time:12.3f}{rate:10.0f}"
+            )
+            os.remove(file_path)
+    finally:
+        os.environ["POLYOMINO_DATA_FOLDER"] = data_folder
+        os.environ["POLYOMINO_COMPRESSION"] = compression
+        if silent is None:
+            del os.environ["POLYOMINO_SILENT"]
+        else:
+            os.environ["POLYOMINO_SILENT"] = silent
+
+    print()
+
+
+def benchmark_compact_ids(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Compare the file size and read time of an ancestor file with standard
+    and compact ids, uncompressed and with gzip. Reading compact ids includes
+    expanding them back, as a loaded level always holds the standard ids.
+    Copies of the level are written to a benchmark folder within the current
+    data folder"""
+    data_folder = os.environ.get("POLYOMINO_DATA_FOLDER", "data")
+    compression = os.environ.get("POLYOMINO_COMPRESSION", "none")
+    compact_ids = os.environ.get("POLYOMINO_COMPACT_IDS")
+    silent = os.environ.get("POLYOMINO_SILENT")
+    os.environ["POLYOMINO_SILENT"] = "1"
+
+    ancestors = load_ancestors_nk(poly_class, collinearity, n, k)
+
+    print()
+    print(
+        f"Compact ids of {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k} rows={len(ancestors)}"
+    )
+    print()
+    print("Format    Ids           Size (bytes)    Ratio    Read (s)    Rows/s")
+    print("-" * 70)
+
+    os.environ["POLYOMINO_DATA_FOLDER"] = f"{data_folder}/benchmark"
+    create_folder_structure()
+    try:
+        for fmt in ("none", "gzip"):
+            os.environ["POLYOMINO_COMPRESSION"] = fmt
+            file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+            standard_size = None
+            for ids in ("standard", "compact"):
+                os.environ["POLYOMINO_COMPACT_IDS"] = "1" if ids == "compact" else ""
+                poly_class.save_to_file(collinearity, Ancestor, n, k, ancestors)
+
+                start = perf_counter()
+                loaded = load_ancestors_nk(poly_class, collinearity, n, k)
+                read_time = perf_counter() - start
+                if loaded != ancestors:
+                    raise RuntimeError(f"The {ids} ids did not read back the same")
+
+                size = os.path.getsize(file_path)
+                if standard_size is None:
+                    standard_size = size
+                rate = len(ancestors) / read_time if read_time else 0
+                print(
+                    f"{fmt:10s}{ids:10s}{size:16d}{standard_size / size:9.2f}{read_time:12.3f}{rate:10.0f}"
+                )
+                os.remove(file_path)
+    finally:
+        os.environ["POLYOMINO_DATA_FOLDER"] = data_folder
+        os.environ["POLYOMINO_COMPRESSION"] = compression
+        if compact_ids is None:
+            os.environ.pop("POLYOMINO_COMPACT_IDS", None)
+        else:
+            os.environ["POLYOMINO_COMPACT_IDS"] = compact_ids
+        if silent is None:
+            del os.environ["POLYOMINO_SILENT"]
+        else:
+            os.environ["POLYOMINO_SILENT"] = silent
+
+    print()
+
+
+def benchmark_import_time(modules=("classes", "generation", "reporting", "plotting")):
+    """Report the cumulative import time of each module in a fresh interpreter
+    and whether the plotting libraries were pulled in with it"""
+    src_path = os.path.dirname(os.path.abspath(__file__))
+
+    print()
+    print("Module          Import (ms)    matplotlib    numpy")
+    print("-" * 50)
+    for module in modules:
+        code = (
+            f"import {module}, sys; "
+            "print('matplotlib' in sys.modules, 'numpy' in sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=src_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # the last line of the import time report is the module itself
+        # in the form: import time: self [us] | cumulative | imported package
+        own_line = [
+            line
+            for line in result.stderr.splitlines()
+            if line.rstrip().endswith(f" {module}")
+        ][-1]
+        cumulative = int(own_line.split("|")[1]) / 1000
+        matplotlib_loaded, numpy_loaded = result.stdout.split()
+        print(
+            f"{module:14s}{cumulative:13.1f}{matplotlib_loaded:>14s}{numpy_loaded:>9s}"
+        )
+
+    print()
+
+
+def benchmark_canonicalisation(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Time finding the id of every child of P(n,k), through the generic
+    classmethods and through the compiled shape kernel"""
+    patterns = load_polyomino_patterns_nk(poly_class, collinearity, n, k, silent=True)
+    kernel = poly_class.kernel()
+    children = [
+        (pattern | {np}, np)
+        for pattern in patterns.values()
+        for np in kernel.to_native(kernel.border(kernel.to_internal(pattern)))
+    ]
+
+    print()
+    print(
+        f"Canonicalisation of {len(children)} children of {poly_class.file_name} {collinearity.file_name} n={n} k={k}"
+    )
+    print()
+    print("Path            Time (s)    Children/s")
+    print("-" * 38)
+    for name, get_pattern_id in (
+        ("generic", poly_class.get_pattern_id_generic),
+        ("kernel", poly_class.get_pattern_id),
+    ):
+        start = perf_counter()
+        for child, np in children:
+            get_pattern_id(child, np)
+        elapsed = perf_counter() - start
+        print(f"{name:10s}{elapsed:14.3f}{len(children) / elapsed:14.0f}")
+
+    print()
+
+
+def benchmark_internal_coordinates(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Time expanding every parent of n,k with the kernel working in the shape's
+    own coordinates and in its internal ones (axial rather than cube for the hexagon)"""
+    same, prev = load_parents_nk(poly_class, collinearity, n, k, silent=True)
+
+    print()
+    print(
+        f"Expansion of {len(prev)} parents of {poly_class.file_name} {collinearity.file_name} n={n} k={k}"
+    )
+    print()
+    print("Coordinates     Time (s)     Parents/s")
+    print("-" * 38)
+    for name, kernel in (
+        ("native", ShapeKernel(poly_class, native=True)),
+        ("internal", poly_class.kernel()),
+    ):
+        cache = PatternIdCache()
+        start = perf_counter()
+        for id, pattern in prev.items():
+            expand_parent(
+                kernel,
+                collinearity,
+                k,
+                kernel.to_internal(pattern),
+                id in same,
+                cache,
+            )
+        elapsed = perf_counter() - start
+        print(f"{name:10s}{elapsed:14.3f}{len(prev) / elapsed:14.0f}")
+
+    print()
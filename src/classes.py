@@ -1,15 +1,30 @@
 """Classes and supporting functions"""
 
+import gzip
+import json
+import lzma
 import os
-from matplotlib.collections import LineCollection
-import matplotlib.pyplot as plt
-from numpy.linalg import matrix_rank
-from matplotlib.patches import RegularPolygon
-from math import radians, sin, sqrt
+import re
+from collections import Counter, OrderedDict, defaultdict
+from hashlib import blake2b
+from math import gcd, radians, sin, sqrt
 from operator import add, sub
 from utils import draw_pattern, get_pattern_limits, scalar_multiply
 
 ENCODING_SEPARATOR = "-"
+
+# in the header of files whose ids are written in their compact form
+# (see PolyShape.compact_id), used for new files when POLYOMINO_COMPACT_IDS is set.
+# The compact form is only on disk, ids are expanded as they are read
+COMPACT_ID_FORMAT = "compact"
+
+# file extensions for the supported stream compression formats
+# the format used for new files is set by POLYOMINO_COMPRESSION
+COMPRESSION_EXTENSIONS = {
+    "none": "",
+    "gzip": ".gz",
+    "lzma": ".xz",
+}
 R3O2 = sin(radians(60))
 ROOT2 = sqrt(2)
 
@@ -50,27 +65,95 @@ def row_decode(v: int) -> list:
     return cols
 
 
+def compact_row(v: int, parity: int) -> int:
+    """Return a row mask with the bits of the other parity, which must be 0, taken out.
+    For example with parity 1
+    @ @  : 10 = 1010 -> 11 = 3"""
+    b = bin(v >> parity)[2:]
+    if v & ~(int("01" * (len(b) // 2 + 1), 2) << parity):
+        raise RuntimeError(f"Row mask {v} has bits of the other parity")
+    return int(b[(len(b) - 1) % 2 :: 2], 2)
+
+
+def expand_row(v: int, parity: int) -> int:
+    """Return the row mask of a compact one, the reverse of compact_row"""
+    return int("0".join(bin(v)[2:]), 2) << parity
+
+
+# the rows of compact ids expanded so far, for even and odd rows
+EXPANDED_ROWS = ({}, {})
+
+
+def is_compact(meta: str) -> bool:
+    """Return True if the header row says the ids are in their compact form"""
+    return meta.split(",")[-2] == COMPACT_ID_FORMAT
+
+
+def record_hash(record: str) -> int:
+    """Return the 128 bit hash of a record of a level digest"""
+    return int.from_bytes(blake2b(record.encode(), digest_size=16).digest(), "big")
+
+
+def get_digest_path(file_path: str) -> str:
+    """Return the path of the digest of a level file, whatever its compression"""
+    return file_path[: file_path.rindex(".txt")] + ".digest"
+
+
+def get_file_stat(file_path: str) -> list:
+    """Return the size and modification time of a file, which change
+    whenever the file is written again"""
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
 def translate_points(points, vector):
     """Translate all point by the given vector"""
     return tuple(tuple(map(add, p, vector)) for p in points)
 
 
-def are_parallel(*point_list):
-    """Return True if points are collinear"""
-    r = matrix_rank(point_list)
-    return r <= 1
+def get_compression_extension() -> str:
+    """Return the file extension for the configured compression format"""
+    compression = os.environ.get("POLYOMINO_COMPRESSION", "none").lower()
+    try:
+        return COMPRESSION_EXTENSIONS[compression]
+    except KeyError:
+        raise RuntimeError(
+            f"Unknown compression {compression}, expected one of {', '.join(COMPRESSION_EXTENSIONS)}"
+        )
+
+
+def open_data_file(file_path, mode="r"):
+    """Open a data file in text mode, compressed or not depending on the extension.
+    Compressed files are streamed so reading never holds the whole file in memory"""
+    if file_path.endswith(COMPRESSION_EXTENSIONS["gzip"]):
+        return gzip.open(file_path, mode + "t")
+    if file_path.endswith(COMPRESSION_EXTENSIONS["lzma"]):
+        return lzma.open(file_path, mode + "t")
+    return open(file_path, mode)
 
 
 def get_row_count(line):
-    """The header row contains Shape, CollinearityType, n, k and row count"""
+    """The header row contains Shape, CollinearityType, n, k and row count,
+    with "compact" before the row count when the ids are compact"""
     meta = line.split(",")
     row_count = meta[-1]
     row_count = int(row_count)
     return row_count
 
 
-def create_folder_structure():
+def get_data_folder() -> str:
+    """Return the data folder set by POLYOMINO_DATA_FOLDER. Levels restricted to a
+    region (see get_region) are kept in a folder of their own within it,
+    region_5x7 for example"""
     data_folder = os.environ.get("POLYOMINO_DATA_FOLDER", "data")
+    region = get_region()
+    if region is not None:
+        data_folder = f"{data_folder}/region_{region.name}"
+    return data_folder
+
+
+def create_folder_structure():
+    data_folder = get_data_folder()
     src_path = os.path.dirname(__file__)
 
     file_path = os.path.join(
@@ -110,50 +193,131 @@ class CollinearityType:
     file_name = "no_collinearity_type"
 
     @staticmethod
-    def get_maximum_collinear(points, new_point, dimensions: int) -> int:
-        """Returns the most number of collinear points going through the new point"""
+    def get_maximum_collinear(
+        points, new_point, dimensions: int, limit=None, forms=None
+    ) -> int:
+        """Returns the most number of collinear points going through the new point.
+        Given a limit, counting stops as soon as it is passed and the count
+        at that point (limit + 1) is returned.
+        Points not in the shape's own coordinates come with the linear forms
+        giving the shape's coordinates from them (see ShapeKernel)"""
         return 0
 
+    @classmethod
+    def get_pattern_collinear(cls, pattern, dimensions: int, forms=None) -> int:
+        """Returns the most number of collinear points anywhere in the pattern"""
+        return max(
+            cls.get_maximum_collinear(pattern, p, dimensions, forms=forms)
+            for p in pattern
+        )
+
 
 class Lattice(CollinearityType):
     file_name = "lattice"
 
     @staticmethod
-    def get_maximum_collinear(pattern, new_point, dimensions: int) -> int:
+    def get_maximum_collinear(
+        pattern, new_point, dimensions: int, limit=None, forms=None
+    ) -> int:
         """Returns the most number of collinear points going through the new point"""
         max_collinear = 0
+        if forms is not None:
+            # lattice lines are where a form (one of the shape's coordinates) is constant
+            for form in forms:
+                if len(form) == 2:
+                    a, b = form
+                    target = a * new_point[0] + b * new_point[1]
+                    values = (a * x + b * y for x, y in pattern)
+                else:
+                    target = sum(f * x for f, x in zip(form, new_point))
+                    values = (sum(f * x for f, x in zip(form, p)) for p in pattern)
+                collinear_count = 0
+                for value in values:
+                    if value == target:
+                        collinear_count += 1
+                        if limit is not None and collinear_count > limit:
+                            return collinear_count
+                max_collinear = max(collinear_count, max_collinear)
+            return max_collinear
+
         for d in range(dimensions):
-            collinear_count = len([p for p in pattern if p[d] == new_point[d]])
+            collinear_count = 0
+            for p in pattern:
+                if p[d] == new_point[d]:
+                    collinear_count += 1
+                    if limit is not None and collinear_count > limit:
+                        return collinear_count
             max_collinear = max(collinear_count, max_collinear)
         return max_collinear
 
+    @staticmethod
+    def get_pattern_collinear(pattern, dimensions: int, forms=None) -> int:
+        """Returns the most number of collinear points anywhere in the pattern,
+        counting the points on each lattice line once"""
+        if forms is None:
+            forms = [
+                tuple(int(i == d) for i in range(dimensions)) for d in range(dimensions)
+            ]
+        return max(
+            max(Counter(sum(f * x for f, x in zip(form, p)) for p in pattern).values())
+            for form in forms
+        )
+
 
 class Plane(CollinearityType):
     file_name = "plane"
 
     @staticmethod
-    def get_maximum_collinear(pattern, new_point, dimensions: int) -> int:
-        """Returns the most number of collinear points going through the new point"""
-
-        # for a given pattern create a list of vectors from the new point
-        # to every other point in the pattern
-        vectors = [tuple(map(sub, p, new_point)) for p in pattern if p != new_point]
-
-        # build a dict of sets, each set is a set of parallel vectors
-        orthogonal = {}
-        for v in vectors:
-            new_value = True
-            for o in orthogonal:
-                if are_parallel(v, o):
-                    orthogonal[o].add(v)
-                    new_value = False
+    def get_maximum_collinear(
+        pattern, new_point, dimensions: int, limit=None, forms=None
+    ) -> int:
+        """Returns the most number of collinear points going through the new point.
+        Lines in the plane are the same whatever basis the lattice points are
+        given in so the forms are not needed"""
+
+        # for a given pattern take the vector from the new point to every
+        # other point in the pattern and reduce it to a direction, being the
+        # smallest integer vector pointing either way along the same line
+        # i.e. parallel vectors have the same direction
+        lines = defaultdict(int)
+        max_collinear = 1
+        for p in pattern:
+            if p == new_point:
+                continue
+            v = tuple(map(sub, p, new_point))
+            divisor = gcd(*v)
+            if next(x for x in v if x) < 0:
+                divisor = -divisor
+            direction = tuple(x // divisor for x in v)
+            lines[direction] += 1
+
+            # we add 1 to include the new point
+            collinear_count = lines[direction] + 1
+            if collinear_count > max_collinear:
+                max_collinear = collinear_count
+                if limit is not None and max_collinear > limit:
                     break
-            if new_value:
-                orthogonal[v] = {v}
 
-        # the largest set gives the longest collinearity through the new point
-        # we add 1 to include the new point
-        return max([len(line) for line in orthogonal.values()]) + 1
+        return max_collinear
+
+    @staticmethod
+    def get_pattern_collinear(pattern, dimensions: int, forms=None) -> int:
+        """Returns the most number of collinear points anywhere in the pattern.
+        A line is counted in full from the first of its points, so only the
+        points after each one are needed"""
+        points = list(pattern)
+        max_collinear = 1
+        for i, new_point in enumerate(points):
+            lines = defaultdict(int)
+            for p in points[i + 1 :]:
+                v = tuple(map(sub, p, new_point))
+                divisor = gcd(*v)
+                if next(x for x in v if x) < 0:
+                    divisor = -divisor
+                lines[tuple(x // divisor for x in v)] += 1
+            if lines:
+                max_collinear = max(max(lines.values()) + 1, max_collinear)
+        return max_collinear
 
 
 class DataType:
@@ -167,6 +331,11 @@ class DataType:
     def data_to_line(id: str, line_data: str) -> str:
         pass
 
+    @staticmethod
+    def map_ids(id: str, line_data, f) -> tuple:
+        """Return the row with its ids mapped by f"""
+        return f(id), line_data
+
 
 class Identifier(DataType):
     file_name = "ancestor"
@@ -178,6 +347,11 @@ class Identifier(DataType):
         id = arr[0]
         return id, encoding_str_to_tuple(id)
 
+    @staticmethod
+    def map_ids(id: str, line_data, f) -> tuple:
+        id = f(id)
+        return id, encoding_str_to_tuple(id)
+
 
 class Ancestor(DataType):
     file_name = "ancestor"
@@ -210,6 +384,486 @@ class Ancestor(DataType):
             ]
         )
 
+    @staticmethod
+    def map_ids(id: str, line_data, f) -> tuple:
+        return f(id), {f(a_id): rp for a_id, rp in line_data.items()}
+
+
+def matrix_multiply(a, b) -> tuple:
+    """Return the product of two integer matrices given as tuples of rows"""
+    return tuple(
+        tuple(sum(x * y for x, y in zip(row, col)) for col in zip(*b)) for row in a
+    )
+
+
+def point_map(matrix):
+    """Return a function mapping a sequence of points by an integer matrix.
+    The common shapes of matrix get an unrolled version"""
+    if len(matrix) == 2 and len(matrix[0]) == 2:
+        (a, b), (c, d) = matrix
+        return lambda points: [(a * x + b * y, c * x + d * y) for x, y in points]
+    if len(matrix) == 2 and len(matrix[0]) == 3:
+        (a, b, c), (d, e, f) = matrix
+        return lambda points: [
+            (a * x + b * y + c * z, d * x + e * y + f * z) for x, y, z in points
+        ]
+    return lambda points: [
+        tuple(sum(m * x for m, x in zip(row, p)) for row in matrix) for p in points
+    ]
+
+
+class ShapeKernel:
+    """Lookup tables compiled once for a shape so the hot paths of generation
+    do not go through the generic classmethods on every call.
+
+    The tables are derived from the shape's own vectors, rotate_point, flip_point,
+    point_to_doubled and point_to_internal, which are all linear, so a new shape
+    gets them for free. Each symmetry is held as an integer matrix and combined
+    with the conversion to the doubled row/col frame, so a pattern is encoded in
+    each orientation with a single mapping of its points.
+
+    Patterns given to the kernel are in the shape's internal coordinates (see
+    PolyShape.point_to_internal), for the hexagon that is 2D axial rather than
+    3D cube coordinates. Removal points and preferred patterns come back in the
+    shape's own coordinates as they are written to file. Building with native=True
+    keeps the shape's own coordinates throughout, which is mostly for comparison"""
+
+    def __init__(self, poly_class, native=False):
+        self.poly_class = poly_class
+        self.skew = poly_class.doubled_skew
+
+        def basis(dimensions):
+            return [
+                tuple(int(i == j) for j in range(dimensions))
+                for i in range(dimensions)
+            ]
+
+        def to_matrix(f, dimensions) -> tuple:
+            images = [f(b) for b in basis(dimensions)]
+            return tuple(zip(*images))
+
+        def symmetry(flip, rotations):
+            def f(p):
+                if flip:
+                    p = poly_class.flip_point(p)
+                for _ in range(rotations):
+                    p = poly_class.rotate_point(p)
+                return p
+
+            return f
+
+        # conversions between the shape's points and the internal coordinates
+        point_dimensions = poly_class.dimensions
+        if native:
+            self.dimensions = point_dimensions
+            self.from_internal = tuple(basis(point_dimensions))
+            self.to_internal_matrix = self.from_internal
+        else:
+            self.dimensions = len(poly_class.point_to_internal(poly_class.origin))
+            self.from_internal = to_matrix(
+                poly_class.internal_to_point, self.dimensions
+            )
+            self.to_internal_matrix = to_matrix(
+                poly_class.point_to_internal, point_dimensions
+            )
+        self.native = self.dimensions == point_dimensions
+        self.point_to_internal = point_map(self.to_internal_matrix)
+        self.internal_to_point = point_map(self.from_internal)
+
+        def internal(m):
+            return matrix_multiply(
+                self.to_internal_matrix, matrix_multiply(m, self.from_internal)
+            )
+
+        self.vectors = tuple(self.point_to_internal(poly_class.vectors))
+
+        # lines of the lattice are where one of the shape's coordinates is constant
+        self.lattice_forms = None if self.native else self.from_internal
+
+        # in the same order as generate_dihedral_symmetries visits them
+        # so the same orientation is preferred when encodings are equal
+        self.symmetries = tuple(
+            internal(to_matrix(symmetry(flip, rotations), point_dimensions))
+            for flip in (False, True)
+            for rotations in range(poly_class.symmetry)
+        )
+        self.to_doubled = matrix_multiply(
+            to_matrix(poly_class.point_to_doubled, point_dimensions),
+            self.from_internal,
+        )
+        self.doubled_symmetries = tuple(
+            matrix_multiply(self.to_doubled, m) for m in self.symmetries
+        )
+        self.doubled_maps = tuple(point_map(m) for m in self.doubled_symmetries)
+        self.symmetry_maps = tuple(point_map(m) for m in self.symmetries)
+
+        # back from doubled to internal, twice over as the doubled frame of
+        # the hexagon only has a point at every other position
+        self.from_doubled_2 = tuple(
+            zip(
+                *(
+                    self.point_to_internal((poly_class.doubled_to_point(d),))[0]
+                    for d in ((2, 0), (0, 2))
+                )
+            )
+        )
+        self.doubled_to_internal_2 = point_map(self.from_doubled_2)
+
+        self.check()
+
+    def check(self):
+        """Make sure the tables agree with the generic classmethods"""
+        origin = self.poly_class.origin
+        pattern = {origin}
+        for v in self.poly_class.vectors[:-1]:
+            pattern.add(tuple(v))
+            pattern.add(tuple(map(add, v, self.poly_class.vectors[0])))
+        pattern = frozenset(pattern)
+        ref = tuple(self.poly_class.vectors[1])
+        fast = self.get_pattern_id(
+            self.to_internal(pattern), self.point_to_internal((ref,))[0]
+        )
+        generic = self.poly_class.get_pattern_id_generic(pattern, ref)
+        if fast[:2] != generic[:2]:
+            raise RuntimeError(
+                f"Shape kernel for {self.poly_class.file_name} does not match, check doubled_skew"
+            )
+        if self.to_native(self.to_internal(pattern)) != pattern:
+            raise RuntimeError(
+                f"Shape kernel for {self.poly_class.file_name} does not match, check point_to_internal"
+            )
+
+    def to_internal(self, pattern) -> frozenset:
+        """Return the shape's points in internal coordinates"""
+        if self.native:
+            return frozenset(pattern)
+        return frozenset(self.point_to_internal(pattern))
+
+    def to_native(self, pattern) -> frozenset:
+        """Return internal points as the shape's own points"""
+        if self.native:
+            return frozenset(pattern)
+        return frozenset(self.internal_to_point(pattern))
+
+    def doubled_to_internal(self, points) -> list:
+        """Return doubled row/col points in internal coordinates"""
+        points = self.doubled_to_internal_2(points)
+        if self.dimensions == 2:
+            return [(x // 2, y // 2) for x, y in points]
+        return [tuple(v // 2 for v in p) for p in points]
+
+    def decoder(self, encoding) -> frozenset:
+        """Return the pattern of an encoding in internal coordinates"""
+        doubled = [(ri, c) for ri, v in enumerate(encoding) for c in row_decode(v)]
+        return frozenset(self.doubled_to_internal(doubled))
+
+    def get_maximum_collinear(
+        self, collinearity: CollinearityType, pattern, new_point, limit=None
+    ) -> int:
+        """Same as the collinearity's get_maximum_collinear for internal points"""
+        return collinearity.get_maximum_collinear(
+            pattern, new_point, self.dimensions, limit, self.lattice_forms
+        )
+
+    def get_pattern_collinear(self, collinearity: CollinearityType, pattern) -> int:
+        """Same as the collinearity's get_pattern_collinear for internal points"""
+        return collinearity.get_pattern_collinear(
+            pattern, self.dimensions, self.lattice_forms
+        )
+
+    def native_pattern(self, pattern) -> frozenset:
+        """Return internal points as the shape's own points. A pattern where its id
+        decodes to comes back built as PolyShape.decoder builds it, so iterating
+        over it goes in the same order as over the pattern loaded from file"""
+        if self.native:
+            return pattern
+        encoding, min_r, min_c = self.encode_doubled(self.doubled_maps[0](pattern))
+        if min_r or min_c:
+            return self.to_native(pattern)
+        return self.poly_class.decoder(encoding)
+
+    def border(self, pattern):
+        """Return the cells adjacent to the pattern in the order walking the pattern
+        in the shape's own points finds them. The last cell giving a child decides
+        its removal point and the first the order of the children, so this keeps
+        the files the same as generating in the shape's own points"""
+        if not self.native:
+            native = self.native_pattern(pattern)
+            border = set()
+            for p in native:
+                for v in self.poly_class.vectors:
+                    np = tuple(map(add, p, v))
+                    if np in native:
+                        continue
+                    border.add(np)
+            return self.point_to_internal(border)
+
+        vectors = self.vectors
+        border = set()
+        if self.dimensions == 2:
+            for x, y in pattern:
+                for dx, dy in vectors:
+                    np = x + dx, y + dy
+                    if np in pattern:
+                        continue
+                    border.add(np)
+        else:
+            for p in pattern:
+                for v in vectors:
+                    np = tuple(map(add, p, v))
+                    if np in pattern:
+                        continue
+                    border.add(np)
+        return border
+
+    def encode_doubled(self, points):
+        """Return the encoding of doubled points as they lie along with the
+        row/col offset taken off to normalise their position"""
+        skew = self.skew
+
+        # normalise the position, rows from 0 and col - skew * row from 0
+        min_r = min(r for r, _ in points)
+        max_r = max(r for r, _ in points)
+        min_c = min(c - skew * r for r, c in points) + skew * min_r
+
+        masks = [0] * (max_r - min_r + 1)
+        for r, c in points:
+            masks[r - min_r] |= 1 << (c - min_c)
+        return tuple(masks), min_r, min_c
+
+    def preferred_orientation(self, pattern):
+        """Return the preferred encoding of the pattern, the index of the symmetry
+        giving it, the points in that orientation and the offset that normalised them"""
+        encode_doubled = self.encode_doubled
+        pref_encoding = (0,)
+        for sym, doubled_map in enumerate(self.doubled_maps):
+            points = doubled_map(pattern)
+            encoding, min_r, min_c = encode_doubled(points)
+            if encoding > pref_encoding:
+                pref_encoding = encoding
+                pref = sym, points, min_r, min_c
+        return (pref_encoding,) + pref
+
+    def automorphisms(self, pattern) -> list:
+        """Return the symmetries that map the pattern on to itself (the identity
+        always being one) as the point map of the symmetry and the translation
+        that brings the mapped pattern back on to the pattern.
+
+        The sum of the points is mapped with them so the translation is known
+        before mapping any point, and most patterns fail on the first point"""
+        n = len(pattern)
+        total = tuple(map(sum, zip(*pattern)))
+        automorphisms = []
+        for symmetry_map in self.symmetry_maps:
+            moved = symmetry_map((total,))[0]
+            shift = []
+            for m, t in zip(moved, total):
+                d, rem = divmod(m - t, n)
+                if rem:
+                    break
+                shift.append(d)
+            else:
+                shift = tuple(shift)
+                if all(
+                    tuple(map(sub, p, shift)) in pattern
+                    for p in symmetry_map(pattern)
+                ):
+                    automorphisms.append((symmetry_map, shift))
+        return automorphisms
+
+    def border_orbits(self, pattern) -> list:
+        """Return the border of the pattern grouped in to orbits under its
+        automorphisms, every cell of an orbit giving the same child. Each orbit is a
+        list of (position in the border, cell) and they are in the order of their
+        first cell, so walking them visits the children as walking the border would"""
+        border = enumerate(self.border(pattern))
+        automorphisms = self.automorphisms(pattern)
+        if len(automorphisms) == 1:
+            return [[cell] for cell in border]
+
+        # the cells of an orbit all have the same images, the smallest is the key
+        orbits = {}
+        for position, np in border:
+            key = min(
+                tuple(map(sub, symmetry_map((np,))[0], shift))
+                for symmetry_map, shift in automorphisms
+            )
+            orbits.setdefault(key, []).append((position, np))
+        return list(orbits.values())
+
+    def get_pattern_id(self, pattern, ref):
+        """Same as PolyShape.get_pattern_id using the compiled tables"""
+        encoding, sym, points, min_r, min_c = self.preferred_orientation(pattern)
+
+        # only the preferred orientation is converted back to the shape's points
+        doubled_to_point = self.poly_class.doubled_to_point
+        ref_r, ref_c = self.doubled_maps[sym]((ref,))[0]
+        removal_point = doubled_to_point((ref_r - min_r, ref_c - min_c))
+        pref_pattern = tuple(
+            doubled_to_point((r - min_r, c - min_c)) for r, c in points
+        )
+
+        return (
+            ENCODING_SEPARATOR.join(str(v) for v in encoding),
+            removal_point,
+            pref_pattern,
+        )
+
+    def get_pattern_id_cached(self, pattern, ref, cache: "PatternIdCache"):
+        """Return the id and removal point as get_pattern_id does, remembering the
+        result against the pattern's fixed form i.e. its encoding as it lies.
+        The same fixed polyomino is often reached from several parents and then
+        only the removal point needs to be worked out.
+
+        The preferred pattern is not returned, it can be decoded from the id"""
+        doubled_to_point = self.poly_class.doubled_to_point
+
+        # the translation that moves the pattern to its normalised fixed position
+        fixed, min_r, min_c = self.encode_doubled(self.doubled_maps[0](pattern))
+        v = self.doubled_to_internal(((-min_r, -min_c),))[0]
+
+        cached = cache.get(fixed)
+        if cached is None:
+            encoding, sym, _, min_r, min_c = self.preferred_orientation(pattern)
+            # offset for the preferred orientation of the fixed position
+            v_r, v_c = self.doubled_maps[sym]((v,))[0]
+            cached = (
+                ENCODING_SEPARATOR.join(str(x) for x in encoding),
+                sym,
+                min_r + v_r,
+                min_c + v_c,
+            )
+            cache.put(fixed, cached)
+
+        id, sym, min_r, min_c = cached
+        ref_r, ref_c = self.doubled_maps[sym]((tuple(map(add, ref, v)),))[0]
+        removal_point = doubled_to_point((ref_r - min_r, ref_c - min_c))
+        return id, removal_point
+
+
+class LevelDigest:
+    """Digests of the ids and the edges of a level that do not depend on the order
+    of its rows, each the sum of the 128 bit hashes of its records, taken as the
+    level is written. An edge is a child and parent, the removal point is left
+    out as any cell of the child giving the parent would do"""
+
+    def __init__(self):
+        self.rows = 0
+        self.ids = 0
+        self.edges = 0
+
+    def add(self, id: str, parents=()):
+        """Add a row of the level, its id in the standard form"""
+        self.rows += 1
+        self.ids += record_hash(id)
+        for parent in parents:
+            self.edges += record_hash(f"{id}<{parent}")
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "ids": f"{self.ids % (1 << 128):032x}",
+            "edges": f"{self.edges % (1 << 128):032x}",
+        }
+
+    @classmethod
+    def from_rows(cls, rows, file_type: DataType = Ancestor) -> "LevelDigest":
+        """Return the digest of a level given the id and data of each row"""
+        digest = cls()
+        for id, line_data in rows:
+            digest.add(id, line_data if file_type is Ancestor else ())
+        return digest
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "LevelDigest":
+        """Return the digest of a level worked out from its file"""
+        digest = cls()
+        with open_data_file(file_path, "r") as file_obj:
+            meta = file_obj.readline()
+            expand_id = get_class(meta.split(",")[0]).expand_id
+            for line in file_obj:
+                id, parents = Ancestor.line_to_data(line.strip())
+                if is_compact(meta):
+                    id, parents = Ancestor.map_ids(id, parents, expand_id)
+                digest.add(id, parents)
+        return digest
+
+    def save(self, file_path: str):
+        """Save the digest of a level file alongside it, with the size and
+        modification time of the file so a digest left behind by the file being
+        replaced is noticed"""
+        record = dict(self.to_dict(), file=get_file_stat(file_path))
+        with open(get_digest_path(file_path), "w") as file_obj:
+            json.dump(record, file_obj)
+
+
+def get_file_digest(file_path: str) -> dict:
+    """Return the digest of a level file (see LevelDigest), working it out from
+    the file and saving it when there is no digest for the file as it is"""
+    try:
+        with open(get_digest_path(file_path), "r") as file_obj:
+            record = json.load(file_obj)
+        if record.pop("file", None) == get_file_stat(file_path):
+            return record
+    except FileNotFoundError:
+        pass
+    digest = LevelDigest.from_file(file_path)
+    digest.save(file_path)
+    return digest.to_dict()
+
+
+class PatternIdCache:
+    """A bounded cache of pattern ids for ShapeKernel.get_pattern_id_cached.
+    The size and eviction policy (lru or fifo) default to the settings
+    POLYOMINO_CACHE_SIZE and POLYOMINO_CACHE_POLICY, a size of 0 turns it off"""
+
+    def __init__(self, size=None, policy=None):
+        if size is None:
+            size = int(os.environ.get("POLYOMINO_CACHE_SIZE", 1_000_000))
+        if policy is None:
+            policy = os.environ.get("POLYOMINO_CACHE_POLICY", "lru").lower()
+        if policy not in ("lru", "fifo"):
+            raise RuntimeError(f"Unknown cache policy {policy}, expected lru or fifo")
+        self.size = size
+        self.lru = policy == "lru"
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value or None"""
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.lru:
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Add the value, evicting the oldest (or least recently used) when full"""
+        if self.size <= 0:
+            return
+        self.data[key] = value
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        """Summary of how much canonicalisation the cache saved"""
+        return (
+            f"Pattern id cache hits={self.hits} misses={self.misses} "
+            f"hit rate={100 * self.hit_rate():.1f}% size={len(self.data)}"
+        )
+
+
+# compiled kernels keyed on shape class
+_kernels = {}
+
 
 def get_class(poly_type: str):
     """Return the class used for the type"""
@@ -221,6 +875,88 @@ def get_class(poly_type: str):
         return HexagonPoly
 
 
+def get_collinearity_class(collinearity_type: str):
+    """Return the class used for the collinearity type"""
+    if collinearity_type[0].upper() == "L":
+        return Lattice
+
+    if collinearity_type[0].upper() == "P":
+        return Plane
+
+
+class Region:
+    """A region of the lattice that polyominoes are to fit within in some orientation.
+    Any part of a polyomino that fits fits as well, so generating only the children
+    that fit gives every polyomino that does"""
+
+    # as given to POLYOMINO_REGION
+    name = "no_region"
+
+    def fits(self, kernel: ShapeKernel, pattern) -> bool:
+        return True
+
+
+class Window(Region):
+    """At most rows by columns as drawn on the console (see PolyShape.draw),
+    for hexagons the columns being half a cell wide"""
+
+    def __init__(self, rows: int, columns: int):
+        self.rows = rows
+        self.columns = columns
+        self.name = f"{rows}x{columns}"
+
+    def fits(self, kernel, pattern) -> bool:
+        # turning the pattern over does not change its extent,
+        # but every orientation is tried for simplicity
+        for doubled_map in kernel.doubled_maps:
+            min_r, min_c, max_r, max_c = get_pattern_limits(doubled_map(pattern))
+            if max_r - min_r < self.rows and max_c - min_c < self.columns:
+                return True
+        return False
+
+
+class HexagonRegion(Region):
+    """The cells within a radius of a hexagon cell, the same in every orientation"""
+
+    def __init__(self, radius: int):
+        self.radius = radius
+        self.name = f"hexagon{radius}"
+
+    def fits(self, kernel, pattern) -> bool:
+        if kernel.poly_class is not HexagonPoly:
+            raise RuntimeError(f"A hexagon region needs {HexagonPoly.file_name}")
+        # in cube coordinates the region is where each coordinate is within the
+        # radius of the centre's, so there has to be a centre summing to 0 that
+        # is within the radius of the least and the most of each coordinate
+        radius = self.radius
+        points = kernel.to_native(pattern)
+        lows = [min(p[d] for p in points) for d in range(3)]
+        highs = [max(p[d] for p in points) for d in range(3)]
+        return (
+            all(high - low <= 2 * radius for low, high in zip(lows, highs))
+            and sum(lows) >= -3 * radius
+            and sum(highs) <= 3 * radius
+        )
+
+
+def get_region():
+    """Return the region polyominoes are restricted to, set by POLYOMINO_REGION as
+    rows x columns (5x7) for a Window or hexagon and a radius (hexagon3) for a
+    HexagonRegion, or None when they are not restricted"""
+    region = os.environ.get("POLYOMINO_REGION", "").lower()
+    if not region:
+        return None
+    window = re.fullmatch(r"(\d+)x(\d+)", region)
+    if window:
+        return Window(int(window.group(1)), int(window.group(2)))
+    hexagon = re.fullmatch(r"hexagon(\d+)", region)
+    if hexagon:
+        return HexagonRegion(int(hexagon.group(1)))
+    raise RuntimeError(
+        f"Unknown region {region}, expected rows x columns (5x7) or hexagon and a radius (hexagon3)"
+    )
+
+
 class PolyShape:
 
     file_name = "no_shape"
@@ -229,72 +965,36 @@ class PolyShape:
     dimensions = 2
     symmetry = 1
 
+    # the encoding works in a doubled row/col frame where normalising puts
+    # the rows from 0 and the smallest (col - doubled_skew * row) at 0
+    doubled_skew = 0
+
+    # when only every other bit of a row can be set in the doubled frame, those of
+    # the same parity as the row, which the compact form of the ids leaves out
+    sparse_rows = False
+
     plot_orientation = 0
     plot_radius = 1
     plot_facecolor = "lightyellow"
 
     @classmethod
     def plot(cls, pattern, alt_cell=None, to_file=True, show_graph=True):
+        """Plot the pattern using matplotlib, see plotting.plot_pattern"""
+        from plotting import plot_pattern
 
-        marker_size = 10
-        id = None
-        if isinstance(pattern, str):
-            id = pattern
-        console_points = cls.pattern_to_points(pattern)
-
-        edges = None
-        if show_graph and id:
-            gph = cls.get_graph(id)
-            edges = cls.graph_to_plot(gph)
-            marker_size = 30
-
-        # adjustment from console row/col points
-        # to matplotlib x,y
-        plot_points = cls.console_to_plot(console_points)
-
-        # we need to scale the marker based on the
-        # physical space the polyomino takes up
-        min_r, min_c, max_r, max_c = get_pattern_limits(plot_points)
-        marker_scale = max((max_r - min_r), ((max_c - min_c)))
-        marker_scale = (marker_size / marker_scale) ** 2
-
-        fig, ax = plt.subplots(1)
-        ax.set_aspect("equal")
-        ax.axis("off")
-
-        # Add some coloured cells
-        for x, y in plot_points:
-            cell = RegularPolygon(
-                (x, y),
-                numVertices=cls.symmetry,
-                radius=cls.plot_radius,
-                orientation=cls.plot_orientation,
-                facecolor=cls.plot_facecolor,
-                alpha=0.5,
-                edgecolor="k",
-                zorder=0,
-            )
-            ax.add_patch(cell)
-
-        # Also add scatter points in cell centres
-        X = [p[0] for p in plot_points]
-        Y = [p[1] for p in plot_points]
-        ax.scatter(X, Y, c="k", s=marker_scale * 2, zorder=20)
+        plot_pattern(cls, pattern, to_file=to_file, show_graph=show_graph)
 
-        # optional graph
-        if edges:
-            lc = LineCollection(edges, linewidth=3, zorder=10)
-            ax.add_collection(lc)
-
-        if to_file and id:
-            fig.tight_layout()
-            plt.savefig(f"{cls.file_name} {id}.png")
-            return
+    @classmethod
+    def point_to_doubled(cls, p):
+        return p
 
-        plt.show()
+    @classmethod
+    def point_to_internal(cls, p):
+        """Return the point in the coordinates the kernel works in"""
+        return p
 
     @classmethod
-    def point_to_doubled(cls, p):
+    def internal_to_point(cls, p):
         return p
 
     @classmethod
@@ -359,8 +1059,26 @@ class PolyShape:
         ref = cls.flip_point(ref)
         yield from generate_rotations(points, ref)
 
+    @classmethod
+    def kernel(cls) -> ShapeKernel:
+        """Return the lookup tables for this shape, compiled on first use"""
+        kernel = _kernels.get(cls)
+        if kernel is None:
+            kernel = ShapeKernel(cls)
+            _kernels[cls] = kernel
+        return kernel
+
     @classmethod
     def get_pattern_id(cls, new_pattern: frozenset, ref):
+        """Given a pattern return its id, removal point and preferred pattern.
+        See get_pattern_id_generic, this is the same but using the compiled kernel"""
+        kernel = cls.kernel()
+        return kernel.get_pattern_id(
+            kernel.to_internal(new_pattern), kernel.point_to_internal((ref,))[0]
+        )
+
+    @classmethod
+    def get_pattern_id_generic(cls, new_pattern: frozenset, ref):
         """Given a pattern return its id.
         This is done by finding a preferred orientation and encoding the layout
         The preferred choice is arbitrary as long as its consistent and
@@ -410,6 +1128,39 @@ class PolyShape:
         points = cls.pattern_to_points(pattern)
         draw_pattern(points, pixel=pixel)
 
+    @classmethod
+    def compact_id(cls, id: str) -> str:
+        """Return the compact form of an id, only shorter for shapes with sparse rows.
+        Row by row the order of ids is kept so the preferred orientation is the same.
+        This is the form written to files, in memory the standard ids are the keys"""
+        if not cls.sparse_rows:
+            return id
+        return ENCODING_SEPARATOR.join(
+            str(compact_row(v, r % 2))
+            for r, v in enumerate(encoding_str_to_tuple(id))
+        )
+
+    @classmethod
+    def expand_id(cls, compact_id: str) -> str:
+        """Return the id of its compact form"""
+        if not cls.sparse_rows:
+            return compact_id
+        # the same few rows come up again and again so keep them by parity
+        rows = []
+        for r, row in enumerate(compact_id.split(ENCODING_SEPARATOR)):
+            expanded = EXPANDED_ROWS[r % 2]
+            if row not in expanded:
+                expanded[row] = str(expand_row(int(row), r % 2))
+            rows.append(expanded[row])
+        return ENCODING_SEPARATOR.join(rows)
+
+    @classmethod
+    def uses_compact_ids(cls) -> bool:
+        """Return True if new files are to be written with compact ids,
+        set by POLYOMINO_COMPACT_IDS for shapes with sparse rows. This makes the
+        files smaller but not the levels once loaded, which hold the standard ids"""
+        return cls.sparse_rows and bool(os.environ.get("POLYOMINO_COMPACT_IDS"))
+
     @classmethod
     def get_file_path(
         cls,
@@ -417,19 +1168,28 @@ class PolyShape:
         file_type: DataType,
         n: int,
         k: int,
+        extension=None,
     ) -> str:
-        """Returns a file path matching the inputs"""
-        data_folder = os.environ.get("POLYOMINO_DATA_FOLDER", "data")
-        file_name = f"{file_type.file_name}_{n:02d}_{k:02d}.txt"
+        """Returns a file path matching the inputs. Without an extension this is
+        the file as it exists, compressed or not, or if there is none the file
+        to be written as set by POLYOMINO_COMPRESSION"""
+        data_folder = get_data_folder()
         src_path = os.path.dirname(__file__)
-        file_path = os.path.join(
+        base_path = os.path.join(
             src_path,
             f"../{data_folder}",
             cls.file_name,
             collinearity.file_name,
-            file_name,
+            f"{file_type.file_name}_{n:02d}_{k:02d}.txt",
         )
-        return file_path
+        if extension is not None:
+            return base_path + extension
+        extension = get_compression_extension()
+        if not os.path.isfile(base_path + extension):
+            for other in COMPRESSION_EXTENSIONS.values():
+                if os.path.isfile(base_path + other):
+                    return base_path + other
+        return base_path + extension
 
     @classmethod
     def save_to_file(
@@ -441,20 +1201,38 @@ class PolyShape:
         rows,
     ):
         """Save rows to a file. The rows argument is assumed to be some sequence of strings.
-        The header row contains Shape, CollinearityType, n, k and row count"""
-        file_path = cls.get_file_path(collinearity, file_type, n, k)
-        with open(file_path, "w") as file_obj:
+        The header row contains Shape, CollinearityType, n, k and row count,
+        with "compact" before the row count when the ids are in their compact form.
+        The digest of the level (see LevelDigest) is saved alongside it and returned"""
+        extension = get_compression_extension()
+        file_path = cls.get_file_path(collinearity, file_type, n, k, extension)
+        compact = cls.uses_compact_ids()
+        with open_data_file(file_path, "w") as file_obj:
             meta = [
                 cls.file_name,
                 collinearity.file_name,
                 str(n),
                 str(k),
-                str(len(rows)),
             ]
+            if compact:
+                meta.append(COMPACT_ID_FORMAT)
+            meta.append(str(len(rows)))
             file_obj.write(",".join(meta) + "\n")
+            digest = LevelDigest()
             for id, line_data in rows.items():
+                digest.add(id, line_data if file_type is Ancestor else ())
+                if compact:
+                    id, line_data = file_type.map_ids(id, line_data, cls.compact_id)
                 line = file_type.data_to_line(id, line_data)
                 file_obj.write(line + "\n")
+        digest.save(file_path)
+        # so a copy written before with other compression is never read instead
+        for other in COMPRESSION_EXTENSIONS.values():
+            if other != extension:
+                other_path = cls.get_file_path(collinearity, file_type, n, k, other)
+                if os.path.isfile(other_path):
+                    os.remove(other_path)
+        return digest
 
     @classmethod
     def start_loading(
@@ -488,13 +1266,10 @@ class PolyShape:
 
     @classmethod
     def graph_to_plot(cls, gph) -> list:
-        edges = []
-        for u, es in gph.items():
-            u = cls.doubled_to_plot(cls.point_to_doubled(u))
-            for v in es:
-                v = cls.doubled_to_plot(cls.point_to_doubled(v))
-                edges.append((u, v))
-        return edges
+        """Return the graph edges as plot coordinates, see plotting.graph_to_plot"""
+        from plotting import graph_to_plot
+
+        return graph_to_plot(cls, gph)
 
 
 ####################################################################
@@ -572,6 +1347,8 @@ class HexagonPoly(PolyShape):
     ]
     dimensions = 3
     symmetry = 6
+    doubled_skew = 1
+    sparse_rows = True
 
     plot_radius = 2.0 / 3.0
     plot_facecolor = "lightgreen"
@@ -590,6 +1367,16 @@ class HexagonPoly(PolyShape):
     def point_to_doubled(cls, p):
         return p[1], p[0] - p[2]
 
+    @classmethod
+    def point_to_internal(cls, p):
+        """Axial coordinates, the cube coordinates without the last
+        which is always -x-y"""
+        return p[0], p[1]
+
+    @classmethod
+    def internal_to_point(cls, p):
+        return p[0], p[1], -p[0] - p[1]
+
     @classmethod
     def doubled_to_point(cls, d):
         if d == (0, 1):
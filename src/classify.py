@@ -0,0 +1,288 @@
+"""Classifying batches of polyominoes from elsewhere against the stored levels.
+
+Each polyomino is given in one of three forms, which can be mixed in the input
+
+    id              1-2-1 as in the ancestor files, in any orientation
+    coordinates     (0, 0, 0) (1, -1, 0) (1, 0, -1) in the shape's own points
+                    (cube coordinates for hexagons), all on one line
+    ASCII art       lines of @ and . (or space) as drawn by PolyShape.draw,
+                    ended by a blank line or a line in another form
+
+and comes out as a CSV row with the line it started on, its id in the preferred
+orientation, n, the Lattice and Plane k and whether it is in each of those
+datasets, blank when the level it would be in has not been created.
+
+The polyominoes are canonicalised and their collinearity found in chunks by a
+pool of worker processes, with the input read and the output written as they
+go so a batch of any size is streamed. Looking up whether a polyomino has been
+stored uses the adjacency index for the levels it covers as they are now
+(see adjacency.py), an indexed query for the SQLite storage and otherwise the
+ids of just the levels the batch needs, read once.
+
+Running from the command line, see --help
+
+python ./src/classify.py hexagon shapes.txt --output classified.csv --data-folder data
+"""
+
+import argparse
+import os
+import re
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from os import cpu_count
+from classes import (
+    CollinearityType,
+    Identifier,
+    Lattice,
+    Plane,
+    PolyShape,
+    encoding_str_to_tuple,
+    get_class,
+)
+from generation import is_connected
+from storage import SQLiteStorage, get_storage
+
+# polyominoes handed to a worker at a time
+CLASSIFY_CHUNK = 1000
+
+# chunks waiting for a worker, for each worker, so the input is read as it is needed
+CHUNKS_AHEAD = 2
+
+ID_PATTERN = re.compile(r"\d+(-\d+)*")
+INTEGER_PATTERN = re.compile(r"-?\d+")
+ART_CELLS = "@#Xx*Oo"
+ART_BLANKS = ". "
+
+CSV_HEADER = "line,id,n,lattice_k,plane_k,in_lattice,in_plane"
+
+
+def parse_coordinates(poly_class: PolyShape, line: str) -> frozenset:
+    """Return the points of a line of coordinates"""
+    values = [int(v) for v in INTEGER_PATTERN.findall(line)]
+    dimensions = len(poly_class.origin)
+    if not values or len(values) % dimensions:
+        raise RuntimeError(
+            f"Expected points of {dimensions} coordinates for {poly_class.file_name}"
+        )
+    return frozenset(
+        tuple(values[i : i + dimensions]) for i in range(0, len(values), dimensions)
+    )
+
+
+def parse_art(poly_class: PolyShape, lines: list) -> frozenset:
+    """Return the points of ASCII art, row and column as drawn to the console"""
+    doubled = {
+        (r, c)
+        for r, line in enumerate(lines)
+        for c, ch in enumerate(line)
+        if ch in ART_CELLS
+    }
+    if not doubled:
+        raise RuntimeError("Expected a cell drawn as one of " + ART_CELLS)
+    return frozenset(poly_class.doubled_to_points(doubled))
+
+
+def is_art(line: str) -> bool:
+    return all(ch in ART_CELLS or ch in ART_BLANKS for ch in line)
+
+
+def read_inputs(poly_class: PolyShape, lines):
+    """Yield the number of the line each polyomino starts on and its points"""
+    art = []
+    art_start = None
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if art and (not line.strip() or not is_art(line)):
+            yield art_start, parse_art(poly_class, art)
+            art = []
+        if not line.strip():
+            continue
+
+        try:
+            if ID_PATTERN.fullmatch(line.strip()):
+                # for shapes with sparse rows this checks the cells are in the frame
+                poly_class.compact_id(line.strip())
+                yield line_number, poly_class.decoder(
+                    encoding_str_to_tuple(line.strip())
+                )
+            elif is_art(line):
+                if not art:
+                    art_start = line_number
+                art.append(line)
+            else:
+                yield line_number, parse_coordinates(poly_class, line)
+        except RuntimeError as e:
+            raise RuntimeError(f"Line {line_number}: {e}")
+    if art:
+        yield art_start, parse_art(poly_class, art)
+
+
+def classify_points(poly_class: PolyShape, points) -> tuple:
+    """Return the id, n and the Lattice and Plane k of a polyomino given its points"""
+    kernel = poly_class.kernel()
+    pattern = kernel.to_internal(points)
+    if not pattern:
+        raise RuntimeError("No cells")
+    if not is_connected(kernel, pattern):
+        raise RuntimeError("Cells are not connected")
+    id = kernel.get_pattern_id(pattern, next(iter(pattern)))[0]
+    return (
+        id,
+        len(pattern),
+        kernel.get_pattern_collinear(Lattice, pattern),
+        kernel.get_pattern_collinear(Plane, pattern),
+    )
+
+
+def classify_chunk(args) -> list:
+    """Return the line and classification of each polyomino of a chunk"""
+    poly_class, chunk = args
+    results = []
+    for line_number, points in chunk:
+        try:
+            results.append((line_number,) + classify_points(poly_class, points))
+        except RuntimeError as e:
+            raise RuntimeError(f"Line {line_number}: {e}")
+    return results
+
+
+class LevelLookup:
+    """Whether polyominoes are in the levels stored for a shape and collinearity"""
+
+    def __init__(self, poly_class: PolyShape, collinearity: CollinearityType):
+        self.poly_class = poly_class
+        self.collinearity = collinearity
+        self.storage = get_storage()
+        self.index = None
+        if not isinstance(self.storage, SQLiteStorage):
+            # imported here as it brings in numpy which classifying alone does not need
+            from adjacency import AdjacencyIndex
+
+            try:
+                self.index = AdjacencyIndex(poly_class, collinearity)
+            except RuntimeError:
+                pass
+        self.levels = {}
+
+    def level_ids(self, n: int, k: int):
+        """Return the ids of a level, or None if it has not been created.
+        These are the adjacency index for a level it covers and the ids read in
+        full for other levels, otherwise (for SQLite) just whether the level exists"""
+        if (n, k) not in self.levels:
+            ids = None
+            if self.storage.exists(self.poly_class, self.collinearity, n, k):
+                ids = True
+                if self.index is not None and self.index.covers(n, k):
+                    ids = self.index
+                elif not isinstance(self.storage, SQLiteStorage):
+                    ids = {
+                        id
+                        for id, _ in self.storage.iter_rows(
+                            self.poly_class, self.collinearity, Identifier, n, k
+                        )
+                    }
+            self.levels[n, k] = ids
+        return self.levels[n, k]
+
+    def contains(self, id: str, n: int, k: int):
+        """Return whether the polyomino of n,k is stored, or None if its level is not"""
+        ids = self.level_ids(n, k)
+        if ids is None:
+            return None
+        if ids is True:
+            try:
+                return self.storage.get_level(
+                    self.poly_class, self.collinearity, id
+                ) == (n, k)
+            except KeyError:
+                return False
+        return id in ids
+
+
+def chunks(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def classify(poly_class: PolyShape, inputs, workers=None):
+    """Yield the line, id, n, Lattice k, Plane k and whether it is stored for
+    Lattice and Plane of each polyomino of the inputs (see read_inputs) in order"""
+    if workers is None:
+        workers = cpu_count() or 1
+    lookups = [
+        LevelLookup(poly_class, collinearity) for collinearity in (Lattice, Plane)
+    ]
+
+    def with_lookups(results):
+        for line_number, id, n, lattice_k, plane_k in results:
+            in_lattice, in_plane = (
+                lookup.contains(id, n, k)
+                for lookup, k in zip(lookups, (lattice_k, plane_k))
+            )
+            yield line_number, id, n, lattice_k, plane_k, in_lattice, in_plane
+
+    work = ((poly_class, chunk) for chunk in chunks(inputs, CLASSIFY_CHUNK))
+    if workers == 1:
+        for args in work:
+            yield from with_lookups(classify_chunk(args))
+        return
+
+    # only a few chunks are submitted ahead of the one being written out
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for args in work:
+            pending.append(executor.submit(classify_chunk, args))
+            if len(pending) > workers * CHUNKS_AHEAD:
+                yield from with_lookups(pending.popleft().result())
+        while pending:
+            yield from with_lookups(pending.popleft().result())
+
+
+def format_row(row: tuple) -> str:
+    """Return a classified polyomino as a CSV line"""
+    flag = lambda stored: "" if stored is None else str(int(stored))
+    line_number, id, n, lattice_k, plane_k, in_lattice, in_plane = row
+    return f"{line_number},{id},{n},{lattice_k},{plane_k},{flag(in_lattice)},{flag(in_plane)}"
+
+
+def classify_file(
+    poly_class: PolyShape, input_path: str, output_path=None, workers=None
+) -> int:
+    """Classify the polyominoes of a file writing CSV to the output file
+    or console, returns the number classified"""
+    count = 0
+    with open(input_path, "r") as in_obj:
+        out_obj = open(output_path, "w") if output_path else sys.stdout
+        try:
+            out_obj.write(CSV_HEADER + "\n")
+            for row in classify(poly_class, read_inputs(poly_class, in_obj), workers):
+                out_obj.write(format_row(row) + "\n")
+                count += 1
+        finally:
+            if output_path:
+                out_obj.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Classify polyominoes given as ids, coordinates or ASCII art"
+    )
+    parser.add_argument("shape", help="square or hexagon")
+    parser.add_argument("input", help="file of polyominoes")
+    parser.add_argument("--output", help="CSV file, the console if not given")
+    parser.add_argument("--data-folder", default="data")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    os.environ["POLYOMINO_DATA_FOLDER"] = args.data_folder
+    count = classify_file(get_class(args.shape), args.input, args.output, args.workers)
+    if args.output:
+        print(f"Classified {count} polyominoes in to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Checking that two data folders hold the same levels without reading the levels.
+
+Each level file is saved with a .digest file alongside it holding digests of its
+ids and its edges that do not depend on the order of the rows (see LevelDigest).
+So two data folders, say one from a new engine and one from the old, are compared
+by reading just the digests, whatever the size of the levels and whichever order
+or form (compression, compact ids) they were written in. The build records of
+the levels (see generation.save_level) hold the same digests.
+
+A level file with no digest, or one left behind by the file being replaced,
+is digested from the file and the digest saved for next time.
+
+Running from the command line, see --help
+
+python ./src/compare.py data data_new
+"""
+
+import argparse
+import os
+import re
+import sys
+from glob import glob
+from classes import get_file_digest
+
+LEVEL_FILE_PATTERN = re.compile(r"(.*)\.txt(\.gz|\.xz)?")
+
+
+def level_files(data_folder: str) -> dict:
+    """Return the path of each level file of a data folder keyed on the shape,
+    collinearity and name of the level"""
+    files = {}
+    for file_path in glob(os.path.join(data_folder, "*", "*", "*.txt*")):
+        match = LEVEL_FILE_PATTERN.fullmatch(os.path.basename(file_path))
+        if match:
+            folder = os.path.dirname(file_path)
+            key = os.path.basename(os.path.dirname(folder)), os.path.basename(folder)
+            files[key + (match.group(1),)] = file_path
+    return files
+
+
+def compare_folders(folder_a: str, folder_b: str) -> dict:
+    """Return the levels of the two data folders that are the same, that differ
+    and that are only in one of them, each a sorted list of the level keys"""
+    files_a = level_files(folder_a)
+    files_b = level_files(folder_b)
+    result = {
+        "same": [],
+        "different": [],
+        "only_a": sorted(files_a.keys() - files_b.keys()),
+        "only_b": sorted(files_b.keys() - files_a.keys()),
+    }
+    for key in sorted(files_a.keys() & files_b.keys()):
+        same = get_file_digest(files_a[key]) == get_file_digest(files_b[key])
+        result["same" if same else "different"].append(key)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the levels of two data folders by their digests"
+    )
+    parser.add_argument("folder_a")
+    parser.add_argument("folder_b")
+    args = parser.parse_args()
+
+    result = compare_folders(args.folder_a, args.folder_b)
+    for name, label in (
+        ("different", "Different"),
+        ("only_a", f"Only in {args.folder_a}"),
+        ("only_b", f"Only in {args.folder_b}"),
+    ):
+        for key in result[name]:
+            print(f"{label}: {'/'.join(key)}")
+    print(
+        f"{len(result['same'])} levels the same, {len(result['different'])} different, {len(result['only_a']) + len(result['only_b'])} in one folder only"
+    )
+    if result["different"] or result["only_a"] or result["only_b"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""Generating a single n,k across many processes or machines through a job queue
+held in a shared folder.
+
+A coordinator splits the parents of n,k into numbered work units in the folder.
+Workers (on any machine that can see the folder) claim a unit by renaming it,
+which only one of them can do, expand its parents and write the descendants
+to a part file. Merging the part files gives the usual ancestor file.
+
+Work unit files in the folder work_<n>_<k> alongside the ancestor files
+
+    units.txt                   the number of units
+    unit_00000.todo             parent ids waiting to be processed
+    unit_00000.<worker>.claimed being processed by the worker
+    unit_00000.part             the descendants of each parent
+
+A claimed unit is kept fresh by its worker touching it, so one not touched
+within the stale time is assumed to belong to a dead worker and put back.
+If a slow worker does finish a reclaimed unit the part is simply written twice
+with the same content.
+
+Running a worker from the command line, see --help
+
+python ./src/distributed.py worker hexagon plane 12 4 --data-folder data
+"""
+
+import argparse
+import os
+import socket
+from glob import glob
+from multiprocessing import Process
+from time import sleep, time
+from classes import (
+    Ancestor,
+    CollinearityType,
+    Identifier,
+    PatternIdCache,
+    PolyShape,
+    get_class,
+    get_collinearity_class,
+    get_region,
+)
+from generation import ancestors_exist, expand_parent, save_level
+from storage import get_storage
+
+UNIT_SIZE = 1000
+STALE_SECONDS = 600
+POLL_SECONDS = 2
+HEARTBEAT_PARENTS = 100
+
+
+def get_work_folder(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> str:
+    """Return the folder holding the work units for n,k"""
+    file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+    return os.path.join(os.path.dirname(file_path), f"work_{n:02d}_{k:02d}")
+
+
+def unit_path(work_folder: str, unit: int, state: str) -> str:
+    return os.path.join(work_folder, f"unit_{unit:05d}.{state}")
+
+
+def stream_parent_ids(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Yield the parent ids of n,k each with s (from P(n-1,k)) or p (from P(n-1,k-1))
+    in the same order as load_parents_nk without holding them in memory"""
+    levels = []
+    if k > 1:
+        levels.append((k - 1, "p"))
+    if k < n:
+        levels.append((k, "s"))
+    storage = get_storage()
+    for level_k, source in levels:
+        for id, _ in storage.iter_rows(
+            poly_class, collinearity, Identifier, n - 1, level_k
+        ):
+            yield id, source
+
+
+def create_work_units(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    unit_size=UNIT_SIZE,
+) -> int:
+    """Split the parents of n,k into work units, returns the number of units.
+    Each line of a unit is a parent id and s (from P(n-1,k)) or p (from P(n-1,k-1)).
+    The parents are streamed from storage so are never all held in memory"""
+    work_folder = get_work_folder(poly_class, collinearity, n, k)
+    os.makedirs(work_folder, exist_ok=True)
+
+    units = 0
+    unit_rows = 0
+    file_obj = None
+    for id, source in stream_parent_ids(poly_class, collinearity, n, k):
+        if file_obj is None:
+            file_path = unit_path(work_folder, units, "todo")
+            # written under another name first so it is never claimed half written
+            file_obj = open(file_path + ".tmp", "w")
+        file_obj.write(f"{id} {source}\n")
+        unit_rows += 1
+        if unit_rows == unit_size:
+            file_obj.close()
+            os.replace(file_path + ".tmp", file_path)
+            file_obj = None
+            unit_rows = 0
+            units += 1
+    if file_obj is not None:
+        file_obj.close()
+        os.replace(file_path + ".tmp", file_path)
+        units += 1
+
+    with open(os.path.join(work_folder, "units.txt"), "w") as file_obj:
+        file_obj.write(f"{units}\n")
+    return units
+
+
+def claim_unit(work_folder: str, worker: str):
+    """Claim a unit waiting to be processed, returns the unit number and
+    path of the claimed file or None if there is nothing to claim"""
+    for file_path in sorted(glob(os.path.join(work_folder, "unit_*.todo"))):
+        unit = int(os.path.basename(file_path)[5:10])
+        claimed = unit_path(work_folder, unit, f"{worker}.claimed")
+        try:
+            os.rename(file_path, claimed)
+        except FileNotFoundError:
+            # another worker got there first
+            continue
+        os.utime(claimed)
+        return unit, claimed
+    return None
+
+
+def reclaim_stale_units(work_folder: str, stale_seconds=STALE_SECONDS) -> int:
+    """Put back any claimed units not touched within the stale time,
+    returns the number reclaimed"""
+    reclaimed = 0
+    for file_path in glob(os.path.join(work_folder, "unit_*.claimed")):
+        try:
+            if time() - os.path.getmtime(file_path) < stale_seconds:
+                continue
+            unit = int(os.path.basename(file_path)[5:10])
+            if os.path.isfile(unit_path(work_folder, unit, "part")):
+                os.remove(file_path)
+                continue
+            os.rename(file_path, unit_path(work_folder, unit, "todo"))
+            reclaimed += 1
+        except FileNotFoundError:
+            # finished or reclaimed by someone else in the meantime
+            continue
+    return reclaimed
+
+
+def process_unit(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    k: int,
+    work_folder: str,
+    unit: int,
+    claimed: str,
+):
+    """Expand the parents of a claimed unit and write its part file"""
+    kernel = poly_class.kernel()
+    cache = PatternIdCache()
+    region = get_region()
+    with open(claimed, "r") as file_obj:
+        parents = [line.split() for line in file_obj.read().splitlines()]
+
+    part = unit_path(work_folder, unit, "part")
+    # a unit reclaimed from a worker thought dead may still be written by that
+    # worker, so each writes its own file and the last to finish puts theirs in place
+    part_tmp = f"{claimed}.{os.getpid()}.tmp"
+    with open(part_tmp, "w") as file_obj:
+        for cnt, (id, source) in enumerate(parents, start=1):
+            _, encoding = Identifier.line_to_data(id)
+            pattern = kernel.decoder(encoding)
+            d_dict = expand_parent(
+                kernel, collinearity, k, pattern, source == "s", cache, region
+            )
+            if d_dict:
+                file_obj.write(Ancestor.data_to_line(id, d_dict) + "\n")
+            if cnt % HEARTBEAT_PARENTS == 0:
+                try:
+                    os.utime(claimed)
+                except FileNotFoundError:
+                    pass
+    os.replace(part_tmp, part)
+
+    try:
+        os.remove(claimed)
+    except FileNotFoundError:
+        pass
+
+
+def run_worker(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    data_folder=None,
+    worker=None,
+    stale_seconds=STALE_SECONDS,
+) -> int:
+    """Process units until every one has a part file, returns the number processed.
+    When there is nothing left to claim the worker waits on the units claimed by
+    others, taking them over if they go stale"""
+    if data_folder is not None:
+        os.environ["POLYOMINO_DATA_FOLDER"] = data_folder
+    if worker is None:
+        worker = f"{socket.gethostname()}-{os.getpid()}"
+    work_folder = get_work_folder(poly_class, collinearity, n, k)
+
+    processed = 0
+    while True:
+        claim = claim_unit(work_folder, worker)
+        if claim:
+            process_unit(poly_class, collinearity, k, work_folder, *claim)
+            processed += 1
+            continue
+
+        if reclaim_stale_units(work_folder, stale_seconds):
+            continue
+        if not glob(os.path.join(work_folder, "unit_*.claimed")):
+            return processed
+        sleep(POLL_SECONDS)
+
+
+def merge_work_units(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Merge the part files in to the ancestor file for n,k and tidy up the work units"""
+    work_folder = get_work_folder(poly_class, collinearity, n, k)
+    with open(os.path.join(work_folder, "units.txt"), "r") as file_obj:
+        units = int(file_obj.readline())
+
+    missing = [
+        unit
+        for unit in range(units)
+        if not os.path.isfile(unit_path(work_folder, unit, "part"))
+    ]
+    if missing:
+        raise RuntimeError(
+            f"Work units {missing} for {poly_class.file_name} {collinearity.file_name} n={n} k={k} not complete"
+        )
+
+    # ancestors is reversed DAG of descendants, parts are read in the unit order
+    # to give the same order of rows as generating in a single process
+    ancestors = {}
+    for unit in range(units):
+        with open(unit_path(work_folder, unit, "part"), "r") as file_obj:
+            for line in file_obj:
+                id, d_dict = Ancestor.line_to_data(line.strip())
+                for d_id, removal_point in d_dict.items():
+                    ancestors.setdefault(d_id, {})[id] = removal_point
+
+    save_level(poly_class, collinearity, n, k, ancestors)
+
+    for file_path in glob(os.path.join(work_folder, "*")):
+        os.remove(file_path)
+    os.rmdir(work_folder)
+
+
+def create_ancestors_nk_distributed(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    workers=4,
+    unit_size=UNIT_SIZE,
+    overwrite=False,
+):
+    """Create the ancestors file for n,k using local worker processes
+    sharing the work units in the data folder"""
+    if not overwrite and ancestors_exist(poly_class, collinearity, n, k):
+        return
+    if n == 1:
+        save_level(poly_class, collinearity, n, k, {"1": {}})
+        return
+
+    create_work_units(poly_class, collinearity, n, k, unit_size)
+    data_folder = os.environ.get("POLYOMINO_DATA_FOLDER", "data")
+    processes = [
+        Process(
+            target=run_worker,
+            args=(poly_class, collinearity, n, k, data_folder),
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    merge_work_units(poly_class, collinearity, n, k)
+
+
+def create_ancestors_nk_work_units(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Create the ancestors file for n,k through work units processed in this process.
+    Only one unit of parents and its descendants are in memory at a time
+    so this is the low memory way of generating"""
+    create_work_units(poly_class, collinearity, n, k)
+    run_worker(poly_class, collinearity, n, k, worker=f"local-{os.getpid()}")
+    merge_work_units(poly_class, collinearity, n, k)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate an n,k through work units in a shared folder"
+    )
+    parser.add_argument("command", choices=["units", "worker", "reclaim", "merge"])
+    parser.add_argument("shape", help="square or hexagon")
+    parser.add_argument("collinearity", help="lattice or plane")
+    parser.add_argument("n", type=int)
+    parser.add_argument("k", type=int)
+    parser.add_argument("--data-folder", default="data")
+    parser.add_argument("--region", help="rows x columns or hexagon and a radius")
+    parser.add_argument("--unit-size", type=int, default=UNIT_SIZE)
+    parser.add_argument("--stale-seconds", type=int, default=STALE_SECONDS)
+    args = parser.parse_args()
+
+    os.environ["POLYOMINO_DATA_FOLDER"] = args.data_folder
+    if args.region:
+        os.environ["POLYOMINO_REGION"] = args.region
+    poly_class = get_class(args.shape)
+    collinearity = get_collinearity_class(args.collinearity)
+    work_folder = get_work_folder(poly_class, collinearity, args.n, args.k)
+
+    if args.command == "units":
+        units = create_work_units(
+            poly_class, collinearity, args.n, args.k, args.unit_size
+        )
+        print(f"Created {units} work units in {work_folder}")
+    elif args.command == "worker":
+        processed = run_worker(
+            poly_class, collinearity, args.n, args.k, stale_seconds=args.stale_seconds
+        )
+        print(f"Processed {processed} work units in {work_folder}")
+    elif args.command == "reclaim":
+        reclaimed = reclaim_stale_units(work_folder, args.stale_seconds)
+        print(f"Reclaimed {reclaimed} work units in {work_folder}")
+    else:
+        merge_work_units(poly_class, collinearity, args.n, args.k)
+
+
+if __name__ == "__main__":
+    main()
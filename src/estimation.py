@@ -0,0 +1,230 @@
+"""Estimating T(n,k) by sampling, for n beyond the reach of exact enumeration.
+
+Every polyomino has a single canonical parent (see canonical_children) so the
+polyominoes form a tree grown from the monomino. A tour walks down the tree
+picking one child at random at each step and carries a Rosenbluth weight, the
+product of the number of children it could have picked. The weight at size n is
+an unbiased estimate of the number of polyominoes of size n, and counting it
+against the k of the polyomino reached gives an estimate for each T(n,k).
+
+Tours are pruned and enriched (PERM) against thresholds taken from a pilot run.
+A tour whose weight has got too large is split in to 2 copies of half the weight,
+one whose weight has got too small is dropped half the time and otherwise
+carries on with double the weight. Neither changes the expected weight but it
+spends the sampling on the parts of the tree holding the most polyominoes.
+
+Given a k limit, children over it are pruned as collinearity only goes up
+as a polyomino grows, so the tours stay within the part of the tree of interest.
+
+Tours are independent so are run in batches across worker processes, each batch
+seeded from the seed and its number so results do not depend on the workers.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
+from random import Random
+from classes import CollinearityType, PolyShape
+from generation import canonical_children
+
+# for a 95% confidence interval
+CONFIDENCE_Z = 1.96
+
+# PERM thresholds as a ratio of the estimated number of polyominoes at the size
+ENRICH_RATIO = 3.0
+PRUNE_RATIO = 0.3
+
+BATCH_TOURS = 50
+
+
+def sample_tour(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    max_n: int,
+    rng: Random,
+    k_limit=None,
+    thresholds=None,
+) -> dict:
+    """Return the weights reached by a single tour as a dict keyed on (n,k).
+    Without thresholds this is a plain Rosenbluth walk with no pruning or enrichment"""
+    kernel = poly_class.kernel()
+    weights = {}
+    stack = [(kernel.to_internal({poly_class.origin}), "1", 1, 1, 1.0)]
+    while stack:
+        pattern, id, max_collinear, n, weight = stack.pop()
+        weights[(n, max_collinear)] = weights.get((n, max_collinear), 0) + weight
+        if n == max_n:
+            continue
+
+        children = canonical_children(
+            kernel, collinearity, pattern, id, max_collinear, k_limit
+        )
+        if not children:
+            continue
+        weight *= len(children)
+
+        copies = 1
+        if thresholds:
+            expected = thresholds[n + 1]
+            if weight > ENRICH_RATIO * expected:
+                copies = 2
+                weight /= 2
+            elif weight < PRUNE_RATIO * expected:
+                if rng.random() < 0.5:
+                    continue
+                weight *= 2
+
+        for _ in range(copies):
+            child, d_id, d_collinear = rng.choice(children)
+            stack.append((child, d_id, d_collinear, n + 1, weight))
+
+    return weights
+
+
+def sample_batch(args) -> tuple:
+    """Run a batch of tours returning the sums and sums of squares of their
+    weights keyed on (n,k) and of their row totals keyed on n"""
+    poly_class, collinearity, max_n, k_limit, thresholds, seed, tours = args
+    rng = Random(seed)
+    level_sums = {}
+    total_sums = {}
+    for _ in range(tours):
+        weights = sample_tour(poly_class, collinearity, max_n, rng, k_limit, thresholds)
+        row_totals = {}
+        for (n, k), w in weights.items():
+            row_totals[n] = row_totals.get(n, 0) + w
+        for sums, values in ((level_sums, weights), (total_sums, row_totals)):
+            for key, w in values.items():
+                s, s2 = sums.get(key, (0, 0))
+                sums[key] = s + w, s2 + w * w
+    return level_sums, total_sums
+
+
+def run_batches(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    max_n: int,
+    k_limit,
+    thresholds,
+    seed: str,
+    tours: int,
+    workers=None,
+) -> tuple:
+    """Run the tours in batches over the workers and combine the sums"""
+    batches = [
+        (
+            poly_class,
+            collinearity,
+            max_n,
+            k_limit,
+            thresholds,
+            f"{seed}:{i}",
+            min(BATCH_TOURS, tours - i * BATCH_TOURS),
+        )
+        for i in range((tours + BATCH_TOURS - 1) // BATCH_TOURS)
+    ]
+    if workers == 1 or len(batches) == 1:
+        results = [sample_batch(batch) for batch in batches]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(sample_batch, batches))
+
+    level_sums = {}
+    total_sums = {}
+    for batch_sums in results:
+        for sums, part in zip((level_sums, total_sums), batch_sums):
+            for key, (s, s2) in part.items():
+                a, a2 = sums.get(key, (0, 0))
+                sums[key] = a + s, a2 + s2
+    return level_sums, total_sums
+
+
+def to_estimates(sums: dict, tours: int) -> dict:
+    """Return the mean and half width of the confidence interval for each key"""
+    estimates = {}
+    for key, (s, s2) in sums.items():
+        mean = s / tours
+        variance = max(s2 / tours - mean * mean, 0) * tours / max(tours - 1, 1)
+        estimates[key] = mean, CONFIDENCE_Z * sqrt(variance / tours)
+    return estimates
+
+
+def estimate_counts(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    max_n: int,
+    tours=1000,
+    k_limit=None,
+    seed=0,
+    workers=None,
+    pilot_tours=None,
+) -> tuple:
+    """Estimate the number of polyominoes for each n,k up to max_n by sampling.
+    Returns 2 dicts, the first keyed on (n,k) and the second on n for the row totals
+    (of those within the k limit), where the value is the estimate and the half width
+    of its 95% confidence interval. Setting pilot_tours to 0 turns off PERM"""
+    if pilot_tours is None:
+        pilot_tours = max(tours // 10, 1)
+
+    thresholds = None
+    if pilot_tours:
+        _, pilot_sums = run_batches(
+            poly_class,
+            collinearity,
+            max_n,
+            k_limit,
+            None,
+            f"{seed}:pilot",
+            pilot_tours,
+            workers,
+        )
+        thresholds = {
+            n: estimate
+            for n, (estimate, _) in to_estimates(pilot_sums, pilot_tours).items()
+        }
+        # a size the pilot never reached is never pruned or enriched
+        for n in range(1, max_n + 1):
+            thresholds.setdefault(n, float("inf"))
+
+    level_sums, total_sums = run_batches(
+        poly_class,
+        collinearity,
+        max_n,
+        k_limit,
+        thresholds,
+        seed,
+        tours,
+        workers,
+    )
+    return to_estimates(level_sums, tours), to_estimates(total_sums, tours)
+
+
+def output_estimates(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    max_n: int,
+    tours=1000,
+    k_limit=None,
+    seed=0,
+    workers=None,
+):
+    """Output the estimated number of polyominoes of size n with k cells collinear
+    along with the 95% confidence interval to console"""
+    level_estimates, total_estimates = estimate_counts(
+        poly_class, collinearity, max_n, tours, k_limit, seed, workers
+    )
+
+    print()
+    print(
+        f"Estimated {poly_class.title} of size (n) with (k) cells collinear on the {collinearity.file_name.title()} from {tours} tours"
+    )
+    print()
+    print(" n   k          Estimate            95% CI")
+    print("-" * 44)
+    for n in range(1, max_n + 1):
+        k_stop = n + 1 if k_limit is None else min(n, k_limit) + 1
+        for k in range(1, k_stop):
+            estimate, half_width = level_estimates.get((n, k), (0, 0))
+            print(f"{n:2d}{k:4d}{estimate:18.6g}  +/-{half_width:14.4g}")
+        estimate, half_width = total_estimates.get(n, (0, 0))
+        print(f"{n:2d} all{estimate:18.6g}  +/-{half_width:14.4g}")
+    print()
@@ -1,7 +1,8 @@
 """Code for generating the data files"""
 
 import os
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from operator import add
 from classes import (
     ENCODING_SEPARATOR,
@@ -9,17 +10,35 @@ from classes import (
     CollinearityType,
     DataType,
     Identifier,
+    Lattice,
+    PatternIdCache,
+    Plane,
     PolyShape,
-    get_row_count,
+    Region,
+    ShapeKernel,
+    get_region,
 )
+from storage import get_storage
+from telemetry import get_telemetry
 from utils import (
-    progress_bar_freq,
-    progress_bar_update,
+    deep_size,
+    estimate_size,
+    get_resident_memory,
+    reverse_dag,
 )
 
 # default root folder for data
 os.environ["POLYOMINO_DATA_FOLDER"] = "data"
 
+MB = 1024 * 1024
+
+# time and memory used generating each n,k keyed on (shape, collinearity, n, k)
+JOB_USAGE = {}
+
+# bumped whenever a change to generation changes what is saved for a level,
+# so create_data rebuilds the levels saved before it
+ENGINE_VERSION = 2
+
 
 def load_data_file(
     poly_class: PolyShape,
@@ -27,48 +46,25 @@ def load_data_file(
     data_type: DataType,
     n: int,
     k: int,
+    silent=None,
 ) -> dict:
-    """Load a file into a dict and return it"""
-    data_dict = {}
-    file_path = poly_class.get_file_path(collinearity, data_type, n, k)
-    silent = os.environ.get("POLYOMINO_SILENT", False)
-
-    try:
-        with open(file_path, "r") as file_obj:
-            meta = file_obj.readline()
-            row_count = get_row_count(meta)
-            if not silent:
-                pbf = progress_bar_freq(row_count)
-                poly_class.start_loading(collinearity, data_type, n, k, row_count)
-
-            cnt = 0
-            while line := file_obj.readline():
-                line = line.strip()
-                # arr = line.split(" ")
-                # id = line.split(" ")[0]
-                id, line_data = data_type.line_to_data(line)
-                data_dict[id] = line_data
-                cnt += 1
-                if not silent and (cnt % pbf == 0 or cnt == row_count):
-                    progress_bar_update(row_count, cnt)
-
-    except FileNotFoundError:
-        raise RuntimeError(
-            f"{data_type.file_name} file for {poly_class.file_name} {collinearity.file_name} n={n} k={k} not found"
-        )
-
-    return data_dict
+    """Load a level from storage into a dict and return it"""
+    return get_storage().load(poly_class, collinearity, data_type, n, k, silent)
 
 
 def load_polyomino_patterns_nk(
-    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    silent=None,
 ):
     """Return a dict of polyominoes loaded from file keyed on id.
     The value is a frozen sets of points"""
     return {
         id: poly_class.decoder(encoding)
         for id, encoding in load_data_file(
-            poly_class, collinearity, Identifier, n, k
+            poly_class, collinearity, Identifier, n, k, silent
         ).items()
     }
 
@@ -97,14 +93,43 @@ def load_ancestors_nk(
     }
 
 
-def create_ancestors_nk(
+def load_parents_nk(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, silent=None
+):
+    """Return the patterns needed to generate n,k as 2 dicts keyed on id.
+    The first is P(n-1,k) and the second is all the parents P(n-1,k) | P(n-1,k-1)"""
+    same = {}
+    prev = {}
+    if n == 1:
+        return same, prev
+
+    if k < n:
+        same = load_polyomino_patterns_nk(poly_class, collinearity, n - 1, k, silent)
+    if k > 1:
+        prev = load_polyomino_patterns_nk(
+            poly_class, collinearity, n - 1, k - 1, silent
+        )
+
+    # confidence levels are good enough to no longer needs
+    # assert set(prev) & set(same) == set()
+
+    prev.update(same)
+    return same, prev
+
+
+def generate_ancestors_nk(
     poly_class: PolyShape,
     collinearity: CollinearityType,
     n: int,
     k: int,
-    overwrite=False,
-):
-    """Return a dict of ancestors for a given n,k"""
+    same: dict,
+    prev: dict,
+    workers=None,
+    region=None,
+) -> dict:
+    """Return a dict of ancestors for a given n,k from the parent patterns,
+    expanding them across local worker processes if more than 1 (see parallel.py)
+    and keeping only the children that fit the region if given"""
 
     # Generate a dict of ancestors of a given type,n,k keyed on id
 
@@ -128,101 +153,491 @@ def create_ancestors_nk(
 
     silent = os.environ.get("POLYOMINO_SILENT", False)
 
-    fp = poly_class.get_file_path(collinearity, Ancestor, n, k)
-    if os.path.isfile(fp) and not overwrite:
-        print(
-            f"File exists already for {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k}"
-        )
-        return
+    # the levels with nothing to do are still timed so the run ETA has every level
+    telemetry = get_telemetry()
+    cache = PatternIdCache()
+    telemetry.start_level(n, k, len(prev), cache, silent)
 
     # Seeded at the origin - single tile and has no ancestors
     # "1" is the encoding
     if n == 1:
-        ancestors = {"1": {}}
-        poly_class.save_to_file(collinearity, Ancestor, n, k, ancestors)
-        return
+        telemetry.end_level(1)
+        return {"1": {}}
 
-    # load the previous sets
-    same = {}
-    if k < n:
-        same = load_polyomino_patterns_nk(poly_class, collinearity, n - 1, k)
-    prev = {}
-    if k > 1:
-        prev = load_polyomino_patterns_nk(poly_class, collinearity, n - 1, k - 1)
-
-    # confidence levels are good enough to no longer needs
-    # assert set(prev) & set(same) == set()
-
-    prev.update(same)
     if not prev:
         print(f"Previous set of {n-1} empty, so no more for k={k}")
-        poly_class.save_to_file(collinearity, Ancestor, n, k, {})
-        return
-
-    # establish progress bar update frequency
-    pbf = progress_bar_freq(len(prev))
+        telemetry.end_level(0)
+        return {}
 
-    # DAG data structures for our working set and final result
+    # DAG data structure for our working set
     # edge data is the point added to the ancestor
     # from the ancestors perspective in the preferred orientation
-    ancestors = defaultdict(dict)
-    descendants = defaultdict(dict)
-    cnt = 0
+    descendants = {}
+    kernel = poly_class.kernel()
 
     if not silent:
         print(
             f"Generating {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k}"
         )
+    if workers and workers > 1:
+        from parallel import expand_parents_shared
 
-    for id, pattern in prev.items():
+        expanded = expand_parents_shared(
+            poly_class, collinearity, n, k, same, prev, workers, cache, region
+        )
+    else:
+        expanded = (
+            (
+                id,
+                expand_parent(
+                    kernel,
+                    collinearity,
+                    k,
+                    kernel.to_internal(pattern),
+                    id in same,
+                    cache,
+                    region,
+                ),
+            )
+            for id, pattern in prev.items()
+        )
+    for id, d_dict in expanded:
+        if d_dict:
+            descendants[id] = d_dict
+        telemetry.update(len(d_dict))
 
-        cnt += 1
-        if not silent and (cnt % pbf == 0 or cnt == len(prev)):
-            progress_bar_update(len(prev), cnt)
+    # ancestors is reversed DAG of descendants
+    ancestors = reverse_dag(descendants)
+    rates = telemetry.end_level(len(ancestors))
+
+    usage = {
+        "seconds": rates["elapsed_sec"],
+        "peak_memory": rates["peak_memory"],
+        "parents": estimate_size(prev),
+        "descendants": estimate_size(descendants),
+        "ancestors": estimate_size(ancestors),
+    }
+    JOB_USAGE[(poly_class.file_name, collinearity.file_name, n, k)] = usage
 
-        # create the border
-        border = set()
+    if not silent:
+        print(cache.report())
+        print(
+            f"Generated {len(ancestors)} in {usage['seconds']:.1f}s "
+            f"peak memory {usage['peak_memory'] / MB:.0f} MB "
+            f"(parents ~{usage['parents'] / MB:.1f} MB, "
+            f"descendants ~{usage['descendants'] / MB:.1f} MB, "
+            f"ancestors ~{usage['ancestors'] / MB:.1f} MB)"
+        )
 
-        # for every node in the graph
-        for p in pattern:
+    return ancestors
 
-            # for ever possible neighbour of that node
-            for v in poly_class.vectors:
-                np = tuple(map(add, p, v))
-                if np in pattern:
-                    continue
-                border.add(np)
 
-        # for every node on the border
-        for np in border:
+def expand_parent(
+    kernel: ShapeKernel,
+    collinearity: CollinearityType,
+    k: int,
+    pattern: frozenset,
+    from_same: bool,
+    cache: PatternIdCache,
+    region: Region = None,
+) -> dict:
+    """Return the descendants of a parent pattern for P(n,k) as a dict keyed on id
+    where the value is the removal point, only those that fit the region if given"""
+    descendants = {}
+
+    # where in the border the removal point of each descendant came from
+    positions = {}
+
+    # the border grouped by the symmetry of the parent, each orbit gives
+    # the same child so only one cell of it needs expanding
+    for orbit in kernel.border_orbits(pattern):
 
-            # a potential new pattern
-            new_pattern = pattern | {np}
-            d_id, removal_point, pref_pattern = poly_class.get_pattern_id(
-                new_pattern, np
+        # when a child is found more than once the last cell of the border
+        # giving it decides the removal point, so that is the one expanded
+        position, np = orbit[-1]
+
+        # a potential new pattern
+        new_pattern = pattern | {np}
+
+        # how does the new point affect collinearity, this does not change
+        # with the orientation so is checked before finding the id
+        max_collinear = kernel.get_maximum_collinear(
+            collinearity, new_pattern, np, limit=k
+        )
+
+        # patterns from P(n-1,k) must not go over k collinear and
+        # patterns from P(n-1,k-1) must make it up to k
+        if from_same:
+            if max_collinear > k:
+                continue
+        else:
+            if max_collinear < k:
+                continue
+
+        # nothing grown from a child that does not fit will fit either
+        if region is not None and not region.fits(kernel, new_pattern):
+            continue
+
+        d_id, removal_point = kernel.get_pattern_id_cached(new_pattern, np, cache)
+
+        # add to the DAG of descendants
+        if positions.get(d_id, -1) < position:
+            descendants[d_id] = removal_point
+            positions[d_id] = position
+
+    return descendants
+
+
+def is_connected(kernel: ShapeKernel, pattern) -> bool:
+    """Return True if the cells of the pattern form a single connected piece"""
+    pattern = set(pattern)
+    if not pattern:
+        return True
+    todo = [next(iter(pattern))]
+    seen = {todo[0]}
+    while todo:
+        p = todo.pop()
+        for v in kernel.vectors:
+            np = tuple(map(add, p, v))
+            if np in pattern and np not in seen:
+                seen.add(np)
+                todo.append(np)
+    return len(seen) == len(pattern)
+
+
+def canonical_removal(kernel: ShapeKernel, pattern) -> tuple:
+    """Return the cell whose removal gives the canonical parent of the pattern.
+    This is the last cell (by row then column) of the preferred orientation that
+    leaves the rest connected, so every polyomino has exactly one canonical parent
+    and the DAG of ancestors reduces to a tree"""
+    cells = tuple(pattern)
+    _, sym, _, _, _ = kernel.preferred_orientation(cells)
+    points = kernel.doubled_maps[sym](cells)
+    for _, cell in sorted(zip(points, cells), reverse=True):
+        rest = set(cells)
+        rest.remove(cell)
+        if is_connected(kernel, rest):
+            return cell
+    raise RuntimeError("Pattern has no removable cell")
+
+
+def canonical_children(
+    kernel: ShapeKernel,
+    collinearity: CollinearityType,
+    pattern: frozenset,
+    pattern_id: str,
+    max_collinear: int,
+    k_limit=None,
+    forbidden=None,
+    region: Region = None,
+) -> list:
+    """Return the children of the pattern whose canonical parent it is,
+    as a list of (child pattern, child id, child max collinear), only those
+    that fit the region if given.
+    Children over the k limit are left out, collinearity never goes down as a
+    polyomino grows so none of their descendants could be within it either.
+    For the same reason a cell that takes the pattern over the k limit can never
+    be added to a descendant, given a set of forbidden cells they are skipped
+    and any more found are added to it.
+    Walking canonical children from the monomino visits every polyomino once"""
+    children = []
+    seen = set()
+    # cells in the same orbit under the symmetry of the pattern give the same child
+    for orbit in kernel.border_orbits(pattern):
+        _, np = orbit[0]
+        if forbidden is not None and np in forbidden:
+            continue
+        new_pattern = pattern | {np}
+        child_collinear = max(
+            max_collinear,
+            kernel.get_maximum_collinear(collinearity, new_pattern, np, limit=k_limit),
+        )
+        if k_limit is not None and child_collinear > k_limit:
+            if forbidden is not None:
+                forbidden.update(cell for _, cell in orbit)
+            continue
+        if region is not None and not region.fits(kernel, new_pattern):
+            continue
+
+        d_id, _, _ = kernel.get_pattern_id(new_pattern, np)
+        if d_id in seen:
+            continue
+        seen.add(d_id)
+
+        removal = canonical_removal(kernel, new_pattern)
+        if removal != np:
+            # removing a different cell may still give a copy of the pattern
+            parent_id, _, _ = kernel.get_pattern_id(new_pattern - {removal}, removal)
+            if parent_id != pattern_id:
+                continue
+        children.append((new_pattern, d_id, child_collinear))
+    return children
+
+
+def ancestors_exist(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> bool:
+    """Return True (with a message) if the ancestors for n,k have already been created"""
+    if get_storage().exists(poly_class, collinearity, n, k):
+        print(
+            f"File exists already for {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k}"
+        )
+        return True
+    return False
+
+
+def level_inputs(n: int, k: int) -> list:
+    """Return the levels n,k is generated from, P(n-1,k-1) then P(n-1,k)"""
+    levels = []
+    if n > 1 and k > 1:
+        levels.append((n - 1, k - 1))
+    if n > 1 and k < n:
+        levels.append((n - 1, k))
+    return levels
+
+
+def get_level_digest(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Return the digest of a level (see LevelDigest) from its build record, getting
+    it from the storage for a level saved without one. None if the level has not
+    been created"""
+    storage = get_storage()
+    record = storage.get_build(poly_class, collinearity, n, k)
+    if record is not None:
+        return record["digest"]
+    digest = storage.get_digest(poly_class, collinearity, n, k)
+    if digest is None:
+        return None
+    storage.set_build(poly_class, collinearity, n, k, {"digest": digest})
+    return digest
+
+
+def build_record(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, digest: dict
+) -> dict:
+    """Return the build record of a level given its digest, with the digests
+    of the levels it was generated from and the engine version"""
+    return {
+        "digest": digest,
+        "engine": ENGINE_VERSION,
+        "inputs": {
+            f"{input_n},{input_k}": get_level_digest(
+                poly_class, collinearity, input_n, input_k
             )
+            for input_n, input_k in level_inputs(n, k)
+        },
+    }
+
 
-            # how does the new point (the removal point) affect collinearity
-            max_collinear = collinearity.get_maximum_collinear(
-                pref_pattern, removal_point, poly_class.dimensions
+def save_level(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, ancestors
+):
+    """Save the ancestors of a level along with its build record,
+    and its property table when POLYOMINO_PROPERTIES is set"""
+    storage = get_storage()
+    digest = storage.save(poly_class, collinearity, Ancestor, n, k, ancestors).to_dict()
+    storage.set_build(
+        poly_class,
+        collinearity,
+        n,
+        k,
+        build_record(poly_class, collinearity, n, k, digest),
+    )
+    if os.environ.get("POLYOMINO_PROPERTIES"):
+        # imported here as it brings in numpy which generation alone does not need
+        from properties import save_properties
+
+        save_properties(poly_class, collinearity, n, k, ancestors, digest)
+
+
+def stale_reason(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    rebuilt=(),
+):
+    """Return why a level needs to be built or None if it is up to date.
+    A level is stale when it was built by another engine version or one of its
+    inputs has changed since. A level saved without a build record is taken as
+    built from its inputs as they are, unless one was rebuilt in this run"""
+    storage = get_storage()
+    if not storage.exists(poly_class, collinearity, n, k):
+        return "missing"
+
+    record = storage.get_build(poly_class, collinearity, n, k)
+    if record is None or "engine" not in record:
+        for level in level_inputs(n, k):
+            if level in rebuilt:
+                return f"n={level[0]} k={level[1]} was rebuilt"
+        digest = get_level_digest(poly_class, collinearity, n, k)
+        storage.set_build(
+            poly_class,
+            collinearity,
+            n,
+            k,
+            build_record(poly_class, collinearity, n, k, digest),
+        )
+        return None
+
+    if record["engine"] != ENGINE_VERSION:
+        return f"built by engine version {record['engine']}"
+    for input_n, input_k in level_inputs(n, k):
+        digest = get_level_digest(poly_class, collinearity, input_n, input_k)
+        if record["inputs"].get(f"{input_n},{input_k}") != digest:
+            return f"n={input_n} k={input_k} has changed"
+    return None
+
+
+def stale_levels(
+    poly_class: PolyShape, collinearity: CollinearityType, levels: list
+) -> list:
+    """Return the levels (in the order given) that are stale along with those
+    generated from them, as far as is known before any are rebuilt"""
+    stale = set()
+    for n, k in levels:
+        if any(level in stale for level in level_inputs(n, k)) or stale_reason(
+            poly_class, collinearity, n, k
+        ):
+            stale.add((n, k))
+    return [level for level in levels if level in stale]
+
+
+def get_workers() -> int:
+    """Return the number of local worker processes to generate a level with,
+    set by POLYOMINO_WORKERS"""
+    return int(os.environ.get("POLYOMINO_WORKERS", 1))
+
+
+def get_memory_budget():
+    """Return the memory budget for a job in bytes, set by POLYOMINO_MEMORY_BUDGET
+    in MB, or None if there is no budget"""
+    budget = os.environ.get("POLYOMINO_MEMORY_BUDGET")
+    if not budget:
+        return None
+    return int(float(budget) * MB)
+
+
+def get_level_row_count(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> int:
+    """Return the number of rows in a level, 0 if it has not been created"""
+    if n < 1 or k < 1 or k > n:
+        return 0
+    return get_storage().row_count(poly_class, collinearity, n, k) or 0
+
+
+def sample_level(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, sample=100
+):
+    """Return the average bytes held in memory per ancestor record and
+    per decoded pattern, measured from the first rows of a level"""
+    record_size = 0
+    pattern_size = 0
+    cnt = 0
+    for id, line_data in get_storage().iter_rows(
+        poly_class, collinearity, Ancestor, n, k, limit=sample
+    ):
+        _, encoding = Identifier.line_to_data(id)
+        record_size += deep_size(id) + deep_size(line_data)
+        pattern_size += deep_size(id) + deep_size(poly_class.decoder(encoding))
+        cnt += 1
+    if cnt == 0:
+        return 0, 0
+    return record_size // cnt, pattern_size // cnt
+
+
+def forecast_memory_nk(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+):
+    """Forecast the peak memory in bytes for generating n,k from the counts
+    of the previous levels, both when done in memory and through work units on disk.
+
+    The number of children is forecast using the ratio of children to parents
+    seen for the previous n,k. The size of each record and pattern is sampled
+    from the parents and scaled up for the extra cell."""
+    rows = lambda n, k: get_level_row_count(poly_class, collinearity, n, k)
+    parents = rows(n - 1, k) + rows(n - 1, k - 1)
+    previous_parents = rows(n - 2, k) + rows(n - 2, k - 1)
+    growth = rows(n - 1, k) / previous_parents if previous_parents else 1
+    children = parents * growth
+
+    record_size, pattern_size = 0, 0
+    for level_k in (k, k - 1):
+        if rows(n - 1, level_k):
+            record_size, pattern_size = sample_level(
+                poly_class, collinearity, n - 1, level_k
             )
+            break
+    scale = n / (n - 1)
+    record_size *= scale
+    pattern_size *= scale
 
-            if id in same:
-                if max_collinear > k:
-                    continue
-            else:
-                if max_collinear < k:
-                    continue
+    # descendants and ancestors hold the same edges
+    baseline = get_resident_memory()
+    full = baseline + parents * pattern_size + 2 * children * record_size
+    low = baseline + children * record_size
+    return int(full), int(low)
 
-            # add to the DAG of descendants
-            descendants[id][d_id] = removal_point
 
-    # ancestors is reversed DAG of descendants
-    for id, d_dict in descendants.items():
-        for d_id, removal_point in d_dict.items():
-            ancestors[d_id][id] = removal_point
+def needs_work_units(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> bool:
+    """Return True if the forecast memory for generating n,k in memory is over
+    the budget set by POLYOMINO_MEMORY_BUDGET, so it should go through work units
+    on disk. Raises RuntimeError if even the work units are over the budget"""
+    budget = get_memory_budget()
+    if budget is None or n == 1:
+        return False
+    full, low = forecast_memory_nk(poly_class, collinearity, n, k)
+    if full <= budget:
+        return False
+    if low > budget:
+        raise RuntimeError(
+            f"Forecast memory of {low // MB} MB for {poly_class.file_name} {collinearity.file_name} n={n} k={k} exceeds the budget of {budget // MB} MB"
+        )
+    print(
+        f"Forecast memory of {full // MB} MB for {poly_class.file_name} {collinearity.file_name} n={n} k={k} exceeds the budget of {budget // MB} MB, generating through work units on disk"
+    )
+    return True
 
-    poly_class.save_to_file(collinearity, Ancestor, n, k, ancestors)
+
+def load_generation_parents(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, silent=None
+):
+    """Return the parents to generate n,k from as load_parents_nk does, or
+    memory mapped as arrays rather than loaded in to dicts if POLYOMINO_COLUMNAR is set"""
+    if os.environ.get("POLYOMINO_COLUMNAR"):
+        from polyset import load_parents_nk_set
+
+        return load_parents_nk_set(poly_class, collinearity, n, k, silent)
+    return load_parents_nk(poly_class, collinearity, n, k, silent)
+
+
+def create_ancestors_nk(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    overwrite=False,
+):
+    """Create the ancestors file for a given n,k"""
+    if not overwrite and ancestors_exist(poly_class, collinearity, n, k):
+        return
+
+    if needs_work_units(poly_class, collinearity, n, k):
+        # parents and descendants are then never held in memory together
+        from distributed import create_ancestors_nk_work_units
+
+        create_ancestors_nk_work_units(poly_class, collinearity, n, k)
+        return
+
+    same, prev = load_generation_parents(poly_class, collinearity, n, k)
+    ancestors = generate_ancestors_nk(
+        poly_class, collinearity, n, k, same, prev, get_workers(), get_region()
+    )
+    save_level(poly_class, collinearity, n, k, ancestors)
 
 
 def create_data(
@@ -231,13 +646,318 @@ def create_data(
     n_start: int,
     n_finish=None,
     k_limit=None,
+    index=False,
+):
+    """Create data for n_start <= n <= n_finish with option to restrict k
+    and to build the adjacency index (see adjacency.py) once done.
+    Levels already created are skipped unless they are stale (see stale_reason),
+    in which case they are rebuilt along with any levels whose inputs then change"""
+    if n_finish is None:
+        n_finish = n_start
+    levels = []
+    for n in range(n_start, n_finish + 1):
+        k_stop = n + 1
+        if k_limit:
+            k_stop = k_limit + 1
+        for k in range(1, k_stop):
+            levels.append((n, k))
+
+    telemetry = get_telemetry()
+    telemetry.start_run(
+        poly_class, collinearity, stale_levels(poly_class, collinearity, levels)
+    )
+    # levels rebuilt in this run, whose digest may have changed
+    rebuilt = set()
+    for n, k in levels:
+        reason = stale_reason(poly_class, collinearity, n, k, rebuilt)
+        if reason is None:
+            print(
+                f"Up to date already {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k}"
+            )
+            continue
+        if reason != "missing":
+            print(
+                f"Rebuilding {Ancestor.file_name} for {poly_class.file_name} {collinearity.file_name} n={n} k={k} as {reason}"
+            )
+        create_ancestors_nk(poly_class, collinearity, n, k, overwrite=True)
+        rebuilt.add((n, k))
+    telemetry.end_run()
+
+    if index:
+        from adjacency import build_index
+
+        build_index(poly_class, collinearity, n_finish)
+
+
+def create_data_pipelined(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n_start: int,
+    n_finish=None,
+    k_limit=None,
 ):
-    """Create data for n_start <= n <= n_finish with option to restrict k"""
+    """Create data as create_data does but overlapping file I/O with generation.
+    The parents of the next n,k are loaded on a background thread while the current
+    n,k is being generated, and the result is handed to a write-behind thread to save.
+
+    The workers, columnar parents and memory budget are taken from the environment
+    as for create_ancestors_nk. A level forecast to be over the budget is generated
+    through work units on disk once the saves in progress are done, without overlap.
+    The forecast is for one level, so with the next parents prefetched the
+    peak can be above it"""
     if n_finish is None:
         n_finish = n_start
+    levels = []
     for n in range(n_start, n_finish + 1):
         k_stop = n + 1
         if k_limit:
             k_stop = k_limit + 1
         for k in range(1, k_stop):
-            create_ancestors_nk(poly_class, collinearity, n, k)
+            levels.append((n, k))
+    # the stale levels and all those generated from them are rebuilt
+    jobs = stale_levels(poly_class, collinearity, levels)
+    if not jobs:
+        return
+    telemetry = get_telemetry()
+    telemetry.start_run(poly_class, collinearity, jobs)
+
+    # saves in progress keyed on n,k, a load must wait for the levels it reads
+    saves = {}
+
+    def load(n, k):
+        for level in ((n - 1, k - 1), (n - 1, k)):
+            if level in saves:
+                saves[level].result()
+        # the forecast counts the rows of the parents so is made once they are saved
+        if needs_work_units(poly_class, collinearity, n, k):
+            return None
+        # keep the console clear for the progress of the current generation
+        return load_generation_parents(poly_class, collinearity, n, k, silent=True)
+
+    with ThreadPoolExecutor(1) as loader, ThreadPoolExecutor(1) as writer:
+        loading = loader.submit(load, *jobs[0])
+        for i, (n, k) in enumerate(jobs):
+            parents = loading.result()
+
+            # the next job can only be prefetched now if it does not read this one
+            next_job = jobs[i + 1] if i + 1 < len(jobs) else None
+            prefetch = next_job and (n, k) not in (
+                (next_job[0] - 1, next_job[1] - 1),
+                (next_job[0] - 1, next_job[1]),
+            )
+            if prefetch:
+                loading = loader.submit(load, *next_job)
+
+            if parents is None:
+                from distributed import create_ancestors_nk_work_units
+
+                for saving in saves.values():
+                    saving.result()
+                create_ancestors_nk_work_units(poly_class, collinearity, n, k)
+            else:
+                same, prev = parents
+                del parents
+                ancestors = generate_ancestors_nk(
+                    poly_class, collinearity, n, k, same, prev, get_workers(), get_region()
+                )
+                del same, prev
+                saves[(n, k)] = writer.submit(
+                    save_level, poly_class, collinearity, n, k, ancestors
+                )
+                del ancestors
+
+            if next_job and not prefetch:
+                loading = loader.submit(load, *next_job)
+
+        # surface any errors from saving
+        for saving in saves.values():
+            saving.result()
+    telemetry.end_run()
+
+
+def generate_level_fused(poly_class: PolyShape, n: int, k_limit=None, region=None):
+    """Return the ancestors for every k of size n for both Lattice and Plane,
+    as 2 dicts keyed on k, from a single pass over the parents, keeping only the
+    children that fit the region if given.
+
+    Every parent is in the Lattice tree (Plane collinearity is never less than
+    Lattice) and each child is found once and given an id once. The collinearity
+    of a child for each type is the larger of its parent's and the most
+    collinear through the new point. The levels are then put together in the
+    order of the parent files so the output is the same as separate runs"""
+    if n == 1:
+        telemetry = get_telemetry()
+        telemetry.start_level(n, None, 0)
+        telemetry.end_level(1)
+        return {1: {"1": {}}}, {1: {"1": {}}}
+
+    k_parents = n - 1 if k_limit is None else min(n - 1, k_limit)
+    k_children = n if k_limit is None else min(n, k_limit)
+
+    # parent patterns from the Lattice tree and the Plane k for those in the Plane tree
+    kernel = poly_class.kernel()
+    lattice_parents = {
+        k: {
+            id: kernel.decoder(encoding)
+            for id, encoding in load_data_file(
+                poly_class, Lattice, Identifier, n - 1, k
+            ).items()
+        }
+        for k in range(1, k_parents + 1)
+    }
+    plane_parents = {
+        k: load_data_file(poly_class, Plane, Identifier, n - 1, k)
+        for k in range(1, k_parents + 1)
+    }
+    plane_k = {id: k for k, ids in plane_parents.items() for id in ids}
+
+    silent = os.environ.get("POLYOMINO_SILENT", False)
+    if not silent:
+        print(
+            f"Generating {Ancestor.file_name} for {poly_class.file_name} {Lattice.file_name} and {Plane.file_name} n={n}"
+        )
+
+    # descendants of each parent keyed on id with the removal point and k of the child
+    lattice_descendants = {}
+    plane_descendants = {}
+    cache = PatternIdCache()
+    total = sum(len(patterns) for patterns in lattice_parents.values())
+    telemetry = get_telemetry()
+    telemetry.start_level(n, None, total, cache, silent)
+
+    for lattice_k, patterns in lattice_parents.items():
+        for id, pattern in patterns.items():
+            parent_plane_k = plane_k.get(id)
+            lattice_d = {}
+            plane_d = {}
+            positions = {}
+            # one cell per orbit of the border as in expand_parent
+            for orbit in kernel.border_orbits(pattern):
+                position, np = orbit[-1]
+                new_pattern = pattern | {np}
+
+                child_lattice_k = max(
+                    lattice_k,
+                    kernel.get_maximum_collinear(
+                        Lattice, new_pattern, np, limit=k_limit
+                    ),
+                )
+                in_lattice = k_limit is None or child_lattice_k <= k_limit
+
+                in_plane = False
+                if parent_plane_k is not None:
+                    child_plane_k = max(
+                        parent_plane_k,
+                        kernel.get_maximum_collinear(
+                            Plane, new_pattern, np, limit=k_limit
+                        ),
+                    )
+                    in_plane = k_limit is None or child_plane_k <= k_limit
+
+                if not (in_lattice or in_plane):
+                    continue
+                if region is not None and not region.fits(kernel, new_pattern):
+                    continue
+
+                d_id, removal_point = kernel.get_pattern_id_cached(
+                    new_pattern, np, cache
+                )
+                if positions.get(d_id, -1) > position:
+                    continue
+                positions[d_id] = position
+                if in_lattice:
+                    lattice_d[d_id] = removal_point, child_lattice_k
+                if in_plane:
+                    plane_d[d_id] = removal_point, child_plane_k
+
+            lattice_descendants[id] = lattice_d
+            if parent_plane_k is not None:
+                plane_descendants[id] = plane_d
+            # every child in the Plane tree is in the Lattice tree too
+            telemetry.update(len(lattice_d))
+
+    telemetry.end_level(
+        len({d_id for d in lattice_descendants.values() for d_id in d})
+    )
+    if not silent:
+        print(cache.report())
+
+    def assemble(parents, descendants):
+        # ancestors of n,k from the parents in P(n-1,k-1) then P(n-1,k)
+        levels = {}
+        for k in range(1, k_children + 1):
+            ancestors = {}
+            for parent_k in (k - 1, k):
+                for id in parents.get(parent_k, ()):
+                    for d_id, (removal_point, d_k) in descendants[id].items():
+                        if d_k == k:
+                            ancestors.setdefault(d_id, {})[id] = removal_point
+            levels[k] = ancestors
+        return levels
+
+    return (
+        assemble(lattice_parents, lattice_descendants),
+        assemble(plane_parents, plane_descendants),
+    )
+
+
+def joint_distribution(lattice_levels: dict, plane_levels: dict) -> Counter:
+    """Return the counts of polyominoes by (Lattice k, Plane k) given the ids
+    of a size keyed on k for each type. The Plane k is None for those
+    only in the Lattice levels, i.e. beyond a k limit"""
+    plane_k = {id: k for k, ids in plane_levels.items() for id in ids}
+    return Counter(
+        (k, plane_k.get(id)) for k, ids in lattice_levels.items() for id in ids
+    )
+
+
+def create_data_fused(
+    poly_class: PolyShape,
+    n_start: int,
+    n_finish=None,
+    k_limit=None,
+    overwrite=False,
+) -> dict:
+    """Create the Lattice and Plane data for n_start <= n <= n_finish together,
+    with option to restrict k. Returns the joint distribution of each n"""
+    if n_finish is None:
+        n_finish = n_start
+
+    storage = get_storage()
+
+    def level_exists(n):
+        k_stop = n + 1 if k_limit is None else min(n, k_limit) + 1
+        return all(
+            storage.exists(poly_class, collinearity, n, k)
+            for collinearity in (Lattice, Plane)
+            for k in range(1, k_stop)
+        )
+
+    telemetry = get_telemetry()
+    telemetry.start_run(
+        poly_class,
+        None,
+        [
+            (n, None)
+            for n in range(n_start, n_finish + 1)
+            if overwrite or not level_exists(n)
+        ],
+    )
+    joint = {}
+    for n in range(n_start, n_finish + 1):
+        if not overwrite and level_exists(n):
+            print(
+                f"Files exist already for {Ancestor.file_name} for {poly_class.file_name} {Lattice.file_name} and {Plane.file_name} n={n}"
+            )
+            continue
+
+        lattice_levels, plane_levels = generate_level_fused(
+            poly_class, n, k_limit, get_region()
+        )
+        for collinearity, levels in ((Lattice, lattice_levels), (Plane, plane_levels)):
+            for k, ancestors in levels.items():
+                save_level(poly_class, collinearity, n, k, ancestors)
+        joint[n] = joint_distribution(lattice_levels, plane_levels)
+
+    telemetry.end_run()
+    return joint
@@ -0,0 +1,139 @@
+"""Generating a level across local worker processes sharing the parents.
+
+The parents of n,k are packed once in to a multiprocessing.shared_memory block
+as the row masks of their ids (see polyset.py) along with a flag for those from
+P(n-1,k)
+
+    keys    uint64 (N, n-1)
+    same    uint8 (N)
+
+Workers attach to the block read only when they start and are then handed
+ranges of rows, decoding only the parents in their range. So the parents are
+held once whatever the number of workers and no more than a range is sent to a
+worker. The descendants come back in the order of the parents so the result is
+the same as generating in a single process.
+
+Setting POLYOMINO_WORKERS has create_ancestors_nk generate this way.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from classes import ENCODING_SEPARATOR, CollinearityType, PatternIdCache, PolyShape
+from generation import expand_parent
+from polyset import PolyominoSet, id_to_key
+
+# most parents handed to a worker at a time
+PARALLEL_CHUNK = 1000
+
+# the shared block and what the worker needs to expand from it
+_worker = {}
+
+
+def shared_arrays(buffer, count: int, width: int) -> tuple:
+    """Return the keys and same flag arrays laid out in the buffer"""
+    keys = np.ndarray((count, width), dtype=np.uint64, buffer=buffer)
+    same = np.ndarray((count,), dtype=np.uint8, buffer=buffer, offset=keys.nbytes)
+    return keys, same
+
+
+def attach_worker(
+    name: str,
+    count: int,
+    width: int,
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    k: int,
+    region=None,
+):
+    """Attach a worker process to the shared parents"""
+    shm = shared_memory.SharedMemory(name)
+    keys, same = shared_arrays(shm.buf, count, width)
+    keys.flags.writeable = False
+    same.flags.writeable = False
+    _worker.update(
+        shm=shm,
+        keys=keys,
+        same=same,
+        poly_class=poly_class,
+        kernel=poly_class.kernel(),
+        collinearity=collinearity,
+        k=k,
+        region=region,
+        cache=PatternIdCache(),
+    )
+
+
+def expand_rows(rows: tuple) -> tuple:
+    """Return the id and descendants of each parent in a range of rows
+    along with the pattern id cache hits and misses while expanding them"""
+    start, stop = rows
+    kernel = _worker["kernel"]
+    cache = _worker["cache"]
+    hits, misses = cache.hits, cache.misses
+    results = []
+    for key, from_same in zip(
+        _worker["keys"][start:stop].tolist(), _worker["same"][start:stop].tolist()
+    ):
+        encoding = tuple(v for v in key if v)
+        id = ENCODING_SEPARATOR.join(str(v) for v in encoding)
+        d_dict = expand_parent(
+            kernel,
+            _worker["collinearity"],
+            _worker["k"],
+            # built as load_parents_nk does so the border is walked in the same order
+            kernel.to_internal(_worker["poly_class"].decoder(encoding)),
+            bool(from_same),
+            cache,
+            _worker["region"],
+        )
+        results.append((id, d_dict))
+    return results, cache.hits - hits, cache.misses - misses
+
+
+def expand_parents_shared(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    same,
+    prev,
+    workers: int,
+    cache=None,
+    region=None,
+):
+    """Yield the id and descendants of each parent of n,k in order, expanded by
+    the workers from the parents in shared memory. The hits and misses of the
+    workers' pattern id caches are added to the cache given"""
+    count = len(prev)
+    width = n - 1
+    nbytes = count * width * 8 + count
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    try:
+        keys, flags = shared_arrays(shm.buf, count, width)
+        if isinstance(prev, PolyominoSet):
+            keys[:] = prev.keys_array
+        else:
+            for row, id in enumerate(prev):
+                keys[row] = id_to_key(id, width)
+        flags[:] = [id in same for id in prev]
+        # the views must go before the block can be closed
+        del keys, flags
+
+        chunk = max(min(PARALLEL_CHUNK, count // (workers * 4)), 1)
+        with ProcessPoolExecutor(
+            workers,
+            initializer=attach_worker,
+            initargs=(shm.name, count, width, poly_class, collinearity, k, region),
+        ) as executor:
+            for results, hits, misses in executor.map(
+                expand_rows,
+                [(start, min(start + chunk, count)) for start in range(0, count, chunk)],
+            ):
+                if cache is not None:
+                    cache.hits += hits
+                    cache.misses += misses
+                yield from results
+    finally:
+        shm.close()
+        shm.unlink()
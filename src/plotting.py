@@ -0,0 +1,213 @@
+"""Plotting polyominoes with matplotlib.
+This is kept apart from the classes so generation does not need to import matplotlib"""
+
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, cos, pi, sin, sqrt
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
+import matplotlib.pyplot as plt
+from matplotlib.patches import RegularPolygon
+from classes import PolyShape
+from utils import get_pattern_limits
+
+# gallery layout, a slot is the space given to each polyomino on a sheet
+GALLERY_SLOT_INCHES = 1.2
+GALLERY_MARGIN = 1.0
+
+
+def plot_pattern(poly_class: PolyShape, pattern, to_file=True, show_graph=True):
+    """Plot the pattern given id, tuple or point set, saving to file if given an id"""
+
+    marker_size = 10
+    id = None
+    if isinstance(pattern, str):
+        id = pattern
+    console_points = poly_class.pattern_to_points(pattern)
+
+    edges = None
+    if show_graph and id:
+        gph = poly_class.get_graph(id)
+        edges = graph_to_plot(poly_class, gph)
+        marker_size = 30
+
+    # adjustment from console row/col points
+    # to matplotlib x,y
+    plot_points = poly_class.console_to_plot(console_points)
+
+    # we need to scale the marker based on the
+    # physical space the polyomino takes up
+    min_r, min_c, max_r, max_c = get_pattern_limits(plot_points)
+    marker_scale = max((max_r - min_r), ((max_c - min_c)))
+    marker_scale = (marker_size / marker_scale) ** 2
+
+    fig, ax = plt.subplots(1)
+    ax.set_aspect("equal")
+    ax.axis("off")
+
+    # Add some coloured cells
+    for x, y in plot_points:
+        cell = RegularPolygon(
+            (x, y),
+            numVertices=poly_class.symmetry,
+            radius=poly_class.plot_radius,
+            orientation=poly_class.plot_orientation,
+            facecolor=poly_class.plot_facecolor,
+            alpha=0.5,
+            edgecolor="k",
+            zorder=0,
+        )
+        ax.add_patch(cell)
+
+    # Also add scatter points in cell centres
+    X = [p[0] for p in plot_points]
+    Y = [p[1] for p in plot_points]
+    ax.scatter(X, Y, c="k", s=marker_scale * 2, zorder=20)
+
+    # optional graph
+    if edges:
+        lc = LineCollection(edges, linewidth=3, zorder=10)
+        ax.add_collection(lc)
+
+    if to_file and id:
+        fig.tight_layout()
+        plt.savefig(f"{poly_class.file_name} {id}.png")
+        return
+
+    plt.show()
+
+
+def graph_to_plot(poly_class: PolyShape, gph) -> list:
+    """Return the edges of the graph as pairs of plot coordinates"""
+    edges = []
+    for u, es in gph.items():
+        u = poly_class.doubled_to_plot(poly_class.point_to_doubled(u))
+        for v in es:
+            v = poly_class.doubled_to_plot(poly_class.point_to_doubled(v))
+            edges.append((u, v))
+    return edges
+
+
+def cell_vertices(poly_class: PolyShape, centre, radius: float) -> list:
+    """Return the vertices of the cell polygon drawn at the centre,
+    matching the orientation used by RegularPolygon"""
+    x, y = centre
+    angles = [
+        pi / 2 + poly_class.plot_orientation + 2 * pi * i / poly_class.symmetry
+        for i in range(poly_class.symmetry)
+    ]
+    return [(x + radius * cos(a), y + radius * sin(a)) for a in angles]
+
+
+def plot_gallery(
+    poly_class: PolyShape,
+    patterns,
+    file_path: str,
+    columns=None,
+    show_graph=False,
+    labels=False,
+):
+    """Draw many polyominoes on to a single sheet and save it to file_path,
+    the format (png, svg etc.) follows the file extension.
+    Patterns are given as ids or encodings, or a PolyominoSet. All the cells go in to a single
+    PolyCollection and any graph edges in to a single LineCollection.
+    Drawing is done on a Figure without pyplot so it runs headless with Agg"""
+    patterns = list(patterns)
+    if columns is None:
+        columns = ceil(sqrt(len(patterns)))
+    rows = ceil(len(patterns) / columns)
+
+    # the plot points for each polyomino moved to the origin
+    # along with the largest extent so every slot is the same size
+    shapes = []
+    extent = 1
+    for pattern in patterns:
+        plot_points = poly_class.console_to_plot(poly_class.pattern_to_points(pattern))
+        min_x, min_y, max_x, max_y = get_pattern_limits(plot_points)
+        shapes.append((pattern, plot_points, (min_x, min_y, max_y)))
+        extent = max(extent, max_x - min_x, max_y - min_y)
+    slot = extent + 2 * poly_class.plot_radius + GALLERY_MARGIN
+
+    fig = Figure(figsize=(columns * GALLERY_SLOT_INCHES, rows * GALLERY_SLOT_INCHES))
+    ax = fig.add_axes((0, 0, 1, 1))
+    ax.set_aspect("equal")
+    ax.axis("off")
+
+    cells = []
+    edges = []
+    for i, (pattern, plot_points, (min_x, min_y, max_y)) in enumerate(shapes):
+        row, col = divmod(i, columns)
+        # shift so each polyomino sits in the top left of its slot
+        dx = col * slot - min_x
+        dy = -row * slot - max_y
+        if labels:
+            ax.text(
+                col * slot - poly_class.plot_radius,
+                min_y + dy - poly_class.plot_radius - GALLERY_MARGIN / 4,
+                str(pattern),
+                fontsize=3,
+                verticalalignment="top",
+            )
+        for x, y in plot_points:
+            cells.append(
+                cell_vertices(poly_class, (x + dx, y + dy), poly_class.plot_radius)
+            )
+
+        if show_graph:
+            gph = poly_class.get_graph(pattern)
+            for u, v in graph_to_plot(poly_class, gph):
+                edges.append(((u[0] + dx, u[1] + dy), (v[0] + dx, v[1] + dy)))
+
+    ax.add_collection(
+        PolyCollection(
+            cells,
+            facecolors=poly_class.plot_facecolor,
+            edgecolors="k",
+            linewidths=0.3,
+            zorder=0,
+        )
+    )
+    if edges:
+        ax.add_collection(LineCollection(edges, colors="k", linewidths=0.8, zorder=10))
+
+    pad = poly_class.plot_radius + GALLERY_MARGIN / 2
+    ax.set_xlim(-pad, columns * slot - pad)
+    ax.set_ylim(-rows * slot + pad, pad)
+    fig.savefig(file_path)
+    return file_path
+
+
+def _plot_gallery_sheet(args):
+    """Unpack the arguments for a sheet rendered in a worker process"""
+    return plot_gallery(*args)
+
+
+def render_gallery(
+    poly_class: PolyShape,
+    patterns,
+    file_prefix: str,
+    per_sheet=100,
+    fmt="png",
+    columns=None,
+    show_graph=False,
+    labels=False,
+    workers=None,
+) -> list:
+    """Render the patterns as a set of gallery sheets with per_sheet polyominoes on each.
+    Sheets are drawn in parallel worker processes, returns the list of files created"""
+    patterns = list(patterns)
+    sheets = [
+        (
+            poly_class,
+            patterns[i : i + per_sheet],
+            f"{file_prefix}_{i // per_sheet + 1:03d}.{fmt}",
+            columns,
+            show_graph,
+            labels,
+        )
+        for i in range(0, len(patterns), per_sheet)
+    ]
+    if workers == 1 or len(sheets) == 1:
+        return [_plot_gallery_sheet(sheet) for sheet in sheets]
+
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(_plot_gallery_sheet, sheets))
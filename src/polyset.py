@@ -0,0 +1,286 @@
+"""A columnar container for a whole level P(n,k) held as NumPy arrays.
+
+A loaded level is otherwise a dict of string ids to frozensets of tuples which
+costs hundreds of bytes per polyomino. Here the level is held as 2 arrays
+
+    keys    uint64 (N, n)        the row masks of the id, padded with 0 rows
+    cells   int16 (N, n, dims)   the cells of each polyomino decoded from its id
+
+saved as set_<n>_<k>.keys.npy and set_<n>_<k>.cells.npy alongside the ancestor
+files and memory mapped when loaded. The cells can always be decoded from the keys,
+they are saved so that loading does not have to.
+
+A PolyominoSet is a read only mapping of id to pattern (frozenset of points) in the
+order of the file it came from, so it can be used wherever a loaded level is.
+Setting POLYOMINO_COLUMNAR has create_ancestors_nk and create_data_pipelined
+load the parents this way.
+
+Row masks are held in 64 bits, which covers every polyomino exact generation
+can reach (n <= 64 for squares and n <= 32 for hexagons).
+"""
+
+import os
+from collections.abc import Mapping
+import numpy as np
+from classes import (
+    ENCODING_SEPARATOR,
+    CollinearityType,
+    Identifier,
+    PolyShape,
+    encoding_str_to_tuple,
+)
+from generation import is_connected, load_data_file
+
+MASK_BITS = 64
+
+# rows decoded at a time, bounding the memory of the bit array
+DECODE_CHUNK = 65536
+
+
+def get_set_path(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, name: str
+) -> str:
+    """Return the path of the keys or cells array of a level"""
+    file_path = poly_class.get_file_path(collinearity, Identifier, n, k)
+    return os.path.join(os.path.dirname(file_path), f"set_{n:02d}_{k:02d}.{name}.npy")
+
+
+def doubled_matrices(poly_class: PolyShape) -> tuple:
+    """Return the matrices to the doubled row/col frame and back from it.
+    Going back gives twice the point, as the doubled frame of the hexagon
+    only has a point at every other position"""
+    kernel = poly_class.kernel()
+    to_doubled = np.array(kernel.to_doubled, dtype=np.int64) @ np.array(
+        kernel.to_internal_matrix, dtype=np.int64
+    )
+    from_doubled = np.array(
+        [poly_class.doubled_to_point((2, 0)), poly_class.doubled_to_point((0, 2))],
+        dtype=np.int64,
+    ).T
+    return to_doubled, from_doubled
+
+
+def encode_cells(poly_class: PolyShape, cells: np.ndarray) -> np.ndarray:
+    """Return the row masks of each polyomino as they lie, the vectorised
+    equivalent of PolyShape.encoder after normalising the position the same
+    way as ShapeKernel.encode_doubled"""
+    to_doubled, _ = doubled_matrices(poly_class)
+    count, n, _ = cells.shape
+    doubled = cells.astype(np.int64) @ to_doubled.T
+    r, c = doubled[:, :, 0], doubled[:, :, 1]
+
+    skew = poly_class.doubled_skew
+    min_r = r.min(axis=1, keepdims=True)
+    min_c = (c - skew * r).min(axis=1, keepdims=True) + skew * min_r
+    r = r - min_r
+    c = c - min_c
+    if count and c.max() >= MASK_BITS:
+        raise RuntimeError(f"Polyominoes wider than {MASK_BITS} cells can not be keyed")
+
+    keys = np.zeros((count, n), dtype=np.uint64)
+    rows = (np.arange(count)[:, None] * n + r).ravel()
+    masks = np.left_shift(np.uint64(1), c.astype(np.uint64)).ravel()
+    np.bitwise_or.at(keys.reshape(-1), rows, masks)
+    return keys
+
+
+def decode_keys(poly_class: PolyShape, keys: np.ndarray) -> np.ndarray:
+    """Return the cells of each polyomino from its row masks,
+    the vectorised equivalent of PolyShape.decoder"""
+    _, from_doubled = doubled_matrices(poly_class)
+    count, n = keys.shape
+    cells = np.zeros((count, n, poly_class.dimensions), dtype=np.int16)
+    if not count:
+        return cells
+
+    width = int(keys.max()).bit_length()
+    bits = np.arange(width, dtype=np.uint64)
+    for start in range(0, count, DECODE_CHUNK):
+        chunk = np.asarray(keys[start : start + DECODE_CHUNK])
+        # row major order of set bits gives the cells in the same order as decoder
+        _, r, c = np.nonzero((chunk[:, :, None] >> bits) & np.uint64(1))
+        doubled = np.stack([r, c], axis=1).astype(np.int64)
+        if len(doubled) != len(chunk) * n:
+            raise RuntimeError(f"Keys do not all have {n} cells")
+        points = (doubled @ from_doubled.T) // 2
+        cells[start : start + len(chunk)] = points.reshape(len(chunk), n, -1)
+    return cells
+
+
+def id_to_key(id: str, n: int) -> np.ndarray:
+    """Return the row masks of an id padded to n rows"""
+    key = np.zeros(n, dtype=np.uint64)
+    masks = encoding_str_to_tuple(id)
+    key[: len(masks)] = masks
+    return key
+
+
+class PolyominoSet(Mapping):
+    """A set of polyominoes of size n as arrays of row masks and cells,
+    behaving as a read only dict of id to pattern"""
+
+    def __init__(self, poly_class: PolyShape, n: int, keys: np.ndarray, cells=None):
+        self.poly_class = poly_class
+        self.n = n
+        self.keys_array = keys
+        if cells is None:
+            cells = decode_keys(poly_class, keys)
+        self.cells = cells
+        self._index = None
+
+    @classmethod
+    def from_ids(cls, poly_class: PolyShape, n: int, ids) -> "PolyominoSet":
+        """Return the set of the polyominoes given by their ids"""
+        ids = list(ids)
+        keys = np.zeros((len(ids), n), dtype=np.uint64)
+        for row, id in enumerate(ids):
+            keys[row] = id_to_key(id, n)
+        return cls(poly_class, n, keys)
+
+    @classmethod
+    def from_patterns(cls, poly_class: PolyShape, n: int, patterns) -> "PolyominoSet":
+        """Return the set of the polyominoes given as point sets in their
+        preferred orientation e.g. the values of load_polyomino_patterns_nk"""
+        cells = np.array(
+            [sorted(pattern) for pattern in patterns], dtype=np.int16
+        ).reshape(-1, n, poly_class.dimensions)
+        return cls(poly_class, n, encode_cells(poly_class, cells))
+
+    @classmethod
+    def concatenate(cls, poly_class: PolyShape, n: int, sets) -> "PolyominoSet":
+        """Return a single set of the sets one after another"""
+        sets = list(sets)
+        if not sets:
+            return cls(poly_class, n, np.zeros((0, n), dtype=np.uint64))
+        return cls(
+            poly_class,
+            n,
+            np.concatenate([s.keys_array for s in sets]),
+            np.concatenate([s.cells for s in sets]),
+        )
+
+    @classmethod
+    def load(
+        cls,
+        poly_class: PolyShape,
+        collinearity: CollinearityType,
+        n: int,
+        k: int,
+        mmap_mode="r",
+    ) -> "PolyominoSet":
+        """Load the set of a level saved as .npy, memory mapped by default"""
+        arrays = [
+            np.load(get_set_path(poly_class, collinearity, n, k, name), mmap_mode)
+            for name in ("keys", "cells")
+        ]
+        return cls(poly_class, n, *arrays)
+
+    def save(self, collinearity: CollinearityType, k: int):
+        """Save the set as the level n,k"""
+        for name, array in (("keys", self.keys_array), ("cells", self.cells)):
+            file_path = get_set_path(self.poly_class, collinearity, self.n, k, name)
+            # written under another name first so a reader never maps half a file
+            with open(file_path + ".tmp", "wb") as file_obj:
+                np.save(file_obj, array)
+            os.replace(file_path + ".tmp", file_path)
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys_array.nbytes + self.cells.nbytes
+
+    def get_id(self, row: int) -> str:
+        """Return the id of the polyomino in the row"""
+        return ENCODING_SEPARATOR.join(
+            str(v) for v in self.keys_array[row].tolist() if v
+        )
+
+    def get_pattern(self, row: int) -> frozenset:
+        """Return the points of the polyomino in the row"""
+        return frozenset(tuple(p) for p in self.cells[row].tolist())
+
+    def get_row(self, id: str):
+        """Return the row of the id or None if it is not in the set"""
+        if self._index is None:
+            self._index = {self.get_id(row): row for row in range(len(self))}
+        return self._index.get(id)
+
+    def __len__(self):
+        return len(self.keys_array)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self.get_id(row)
+
+    def __contains__(self, id):
+        return self.get_row(id) is not None
+
+    def __getitem__(self, id: str) -> frozenset:
+        row = self.get_row(id)
+        if row is None:
+            raise KeyError(id)
+        return self.get_pattern(row)
+
+    def items(self):
+        for row in range(len(self)):
+            yield self.get_id(row), self.get_pattern(row)
+
+
+def load_level_set(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> PolyominoSet:
+    """Return the level n,k as a PolyominoSet, memory mapped from its .npy files.
+    They are created from the ancestor file when missing or older than it"""
+    text_path = poly_class.get_file_path(collinearity, Identifier, n, k)
+    keys_path = get_set_path(poly_class, collinearity, n, k, "keys")
+    cells_path = get_set_path(poly_class, collinearity, n, k, "cells")
+    text_time = os.path.getmtime(text_path) if os.path.isfile(text_path) else 0
+    if not all(
+        os.path.isfile(path) and os.path.getmtime(path) >= text_time
+        for path in (keys_path, cells_path)
+    ):
+        ids = load_data_file(poly_class, collinearity, Identifier, n, k)
+        PolyominoSet.from_ids(poly_class, n, ids).save(collinearity, k)
+    return PolyominoSet.load(poly_class, collinearity, n, k)
+
+
+def load_parents_nk_set(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int, silent=None
+):
+    """Same as generation.load_parents_nk returning PolyominoSets"""
+    empty = PolyominoSet.concatenate(poly_class, n - 1, [])
+    if n == 1:
+        return empty, empty
+
+    same = empty
+    prev = empty
+    if k < n:
+        same = load_level_set(poly_class, collinearity, n - 1, k)
+    if k > 1:
+        prev = load_level_set(poly_class, collinearity, n - 1, k - 1)
+    return same, PolyominoSet.concatenate(poly_class, n - 1, [prev, same])
+
+
+def verify_set(poly_set: PolyominoSet, collinearity: CollinearityType, k: int) -> int:
+    """Check every polyomino of the set is a distinct connected polyomino of n cells
+    with k collinear held in its preferred orientation, returns the number checked"""
+    poly_class = poly_set.poly_class
+    kernel = poly_class.kernel()
+    keys = np.asarray(poly_set.keys_array)
+
+    if len(np.unique(keys, axis=0)) != len(keys):
+        raise RuntimeError("Set holds the same polyomino more than once")
+    if not np.array_equal(encode_cells(poly_class, decode_keys(poly_class, keys)), keys):
+        raise RuntimeError("Keys are not the encoding of their cells")
+
+    for id, pattern in poly_set.items():
+        pattern = kernel.to_internal(pattern)
+        if len(pattern) != poly_set.n or not is_connected(kernel, pattern):
+            raise RuntimeError(f"{id} is not a polyomino of {poly_set.n} cells")
+        if kernel.get_pattern_id(pattern, next(iter(pattern)))[0] != id:
+            raise RuntimeError(f"{id} is not in its preferred orientation")
+        max_collinear = max(
+            kernel.get_maximum_collinear(collinearity, pattern, p) for p in pattern
+        )
+        if max_collinear != k:
+            raise RuntimeError(f"{id} has {max_collinear} collinear not {k}")
+    return len(poly_set)
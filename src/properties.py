@@ -0,0 +1,194 @@
+"""A table of properties of every polyomino of a level, kept alongside the ancestor files.
+
+Answering questions like which polyominoes of P(n,k) have full symmetry or which
+is the widest otherwise means loading the level and decoding every pattern again.
+Instead a level's table is saved as the columns of properties_<n>_<k>.npz
+
+    ids         the ids in the order of the level as the table was built
+    symmetry    the order of the symmetry group, 1 up to 2 * the shape's symmetry
+    height      rows spanned in the doubled frame of the id
+    width       columns spanned in the doubled frame of the id, for hexagons these
+                are half a cell wide
+    lattice_k   the most cells collinear along the lattice
+    plane_k     the most cells collinear anywhere in the plane
+    perimeter   edges between a cell and one not in the polyomino
+    parents     the number of parents in the ancestor file
+
+along with the digest of the level (see LevelDigest), so a table left behind
+by a level since rebuilt is noticed and built again. Height and width are those
+of the preferred orientation given by the id.
+
+Setting POLYOMINO_PROPERTIES has save_level write the table of each level as it
+is generated, otherwise it is built from the level the first time it is loaded.
+"""
+
+import json
+import os
+from functools import reduce
+from operator import add, or_
+import numpy as np
+from classes import (
+    Ancestor,
+    CollinearityType,
+    Lattice,
+    Plane,
+    PolyShape,
+    encoding_str_to_tuple,
+)
+from generation import get_level_digest
+from storage import get_storage
+
+PROPERTY_COLUMNS = (
+    "symmetry",
+    "height",
+    "width",
+    "lattice_k",
+    "plane_k",
+    "perimeter",
+    "parents",
+)
+
+
+def get_properties_path(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> str:
+    """Return the path of the property table of a level"""
+    file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+    return os.path.join(os.path.dirname(file_path), f"properties_{n:02d}_{k:02d}.npz")
+
+
+def digest_key(digest: dict) -> str:
+    """Return the digest of a level as the string kept in its table"""
+    return json.dumps(digest, sort_keys=True)
+
+
+def polyomino_properties(
+    poly_class: PolyShape, collinearity: CollinearityType, k: int, id: str, parents: int
+) -> tuple:
+    """Return the properties of a polyomino of a level with k collinear
+    in the order of PROPERTY_COLUMNS"""
+    kernel = poly_class.kernel()
+    encoding = encoding_str_to_tuple(id)
+    # the columns from the lowest bit of any row to the highest
+    columns = reduce(or_, encoding)
+    pattern = kernel.decoder(encoding)
+    perimeter = sum(
+        tuple(map(add, p, v)) not in pattern for p in pattern for v in kernel.vectors
+    )
+    lattice_k, plane_k = (
+        k if other is collinearity else kernel.get_pattern_collinear(other, pattern)
+        for other in (Lattice, Plane)
+    )
+    return (
+        len(kernel.automorphisms(pattern)),
+        len(encoding),
+        columns.bit_length() - (columns & -columns).bit_length() + 1,
+        lattice_k,
+        plane_k,
+        perimeter,
+        parents,
+    )
+
+
+class PropertyTable:
+    """The property table of a level, each column a NumPy array in the order of the level"""
+
+    def __init__(self, poly_class: PolyShape, n: int, k: int, columns: dict):
+        self.poly_class = poly_class
+        self.n = n
+        self.k = k
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["ids"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def ids(self, mask=None) -> list:
+        """Return the ids of the rows where the mask is True, or every id"""
+        ids = self.columns["ids"]
+        if mask is not None:
+            ids = ids[mask]
+        return [id.decode() for id in ids.tolist()]
+
+    def where(self, **conditions) -> np.ndarray:
+        """Return the mask of the rows where every column given has the value given"""
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            mask &= self.columns[name] == value
+        return mask
+
+
+def save_properties(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    n: int,
+    k: int,
+    ancestors: dict,
+    digest: dict,
+) -> PropertyTable:
+    """Work out and save the property table of a level given its ancestors
+    and digest, returning the table"""
+    rows = [
+        polyomino_properties(poly_class, collinearity, k, id, len(parents))
+        for id, parents in ancestors.items()
+    ]
+    values = np.array(rows, dtype=np.uint16).reshape(len(rows), len(PROPERTY_COLUMNS))
+    columns = {"ids": np.array(list(ancestors), dtype=np.bytes_)}
+    columns.update((name, values[:, c]) for c, name in enumerate(PROPERTY_COLUMNS))
+
+    file_path = get_properties_path(poly_class, collinearity, n, k)
+    # written under another name first so a reader never loads half a file
+    with open(file_path + ".tmp", "wb") as file_obj:
+        np.savez(file_obj, digest=np.array(digest_key(digest)), **columns)
+    os.replace(file_path + ".tmp", file_path)
+    return PropertyTable(poly_class, n, k, columns)
+
+
+def load_properties(
+    poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+) -> PropertyTable:
+    """Load the property table of a level, building it from the level when
+    there is none or the level has changed since it was saved"""
+    digest = get_level_digest(poly_class, collinearity, n, k)
+    if digest is None:
+        raise RuntimeError(
+            f"Level {poly_class.file_name} {collinearity.file_name} n={n} k={k} not found"
+        )
+    file_path = get_properties_path(poly_class, collinearity, n, k)
+    if os.path.isfile(file_path):
+        with np.load(file_path) as arrays:
+            if str(arrays["digest"]) == digest_key(digest):
+                columns = {
+                    name: arrays[name] for name in arrays.files if name != "digest"
+                }
+                return PropertyTable(poly_class, n, k, columns)
+
+    ancestors = dict(get_storage().iter_rows(poly_class, collinearity, Ancestor, n, k))
+    return save_properties(poly_class, collinearity, n, k, ancestors, digest)
+
+
+def query_properties(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    max_n: int,
+    where,
+    n_start=1,
+    k_limit=None,
+) -> list:
+    """Return the n, k and id of every polyomino of the levels from n_start to max_n
+    (and up to k_limit) that have been created where the condition holds, the
+    condition being given a level's PropertyTable and returning a mask of its rows.
+    For example those with full symmetry
+
+        lambda table: table["symmetry"] == 2 * poly_class.symmetry"""
+    storage = get_storage()
+    results = []
+    for n in range(n_start, max_n + 1):
+        for k in range(1, min(n, k_limit or n) + 1):
+            if not storage.exists(poly_class, collinearity, n, k):
+                continue
+            table = load_properties(poly_class, collinearity, n, k)
+            results.extend((n, k, id) for id in table.ids(where(table)))
+    return results
@@ -1,8 +1,20 @@
 """Functions for reporting"""
 
 from collections import defaultdict
-from classes import Ancestor, CollinearityType, Identifier, PolyShape, get_row_count
-from generation import load_ancestors_nk, load_data_file, load_polyomino_patterns_nk
+from classes import (
+    CollinearityType,
+    Identifier,
+    Lattice,
+    Plane,
+    PolyShape,
+)
+from generation import (
+    joint_distribution,
+    load_ancestors_nk,
+    load_data_file,
+    load_polyomino_patterns_nk,
+)
+from storage import get_storage
 from utils import reverse_dag
 
 
@@ -11,17 +23,11 @@ def get_summary(
 ):
     """Return the summary counts as a dict keyed on (n,k)"""
     summary = defaultdict(int)
+    storage = get_storage()
     for n in range(1, max_m + 1):
         for k in range(1, n + 1):
-            file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
-            row_count = default
-            try:
-                with open(file_path, "r") as file_obj:
-                    meta = file_obj.readline()
-                    row_count = get_row_count(meta)
-            except:
-                pass
-            summary[(n, k)] = row_count
+            row_count = storage.row_count(poly_class, collinearity, n, k)
+            summary[(n, k)] = default if row_count is None else row_count
     return summary
 
 
@@ -140,3 +146,36 @@ def load_polyomino_patterns_n_le_k(
         k_dict = load_data_file(poly_class, collinearity, Identifier, n, k)
         polyominoes.update(k_dict)
     return polyominoes
+
+
+def output_joint_table(poly_class: PolyShape, n: int, k_limit=None, cell_width=8):
+    """Output the number of polyominoes of size n by their Lattice k (rows)
+    and Plane k (columns) to console"""
+    k_stop = n + 1 if k_limit is None else min(n, k_limit) + 1
+    levels = {
+        collinearity: {
+            k: load_data_file(poly_class, collinearity, Identifier, n, k)
+            for k in range(1, k_stop)
+        }
+        for collinearity in (Lattice, Plane)
+    }
+    joint = joint_distribution(levels[Lattice], levels[Plane])
+
+    print()
+    print(f"{poly_class.title} of size {n} by Lattice (k) and Plane (k) collinearity")
+    print()
+    line = " L | " + "".join(f"{k:{cell_width}d}" for k in range(1, k_stop))
+    if k_limit is not None:
+        line += f"{'>' + str(k_limit):>{cell_width}s}"
+    print(line)
+    print("-" * len(line))
+    for lattice_k in range(1, k_stop):
+        line = f"{lattice_k:2d} | "
+        plane_ks = list(range(1, k_stop))
+        if k_limit is not None:
+            plane_ks.append(None)
+        for plane_k in plane_ks:
+            cnt = joint.get((lattice_k, plane_k))
+            line += " " * cell_width if cnt is None else f"{cnt:{cell_width}d}"
+        print(line)
+    print()
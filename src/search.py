@@ -0,0 +1,154 @@
+"""Searching directly for the largest polyominoes within a collinearity limit.
+
+Finding the largest polyomino with no more than k cells collinear by enumeration
+(as A378169.py and A377756.py do) means creating every level until one is empty.
+Here the polyominoes within the limit are walked depth first down the tree of
+canonical parents (see canonical_children) so only the path to the current
+polyomino and its siblings are ever held, whatever the size of the levels.
+
+Each free polyomino has a single canonical parent so is visited once,
+which breaks the symmetry without having to keep the ones seen. Collinearity
+never goes down as a polyomino grows so a child over the limit is pruned with
+everything below it, and the cell added to make it is never tried again anywhere
+below its parent.
+
+For workers the top of the tree is expanded breadth first until there are enough
+subtrees to go round, then the subtrees are searched in parallel.
+
+On the lattice with k >= 2 there are polyominoes within the limit of any size
+(staircases, for hexagons as well as squares), so the search needs max_n to cap
+it, or a region (see Region) when only the polyominoes fitting within it are wanted.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from classes import CollinearityType, Lattice, PolyShape
+from generation import canonical_children
+
+# the subtrees handed out are at least this many times the number of workers
+SUBTREES_PER_WORKER = 8
+
+
+def get_children(kernel, collinearity, k_limit, node, region=None) -> list:
+    """Return the nodes below a node, each being a pattern, its id, its
+    collinearity and the cells that can never be added below it"""
+    pattern, id, max_collinear, forbidden = node
+    forbidden = set(forbidden)
+    children = canonical_children(
+        kernel, collinearity, pattern, id, max_collinear, k_limit, forbidden, region
+    )
+    forbidden = frozenset(forbidden)
+    return [(child, d_id, d_collinear, forbidden) for child, d_id, d_collinear in children]
+
+
+def merge_results(results) -> tuple:
+    """Return the largest size of the results with all of its witnesses"""
+    best = 0
+    witnesses = []
+    for n, ids in results:
+        if n > best:
+            best, witnesses = n, list(ids)
+        elif n == best:
+            witnesses.extend(ids)
+    return best, witnesses
+
+
+def search_subtrees(args) -> tuple:
+    """Return the largest size below the root nodes and the ids of the
+    polyominoes of that size, searching depth first"""
+    poly_class, collinearity, k_limit, max_n, region, roots = args
+    kernel = poly_class.kernel()
+    best = 0
+    witnesses = []
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        n = len(node[0])
+        if n > best:
+            best, witnesses = n, [node[1]]
+        elif n == best:
+            witnesses.append(node[1])
+        if n != max_n:
+            stack.extend(get_children(kernel, collinearity, k_limit, node, region))
+    return best, witnesses
+
+
+def largest_polyominoes(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    k_limit: int,
+    max_n=None,
+    workers=None,
+    region=None,
+) -> tuple:
+    """Return the size of the largest polyominoes with no more than k cells collinear
+    and the ids of all of them, up to max_n and within the region if given.
+    On the lattice with k >= 2 one of them is needed for the search to end"""
+    if max_n is None and region is None and collinearity is Lattice and k_limit >= 2:
+        raise RuntimeError(
+            f"There are {poly_class.title} of any size with no more than {k_limit} cells collinear on the Lattice, give max_n or a region"
+        )
+    kernel = poly_class.kernel()
+    root = (kernel.to_internal({poly_class.origin}), "1", 1, frozenset())
+    if workers is None:
+        workers = cpu_count() or 1
+    if workers == 1:
+        best, witnesses = search_subtrees(
+            (poly_class, collinearity, k_limit, max_n, region, [root])
+        )
+        return best, sorted(witnesses)
+
+    # split the top of the tree in to subtrees, keeping the results above them
+    results = []
+    frontier = [root]
+    while frontier and len(frontier) < workers * SUBTREES_PER_WORKER:
+        n = len(frontier[0][0])
+        results.append((n, [node[1] for node in frontier]))
+        if n == max_n:
+            frontier = []
+            break
+        frontier = [
+            child
+            for node in frontier
+            for child in get_children(kernel, collinearity, k_limit, node, region)
+        ]
+
+    if frontier:
+        with ProcessPoolExecutor(workers) as executor:
+            results.extend(
+                executor.map(
+                    search_subtrees,
+                    [
+                        (poly_class, collinearity, k_limit, max_n, region, [node])
+                        for node in frontier
+                    ],
+                )
+            )
+    best, witnesses = merge_results(results)
+    return best, sorted(witnesses)
+
+
+def output_largest(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    k_limit: int,
+    max_n=None,
+    workers=None,
+    region=None,
+):
+    """Output the largest polyominoes with no more than k cells collinear to console"""
+    best, witnesses = largest_polyominoes(
+        poly_class, collinearity, k_limit, max_n, workers, region
+    )
+
+    print()
+    print(
+        f"Largest {poly_class.title} with no more than {k_limit} cells collinear on the {collinearity.file_name.title()} have {best} cells, {len(witnesses)} of them"
+    )
+    if best == max_n:
+        print(f"The search stopped at n={max_n} so there may be larger")
+    for id in witnesses:
+        print()
+        print(id)
+        poly_class.draw(id, pixel="#")
+    print()
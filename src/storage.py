@@ -0,0 +1,593 @@
+"""Where the levels P(n,k) are kept, behind a storage backend.
+
+Generation, reporting and the rest go through the Storage object from get_storage
+rather than the files themselves. POLYOMINO_STORAGE picks the backend
+
+    text        the ancestor files in the data folder (the default), read with
+                their ids in the standard form whichever form they were written in
+    memory      dicts held by the process, for tests and pipelined runs that
+                do not need to keep the levels
+    sqlite      polyominoes.sqlite in the data folder
+
+The SQLite database holds the tables
+
+    level       the shape, collinearity, n, k and row count of each level
+    polyomino   the id of each row of a level, indexed on id
+    edge        the parents of each row with the removal point, indexed on parent
+    build       the build record of each level
+
+so finding the level, parents or children of a polyomino is an indexed lookup
+rather than loading whole levels, as it is for the other backends.
+
+A level is always returned with its rows in the order they were saved, so every
+backend gives the same output.
+"""
+
+import json
+import os
+import sqlite3
+from itertools import groupby, islice
+from threading import Lock
+from classes import (
+    Ancestor,
+    CollinearityType,
+    DataType,
+    Identifier,
+    LevelDigest,
+    PolyShape,
+    encoding_str_to_tuple,
+    get_data_folder,
+    get_file_digest,
+    get_file_stat,
+    get_row_count,
+    is_compact,
+    open_data_file,
+)
+from utils import progress_bar_freq, progress_bar_update
+
+
+def get_data_folder_path() -> str:
+    data_folder = get_data_folder()
+    return os.path.join(os.path.dirname(__file__), f"../{data_folder}")
+
+
+def id_size(id: str) -> int:
+    """Return the number of cells of the polyomino from its id"""
+    return sum(bin(mask).count("1") for mask in encoding_str_to_tuple(id))
+
+
+def level_not_found(
+    poly_class: PolyShape,
+    collinearity: CollinearityType,
+    data_type: DataType,
+    n: int,
+    k: int,
+):
+    return RuntimeError(
+        f"{data_type.file_name} file for {poly_class.file_name} {collinearity.file_name} n={n} k={k} not found"
+    )
+
+
+class Storage:
+    """The interface of a storage backend, keeping nothing. A backend provides
+    exists, row_count, iter_rows, save, get_build and set_build, the rest is
+    built on those and can be replaced with something quicker"""
+
+    name = "none"
+
+    def exists(
+        self, poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+    ) -> bool:
+        """Return True if the level n,k has been saved"""
+        return False
+
+    def row_count(
+        self, poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+    ):
+        """Return the number of rows in the level or None if it has not been saved"""
+        return None
+
+    def iter_rows(
+        self,
+        poly_class: PolyShape,
+        collinearity: CollinearityType,
+        data_type: DataType,
+        n: int,
+        k: int,
+        limit=None,
+    ):
+        """Yield the id and data of each row of a level in order, the data being
+        the encoding for Identifier and the dict of ancestors for Ancestor"""
+        return iter(())
+
+    def save(
+        self,
+        poly_class: PolyShape,
+        collinearity: CollinearityType,
+        data_type: DataType,
+        n: int,
+        k: int,
+        rows: dict,
+    ):
+        """Save the rows of a level replacing any already saved and its
+        build record, returning the digest of the level (see LevelDigest)"""
+        return LevelDigest.from_rows(rows.items(), data_type)
+
+    def get_build(
+        self, poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+    ):
+        """Return the build record of a level (see generation.save_level) or None
+        if it has none or the level has been saved again since it was set"""
+        return None
+
+    def set_build(
+        self,
+        poly_class: PolyShape,
+        collinearity: CollinearityType,
+        n: int,
+        k: int,
+        record: dict,
+    ):
+        """Set the build record of a level"""
+        pass
+
+    def get_digest(
+        self, poly_class: PolyShape, collinearity: CollinearityType, n: int, k: int
+    ):
+        """Return the digest of a level (see LevelDigest) as a dict,
+        or None if it has not been saved"""
+        if not self.exists(poly_class, collinearity, n, k):
+            return None
+        rows = self.iter_rows(poly_class, collinearity, Ancestor, n, k)
+        return LevelDigest.from_rows(rows).to_dict()
+
+    def load(
+        self,
+        poly_class: PolyShape,
+        collinearity: CollinearityType,
+        data_type: DataType,
+        n: int,
+        k: int,
+        silent=None,
+    ) -> dict:
+        """Load a level into a dict and return it"""
+        row_count = self.row_count(poly_class, collinearity, n, k)
+        if row_count is None:
+            raise level_not_found(poly_class, collinearity, data_type, n, k)
+        if silent is None:
+            silent = os.environ.get("POLYOMINO_SILENT", False)
+        if not silent:
+            pbf = progress_bar_freq(row_count)
+            poly_class.start_loading(collinearity, data_type, n, k, row_count)
+
+        data_dict = {}
+        cnt = 0
+        for id, line_data in self.iter_rows(poly_class, collinearity, data_type, n, k):
+            data_dict[id] = line_data
+            cnt += 1
+            if not silent and (cnt % pbf == 0 or cnt == row_count):
+                progress_bar_update(row_count, cnt)
+        return data_dict
+
+    def get_level(
+        self, poly_class: PolyShape, collinearity: CollinearityType, id: str
+    ) -> tuple:
+        """Return the n,k of the polyomino, raising KeyError if it is not saved"""
+        n = id_size(id)
+        for k in range(1, n + 1):
+            if not self.exists(poly_class, collinearity, n, k):
+                continue
+            for row_id, _ in self.iter_rows(poly_class, collinearity, Identifier, n, k):
+                if row_id == id:
+                    return n, k
+        raise KeyError(id)
+
+    def get_parents(
+        self, poly_class: PolyShape, collinearity: CollinearityType, id: str
+    ) -> dict:
+        """Return the parents of the polyomino keyed on id, the value being
+        the removal point from the polyomino to get to the parent"""
+        n, k = self.get_level(poly_class, collinearity, id)
+        for row_id, ancestors in self.iter_rows(poly_class, collinearity, Ancestor, n, k):
+            if row_id == id:
+                return ancestors
+
+    def get_children(
+        self, poly_class: PolyShape, collinearity: CollinearityType, id: str
+    ) -> dict:
+        """Return the children the polyomino grows in to keyed on id,
+        the value being the removal point from the child back to the polyomino"""
+        n, k = self.get_level(poly_class, collinearity, id)
+        children = {}
+        for child_k in (k, k + 1):
+            if child_k > n + 1 or not self.exists(
+                poly_class, collinearity, n + 1, child_k
+            ):
+                continue
+            for d_id, ancestors in self.iter_rows(
+                poly_class, collinearity, Ancestor, n + 1, child_k
+            ):
+                if id in ancestors:
+                    children[d_id] = ancestors[id]
+        return children
+
+
+class TextStorage(Storage):
+    """The ancestor files, one per level, see PolyShape.get_file_path.
+    The build record of a level is kept next to its file as .build"""
+
+    name = "text"
+
+    def exists(self, poly_class, collinearity, n, k) -> bool:
+        return os.path.isfile(poly_class.get_file_path(collinearity, Ancestor, n, k))
+
+    def row_count(self, poly_class, collinearity, n, k):
+        file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+        try:
+            with open_data_file(file_path, "r") as file_obj:
+                return get_row_count(file_obj.readline())
+        except FileNotFoundError:
+            return None
+
+    def iter_rows(self, poly_class, collinearity, data_type, n, k, limit=None):
+        file_path = poly_class.get_file_path(collinearity, data_type, n, k)
+        try:
+            file_obj = open_data_file(file_path, "r")
+        except FileNotFoundError:
+            raise level_not_found(poly_class, collinearity, data_type, n, k)
+        with file_obj:
+            if not is_compact(file_obj.readline()):
+                for line in islice(file_obj, limit):
+                    yield data_type.line_to_data(line.strip())
+                return
+            # the parents come up for each of their children, so expand them once
+            expanded = {}
+
+            def expand_id(compact_id):
+                id = expanded.get(compact_id)
+                if id is None:
+                    id = expanded[compact_id] = poly_class.expand_id(compact_id)
+                return id
+
+            for line in islice(file_obj, limit):
+                id, line_data = data_type.line_to_data(line.strip())
+                yield data_type.map_ids(id, line_data, expand_id)
+
+    def save(self, poly_class, collinearity, data_type, n, k, rows):
+        return poly_class.save_to_file(collinearity, data_type, n, k, rows)
+
+    def get_build_path(self, poly_class, collinearity, n, k) -> str:
+        file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+        return file_path[: file_path.rindex(".txt")] + ".build"
+
+    def get_file_stat(self, poly_class, collinearity, n, k):
+        try:
+            return get_file_stat(poly_class.get_file_path(collinearity, Ancestor, n, k))
+        except FileNotFoundError:
+            return None
+
+    def get_build(self, poly_class, collinearity, n, k):
+        try:
+            with open(
+                self.get_build_path(poly_class, collinearity, n, k), "r"
+            ) as file_obj:
+                record = json.load(file_obj)
+        except FileNotFoundError:
+            return None
+        # the record is only good for the file as it was when it was set
+        if record.pop("file", None) != self.get_file_stat(
+            poly_class, collinearity, n, k
+        ):
+            return None
+        return record
+
+    def set_build(self, poly_class, collinearity, n, k, record):
+        record = dict(record, file=self.get_file_stat(poly_class, collinearity, n, k))
+        file_path = self.get_build_path(poly_class, collinearity, n, k)
+        # written under a name of the process's own first, so a reader never
+        # loads half a record and workers saving at the same time never share a file
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file_obj:
+            json.dump(record, file_obj, sort_keys=True)
+        os.replace(tmp_path, file_path)
+
+    def get_digest(self, poly_class, collinearity, n, k):
+        # the digest saved alongside the file, unless the file has been written since
+        if not self.exists(poly_class, collinearity, n, k):
+            return None
+        return get_file_digest(poly_class.get_file_path(collinearity, Ancestor, n, k))
+
+
+class MemoryStorage(Storage):
+    """Levels held in dicts by the process, kept apart for each data folder"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.levels = {}
+        self.builds = {}
+
+    def key(self, poly_class, collinearity, n, k) -> tuple:
+        data_folder = get_data_folder()
+        return data_folder, poly_class.file_name, collinearity.file_name, n, k
+
+    def exists(self, poly_class, collinearity, n, k) -> bool:
+        return self.key(poly_class, collinearity, n, k) in self.levels
+
+    def row_count(self, poly_class, collinearity, n, k):
+        rows = self.levels.get(self.key(poly_class, collinearity, n, k))
+        return None if rows is None else len(rows)
+
+    def iter_rows(self, poly_class, collinearity, data_type, n, k, limit=None):
+        rows = self.levels.get(self.key(poly_class, collinearity, n, k))
+        if rows is None:
+            raise level_not_found(poly_class, collinearity, data_type, n, k)
+        for id, ancestors in islice(rows.items(), limit):
+            if data_type is Identifier:
+                yield id, encoding_str_to_tuple(id)
+            else:
+                yield id, ancestors
+
+    def save(self, poly_class, collinearity, data_type, n, k, rows):
+        key = self.key(poly_class, collinearity, n, k)
+        self.levels[key] = dict(rows)
+        self.builds.pop(key, None)
+        return LevelDigest.from_rows(rows.items(), data_type)
+
+    def get_build(self, poly_class, collinearity, n, k):
+        record = self.builds.get(self.key(poly_class, collinearity, n, k))
+        return None if record is None else dict(record)
+
+    def set_build(self, poly_class, collinearity, n, k, record):
+        self.builds[self.key(poly_class, collinearity, n, k)] = dict(record)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS level (
+    level_id INTEGER PRIMARY KEY,
+    shape TEXT NOT NULL,
+    collinearity TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    k INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    UNIQUE (shape, collinearity, n, k)
+);
+CREATE TABLE IF NOT EXISTS polyomino (
+    level_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (level_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS polyomino_id ON polyomino (id);
+CREATE TABLE IF NOT EXISTS edge (
+    level_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    edge INTEGER NOT NULL,
+    parent TEXT NOT NULL,
+    removal_point TEXT NOT NULL,
+    PRIMARY KEY (level_id, position, edge)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS edge_parent ON edge (parent);
+CREATE TABLE IF NOT EXISTS build (
+    level_id INTEGER PRIMARY KEY,
+    record TEXT NOT NULL
+);
+"""
+
+
+# rows read from the database at a time
+SQLITE_CHUNK = 10000
+
+
+def point_to_text(point) -> str:
+    return ",".join(str(x) for x in point)
+
+
+def text_to_point(text: str) -> tuple:
+    return tuple(int(x) for x in text.split(","))
+
+
+class SQLiteStorage(Storage):
+    """A SQLite database in the data folder. Each process opens its own connection,
+    shared by its threads through a lock"""
+
+    name = "sqlite"
+    file_name = "polyominoes.sqlite"
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        file_path = os.path.join(get_data_folder_path(), self.file_name)
+        key = os.getpid(), os.path.abspath(file_path)
+        connection = self.connections.get(key)
+        if connection is None:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            connection = sqlite3.connect(file_path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SQLITE_SCHEMA)
+            self.connections[key] = connection
+        return connection
+
+    def query(self, sql: str, parameters=()) -> list:
+        with self.lock:
+            return self.connect().execute(sql, parameters).fetchall()
+
+    def get_level_id(self, poly_class, collinearity, n, k):
+        rows = self.query(
+            "SELECT level_id, rows FROM level WHERE shape = ? AND collinearity = ? AND n = ? AND k = ?",
+            (poly_class.file_name, collinearity.file_name, n, k),
+        )
+        return rows[0] if rows else (None, None)
+
+    def exists(self, poly_class, collinearity, n, k) -> bool:
+        return self.get_level_id(poly_class, collinearity, n, k)[0] is not None
+
+    def row_count(self, poly_class, collinearity, n, k):
+        return self.get_level_id(poly_class, collinearity, n, k)[1]
+
+    def iter_rows(self, poly_class, collinearity, data_type, n, k, limit=None):
+        level_id, row_count = self.get_level_id(poly_class, collinearity, n, k)
+        if level_id is None:
+            raise level_not_found(poly_class, collinearity, data_type, n, k)
+        if limit is None:
+            limit = row_count
+
+        # read in chunks of rows so a level is never all held in memory
+        for start in range(0, min(limit, row_count), SQLITE_CHUNK):
+            parameters = (level_id, start, min(start + SQLITE_CHUNK, limit))
+            if data_type is Identifier:
+                for (id,) in self.query(
+                    """SELECT id FROM polyomino
+                    WHERE level_id = ? AND position >= ? AND position < ?
+                    ORDER BY position""",
+                    parameters,
+                ):
+                    yield id, encoding_str_to_tuple(id)
+                continue
+
+            rows = self.query(
+                """SELECT p.position, p.id, e.parent, e.removal_point
+                FROM polyomino p LEFT JOIN edge e
+                ON e.level_id = p.level_id AND e.position = p.position
+                WHERE p.level_id = ? AND p.position >= ? AND p.position < ?
+                ORDER BY p.position, e.edge""",
+                parameters,
+            )
+            for (_, id), edges in groupby(rows, key=lambda row: row[:2]):
+                yield id, {
+                    parent: text_to_point(removal_point)
+                    for _, _, parent, removal_point in edges
+                    if parent is not None
+                }
+
+    def save(self, poly_class, collinearity, data_type, n, k, rows):
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                level = (poly_class.file_name, collinearity.file_name, n, k)
+                found = connection.execute(
+                    "SELECT level_id FROM level WHERE shape = ? AND collinearity = ? AND n = ? AND k = ?",
+                    level,
+                ).fetchone()
+                if found:
+                    level_id = found[0]
+                    for table in ("polyomino", "edge", "build"):
+                        connection.execute(
+                            f"DELETE FROM {table} WHERE level_id = ?", (level_id,)
+                        )
+                    connection.execute(
+                        "UPDATE level SET rows = ? WHERE level_id = ?",
+                        (len(rows), level_id),
+                    )
+                else:
+                    level_id = connection.execute(
+                        "INSERT INTO level (shape, collinearity, n, k, rows) VALUES (?, ?, ?, ?, ?)",
+                        level + (len(rows),),
+                    ).lastrowid
+
+                connection.executemany(
+                    "INSERT INTO polyomino VALUES (?, ?, ?)",
+                    ((level_id, position, id) for position, id in enumerate(rows)),
+                )
+                connection.executemany(
+                    "INSERT INTO edge VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (level_id, position, edge, a_id, point_to_text(removal_point))
+                        for position, ancestors in enumerate(rows.values())
+                        for edge, (a_id, removal_point) in enumerate(ancestors.items())
+                    ),
+                )
+        return LevelDigest.from_rows(rows.items(), data_type)
+
+    def get_build(self, poly_class, collinearity, n, k):
+        level_id, _ = self.get_level_id(poly_class, collinearity, n, k)
+        rows = self.query("SELECT record FROM build WHERE level_id = ?", (level_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def set_build(self, poly_class, collinearity, n, k, record):
+        level_id, _ = self.get_level_id(poly_class, collinearity, n, k)
+        if level_id is None:
+            raise level_not_found(poly_class, collinearity, Ancestor, n, k)
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO build VALUES (?, ?)",
+                    (level_id, json.dumps(record, sort_keys=True)),
+                )
+
+    def get_level(self, poly_class, collinearity, id) -> tuple:
+        rows = self.query(
+            """SELECT l.n, l.k FROM polyomino p JOIN level l USING (level_id)
+            WHERE p.id = ? AND l.shape = ? AND l.collinearity = ?""",
+            (id, poly_class.file_name, collinearity.file_name),
+        )
+        if not rows:
+            raise KeyError(id)
+        return rows[0]
+
+    def get_parents(self, poly_class, collinearity, id) -> dict:
+        self.get_level(poly_class, collinearity, id)
+        return {
+            parent: text_to_point(removal_point)
+            for parent, removal_point in self.query(
+                """SELECT e.parent, e.removal_point
+                FROM polyomino p JOIN level l USING (level_id)
+                JOIN edge e ON e.level_id = p.level_id AND e.position = p.position
+                WHERE p.id = ? AND l.shape = ? AND l.collinearity = ?
+                ORDER BY e.edge""",
+                (id, poly_class.file_name, collinearity.file_name),
+            )
+        }
+
+    def get_children(self, poly_class, collinearity, id) -> dict:
+        self.get_level(poly_class, collinearity, id)
+        return {
+            child: text_to_point(removal_point)
+            for child, removal_point in self.query(
+                """SELECT p.id, e.removal_point
+                FROM edge e JOIN level l USING (level_id)
+                JOIN polyomino p ON p.level_id = e.level_id AND p.position = e.position
+                WHERE e.parent = ? AND l.shape = ? AND l.collinearity = ?
+                ORDER BY l.k, p.position""",
+                (id, poly_class.file_name, collinearity.file_name),
+            )
+        }
+
+
+STORAGE_BACKENDS = {
+    backend.name: backend for backend in (TextStorage, MemoryStorage, SQLiteStorage)
+}
+
+_storage = None
+
+
+def make_storage(name=None) -> Storage:
+    """Return a new backend by name, defaulting to POLYOMINO_STORAGE"""
+    if name is None:
+        name = os.environ.get("POLYOMINO_STORAGE", "text")
+    try:
+        return STORAGE_BACKENDS[name.lower()]()
+    except KeyError:
+        raise RuntimeError(
+            f"Unknown storage {name}, expected one of {', '.join(STORAGE_BACKENDS)}"
+        )
+
+
+def get_storage() -> Storage:
+    """Return the storage of this process, configured from the environment
+    the first time it is asked for"""
+    global _storage
+    if _storage is None:
+        _storage = make_storage()
+    return _storage
+
+
+def configure_storage(name=None) -> Storage:
+    """Replace the storage of this process e.g. to switch to the in-memory backend"""
+    global _storage
+    _storage = make_storage(name)
+    return _storage
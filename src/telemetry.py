@@ -0,0 +1,252 @@
+"""Live throughput and ETA for long runs.
+
+Generation reports its progress through the Telemetry object from get_telemetry.
+It draws the console progress bar (unless POLYOMINO_SILENT is set) and, when
+POLYOMINO_TELEMETRY is set, writes JSON lines to that file or to stdout if it
+is set to "-". A run can then be followed from another terminal with
+
+    POLYOMINO_TELEMETRY=run.jsonl python ./src/usage.py
+    tail -f run.jsonl
+
+Each line is an object with the time and an event of
+
+    run_start       the shape, collinearity and the n,k levels planned
+    level_start     the n,k being generated and the number of parents
+    progress        at most every POLYOMINO_TELEMETRY_INTERVAL seconds (default 5)
+    level_end       the totals for the level
+    run_end         the totals for the run
+
+Progress and level_end carry parents_per_sec and children_per_sec, where a child
+is a descendant found for a parent. duplicate_ratio is the share of children
+that were the same polyomino as one found from another parent, known exactly at
+the end of a level and estimated from the pattern id cache as it goes.
+memory_mb is the resident memory. level_eta_sec is from the current rate and
+run_eta_sec adds the levels still to do. These are estimated by scaling the time
+of the level before by how much the time of the last complete n grew on the n
+before it, so there is no run ETA until 2 rows of the range are done.
+
+The per parent cost is a counter increment, the clock is only read
+TELEMETRY_CHECKS times over a level.
+"""
+
+import json
+import os
+import sys
+from time import perf_counter, time
+from utils import get_resident_memory, progress_bar_update
+
+MB = 1024 * 1024
+
+# how many times over a level the clock is checked
+TELEMETRY_CHECKS = 200
+
+# the progress bar and peak memory are updated every so many checks
+PROGRESS_BAR_EVERY = 4
+
+
+class Telemetry:
+    """Collects the throughput of a run and emits it to the console and JSON lines"""
+
+    def __init__(self, target=None, interval=None):
+        if target is None:
+            target = os.environ.get("POLYOMINO_TELEMETRY")
+        if interval is None:
+            interval = float(os.environ.get("POLYOMINO_TELEMETRY_INTERVAL", 5))
+        self.target = target
+        self.interval = interval
+        self.file_obj = None
+        self.context = {}
+        self.planned = []
+        self.seconds = {}
+        self.run_start = None
+        self.level = None
+
+    def emit(self, event: str, **fields):
+        """Write an event as a JSON line if a target is set"""
+        if not self.target:
+            return
+        if self.file_obj is None:
+            if self.target == "-":
+                self.file_obj = sys.stdout
+            else:
+                self.file_obj = open(self.target, "a")
+        record = {"event": event, "time": round(time(), 3)}
+        record.update(self.context)
+        record.update(fields)
+        self.file_obj.write(json.dumps(record) + "\n")
+        self.file_obj.flush()
+
+    def start_run(self, poly_class, collinearity, levels):
+        """Plan the n,k levels of a run, for the run ETA"""
+        self.context = {"shape": poly_class.file_name}
+        if collinearity is not None:
+            self.context["collinearity"] = collinearity.file_name
+        self.planned = list(levels)
+        self.seconds = {}
+        self.run_start = perf_counter()
+        self.emit("run_start", levels=self.planned)
+
+    def end_run(self):
+        if self.run_start is not None:
+            self.emit(
+                "run_end",
+                levels=len(self.seconds),
+                seconds=round(perf_counter() - self.run_start, 3),
+            )
+        self.planned = []
+        self.run_start = None
+
+    def start_level(self, n: int, k, parents: int, cache=None, silent=False):
+        """Start the clock on a level, k is None when all k are generated together"""
+        now = perf_counter()
+        self.level = {
+            "n": n,
+            "k": k,
+            "parents_total": parents,
+            "parents": 0,
+            "children": 0,
+            "start": now,
+            "last_emit": now,
+            "checks": 0,
+            "peak_memory": get_resident_memory(),
+            "cache": cache,
+            "silent": silent,
+        }
+        self.check_every = max(parents // TELEMETRY_CHECKS, 1)
+        self.next_check = min(self.check_every, parents)
+        self.emit("level_start", n=n, k=k, parents_total=parents)
+
+    def update(self, children: int):
+        """Count a parent done along with the children found for it"""
+        level = self.level
+        level["parents"] += 1
+        level["children"] += children
+        if level["parents"] >= self.next_check:
+            self.next_check += self.check_every
+            # the last parent is always checked so the bar gets to the end
+            if level["parents"] < level["parents_total"] < self.next_check:
+                self.next_check = level["parents_total"]
+            self.check()
+
+    def check(self):
+        level = self.level
+        level["checks"] += 1
+        done = level["parents"] == level["parents_total"]
+        if level["checks"] % PROGRESS_BAR_EVERY == 0 or done:
+            level["peak_memory"] = max(level["peak_memory"], get_resident_memory())
+            if not level["silent"]:
+                progress_bar_update(level["parents_total"], level["parents"])
+
+        now = perf_counter()
+        if now - level["last_emit"] >= self.interval:
+            level["last_emit"] = now
+            self.emit("progress", **self.rates(now))
+
+    def rates(self, now: float) -> dict:
+        """Return the throughput, memory and ETA of the current level"""
+        level = self.level
+        elapsed = now - level["start"]
+        memory = get_resident_memory()
+        level["peak_memory"] = max(level["peak_memory"], memory)
+
+        parents_rate = level["parents"] / elapsed if elapsed else 0
+        remaining = level["parents_total"] - level["parents"]
+        level_eta = remaining / parents_rate if parents_rate else None
+
+        cache = level["cache"]
+        fields = {
+            "n": level["n"],
+            "k": level["k"],
+            "parents": level["parents"],
+            "parents_total": level["parents_total"],
+            "children": level["children"],
+            "parents_per_sec": round(parents_rate, 1),
+            "children_per_sec": round(level["children"] / elapsed if elapsed else 0, 1),
+            "duplicate_ratio": round(cache.hit_rate(), 4) if cache else None,
+            "memory_mb": round(memory / MB, 1),
+            "elapsed_sec": round(elapsed, 3),
+            "level_eta_sec": None if level_eta is None else round(level_eta, 1),
+            "run_eta_sec": None,
+        }
+        if level_eta is not None:
+            run_eta = self.run_eta((level["n"], level["k"]), elapsed + level_eta)
+            if run_eta is not None:
+                fields["run_eta_sec"] = round(level_eta + run_eta, 1)
+        return fields
+
+    def end_level(self, rows: int) -> dict:
+        """Finish the level given the number of distinct polyominoes found,
+        returns the final rates including the peak memory"""
+        level = self.level
+        now = perf_counter()
+        fields = self.rates(now)
+        fields["rows"] = rows
+        fields["duplicate_ratio"] = (
+            round(1 - rows / level["children"], 4) if level["children"] else 0.0
+        )
+        fields["peak_memory_mb"] = round(level["peak_memory"] / MB, 1)
+        self.seconds[(level["n"], level["k"])] = now - level["start"]
+        self.emit("level_end", **fields)
+        fields["peak_memory"] = level["peak_memory"]
+        self.level = None
+        return fields
+
+    def row_seconds(self, n: int):
+        """Return the time of all the planned levels of n if they are done"""
+        levels = [level for level in self.planned if level[0] == n]
+        if not levels or any(level not in self.seconds for level in levels):
+            return None
+        return sum(self.seconds[level] for level in levels)
+
+    def growth(self):
+        """Return how much the time of the last complete n grew on the n before"""
+        rows = sorted({n for n, _ in self.planned}, reverse=True)
+        for n in rows:
+            last, before = self.row_seconds(n), self.row_seconds(n - 1)
+            if last is not None:
+                if before:
+                    return last / before
+                return None
+        return None
+
+    def run_eta(self, current: tuple, current_seconds: float):
+        """Return the estimated seconds of the planned levels not started yet"""
+        if current not in self.planned:
+            return 0
+        growth = self.growth()
+        if growth is None:
+            return None
+
+        estimates = dict(self.seconds)
+        estimates[current] = current_seconds
+        remaining = 0
+        for n, k in self.planned:
+            if (n, k) in estimates:
+                continue
+            prior = estimates.get((n - 1, k))
+            if prior is None and k is not None:
+                prior = estimates.get((n - 1, k - 1))
+            if prior is None:
+                return None
+            estimates[(n, k)] = prior * growth
+            remaining += estimates[(n, k)]
+        return remaining
+
+
+_telemetry = None
+
+
+def get_telemetry() -> Telemetry:
+    """Return the telemetry of this process, configured from the environment
+    the first time it is asked for"""
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = Telemetry()
+    return _telemetry
+
+
+def configure_telemetry(target=None, interval=None) -> Telemetry:
+    """Replace the telemetry of this process e.g. to start writing to another file"""
+    global _telemetry
+    _telemetry = Telemetry(target, interval)
+    return _telemetry
@@ -1,13 +1,35 @@
 """Run some end to end tests making sure the first terms of output match OEIS"""
 
 import os
-from classes import HexagonPoly, Lattice, Plane, SquarePoly, create_folder_structure
-from generation import create_ancestors_nk
+import sys
+from multiprocessing import Process
+from classes import (
+    Ancestor,
+    HexagonPoly,
+    Lattice,
+    Plane,
+    SquarePoly,
+    create_folder_structure,
+    encoding_str_to_tuple,
+    open_data_file,
+)
+from distributed import (
+    claim_unit,
+    create_work_units,
+    get_work_folder,
+    merge_work_units,
+    run_worker,
+)
+from generation import create_ancestors_nk, create_data_fused
 from reporting import oeis_data_triangle
 
 os.environ["POLYOMINO_DATA_FOLDER"] = "temp"
 max_n = 7
 
+# generation should not pay for the plotting imports
+assert "matplotlib" not in sys.modules
+assert "numpy" not in sys.modules
+
 
 def answer_for_n(s: str, n) -> list:
     terms = n * (n + 1) // 2
@@ -52,3 +74,473 @@ assert oeis_data_triangle(HexagonPoly, Plane, max_n) == answer_for_n(
     hex_plane,
     max_n,
 )
+# the hexagon files are as walking the border in cube coordinates gives them,
+# the order of the rows and the removal points of symmetric children included
+with open_data_file(HexagonPoly.get_file_path(Lattice, Ancestor, 3, 2)) as file_obj:
+    assert file_obj.read().splitlines()[1:] == ["20-2 5:0,1,-1", "5-2 5:0,1,-1"]
+with open_data_file(HexagonPoly.get_file_path(Lattice, Ancestor, 4, 3)) as file_obj:
+    assert file_obj.read().splitlines()[1:] == [
+        "84-2 20-2:3,0,-3 21:0,1,-1",
+        "21-8 20-2:2,0,-2 5-2:0,0,0 21:1,1,-2",
+    ]
+
+
+# distributed generation gives the same file as a single process,
+# including taking over the unit of a worker that died
+file_path = HexagonPoly.get_file_path(Plane, Ancestor, max_n, 3)
+with open_data_file(file_path) as file_obj:
+    expected = file_obj.read()
+
+work_folder = get_work_folder(HexagonPoly, Plane, max_n, 3)
+create_work_units(HexagonPoly, Plane, max_n, 3, unit_size=10)
+_, claimed = claim_unit(work_folder, "dead")
+os.utime(claimed, (0, 0))
+workers = [
+    Process(target=run_worker, args=(HexagonPoly, Plane, max_n, 3, "temp"))
+    for _ in range(3)
+]
+for worker in workers:
+    worker.start()
+for worker in workers:
+    worker.join()
+merge_work_units(HexagonPoly, Plane, max_n, 3)
+
+with open_data_file(file_path) as file_obj:
+    assert file_obj.read() == expected
+assert not os.path.isdir(work_folder)
+
+
+# the adjacency index agrees with the ancestor files, imported here
+# as it brings in numpy which generation alone does not need
+from adjacency import AdjacencyIndex, build_index
+from generation import load_ancestors_nk
+
+build_index(HexagonPoly, Plane, max_n)
+index = AdjacencyIndex(HexagonPoly, Plane)
+assert len(index) == sum(oeis_data_triangle(HexagonPoly, Plane, max_n))
+for id, ancestors in load_ancestors_nk(HexagonPoly, Plane, max_n, 3).items():
+    assert index.get_parents(id) == ancestors
+    assert index.get_level(id) == (max_n, 3)
+    for a_id in ancestors:
+        assert id in index.get_children(a_id)
+
+
+# fused generation of Lattice and Plane gives the same files as separate runs
+for poly_class in (SquarePoly, HexagonPoly):
+    os.environ["POLYOMINO_DATA_FOLDER"] = "temp/fused"
+    create_folder_structure()
+    create_data_fused(poly_class, 1, max_n, overwrite=True)
+    for collinearity in (Lattice, Plane):
+        for n in range(1, max_n + 1):
+            for k in range(1, n + 1):
+                contents = []
+                for data_folder in ("temp/fused", "temp"):
+                    os.environ["POLYOMINO_DATA_FOLDER"] = data_folder
+                    file_path = poly_class.get_file_path(collinearity, Ancestor, n, k)
+                    with open_data_file(file_path) as file_obj:
+                        contents.append(file_obj.read())
+                assert contents[0] == contents[1]
+
+
+# sampling estimates agree with the exact counts, to within twice the 95% interval
+# and one more for the levels so rare the tours may never reach them
+from estimation import estimate_counts
+
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp"
+level_estimates, total_estimates = estimate_counts(
+    HexagonPoly, Lattice, 6, tours=300, seed=1, workers=2
+)
+exact = answer_for_n(hex_lattice, 6)
+for n in range(1, 7):
+    for k in range(1, n + 1):
+        estimate, half_width = level_estimates.get((n, k), (0, 0))
+        assert abs(estimate - exact.pop(0)) <= 2 * half_width + 1
+
+
+# a level as a PolyominoSet matches the level loaded as a dict and
+# generating from parents held that way gives the same file
+from generation import load_polyomino_patterns_nk
+from polyset import load_level_set, verify_set
+
+poly_set = load_level_set(HexagonPoly, Plane, max_n, 3)
+assert poly_set == load_polyomino_patterns_nk(HexagonPoly, Plane, max_n, 3)
+assert verify_set(poly_set, Plane, 3) == len(poly_set)
+
+file_path = HexagonPoly.get_file_path(Plane, Ancestor, max_n, 3)
+with open_data_file(file_path) as file_obj:
+    expected = file_obj.read()
+os.environ["POLYOMINO_COLUMNAR"] = "1"
+create_ancestors_nk(HexagonPoly, Plane, max_n, 3, overwrite=True)
+del os.environ["POLYOMINO_COLUMNAR"]
+with open_data_file(file_path) as file_obj:
+    assert file_obj.read() == expected
+
+# the pipelined run takes the workers, columnar parents and memory budget
+# from the environment as create_ancestors_nk does
+from generation import create_data_pipelined
+
+os.environ["POLYOMINO_WORKERS"] = "2"
+os.environ["POLYOMINO_COLUMNAR"] = "1"
+os.remove(file_path)
+create_data_pipelined(HexagonPoly, Plane, max_n, max_n, 3)
+with open_data_file(file_path) as file_obj:
+    assert file_obj.read() == expected
+del os.environ["POLYOMINO_WORKERS"]
+del os.environ["POLYOMINO_COLUMNAR"]
+os.environ["POLYOMINO_MEMORY_BUDGET"] = "0.001"
+os.remove(file_path)
+try:
+    create_data_pipelined(HexagonPoly, Plane, max_n, max_n, 3)
+    assert False
+except RuntimeError:
+    pass
+del os.environ["POLYOMINO_MEMORY_BUDGET"]
+create_data_pipelined(HexagonPoly, Plane, max_n, max_n, 3)
+with open_data_file(file_path) as file_obj:
+    assert file_obj.read() == expected
+
+
+# telemetry of a run is a JSON line for each event ending with the run
+import json
+import shutil
+from generation import create_data
+from telemetry import configure_telemetry
+
+# built in to a fresh folder as create_data leaves the levels of a run before alone
+telemetry_folder = os.path.join(os.path.dirname(__file__), "../temp/telemetry")
+shutil.rmtree(telemetry_folder, ignore_errors=True)
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp/telemetry"
+create_folder_structure()
+telemetry_path = os.path.join(os.path.dirname(__file__), "../temp/telemetry.jsonl")
+if os.path.isfile(telemetry_path):
+    os.remove(telemetry_path)
+configure_telemetry(telemetry_path, interval=0)
+create_data(SquarePoly, Lattice, 1, max_n)
+with open(telemetry_path) as file_obj:
+    events = [json.loads(line) for line in file_obj]
+assert events[0]["event"] == "run_start" and events[-1]["event"] == "run_end"
+level_ends = [e for e in events if e["event"] == "level_end"]
+assert [e["rows"] for e in level_ends] == answer_for_n(squ_lattice, max_n)
+configure_telemetry()
+# the progress bar gets to the end whatever the number of parents
+from contextlib import redirect_stdout
+from io import StringIO
+from telemetry import Telemetry
+
+telemetry = Telemetry()
+with redirect_stdout(StringIO()) as out:
+    telemetry.start_level(5, 2, 401)
+    for _ in range(401):
+        telemetry.update(1)
+    telemetry.end_level(1)
+assert out.getvalue().endswith("100.0% Complete\r\n")
+
+
+# the border of a symmetric parent is grouped in to orbits giving the same child
+for poly_class in (SquarePoly, HexagonPoly):
+    kernel = poly_class.kernel()
+    monomino = kernel.to_internal({poly_class.origin})
+    assert len(kernel.automorphisms(monomino)) == 2 * poly_class.symmetry
+    assert len(kernel.border_orbits(monomino)) == 1
+kernel = SquarePoly.kernel()
+assert len(kernel.border_orbits(kernel.to_internal({(0, 0), (0, 1)}))) == 2
+
+
+# the in-memory and SQLite storage give the same levels as the text files
+# and SQLite answers the parents and children of a polyomino by lookup
+from storage import configure_storage
+
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp"
+text_levels = {
+    (n, k): load_ancestors_nk(HexagonPoly, Plane, n, k)
+    for n in range(1, max_n + 1)
+    for k in range(1, n + 1)
+}
+for name in ("memory", "sqlite"):
+    os.environ["POLYOMINO_DATA_FOLDER"] = f"temp/{name}"
+    storage = configure_storage(name)
+    for n in range(1, max_n + 1):
+        for k in range(1, n + 1):
+            create_ancestors_nk(HexagonPoly, Plane, n, k, overwrite=True)
+    assert oeis_data_triangle(HexagonPoly, Plane, max_n) == answer_for_n(
+        hex_plane, max_n
+    )
+    for (n, k), ancestors in text_levels.items():
+        assert list(load_ancestors_nk(HexagonPoly, Plane, n, k).items()) == list(
+            ancestors.items()
+        )
+for id, ancestors in text_levels[(max_n, 3)].items():
+    assert storage.get_level(HexagonPoly, Plane, id) == (max_n, 3)
+    assert storage.get_parents(HexagonPoly, Plane, id) == ancestors
+    for a_id, removal_point in ancestors.items():
+        assert storage.get_children(HexagonPoly, Plane, a_id)[id] == removal_point
+configure_storage()
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp"
+
+
+# create_data only rebuilds the levels that are stale and those downstream
+# whose inputs then change, seen by the levels it generates
+from classes import LevelDigest
+from storage import get_storage
+
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp/telemetry"
+
+
+def rebuilt_levels() -> list:
+    if os.path.isfile(telemetry_path):
+        os.remove(telemetry_path)
+    configure_telemetry(telemetry_path, interval=0)
+    create_data(SquarePoly, Lattice, 1, max_n)
+    configure_telemetry()
+    with open(telemetry_path) as file_obj:
+        events = [json.loads(line) for line in file_obj]
+    return [(e["n"], e["k"]) for e in events if e["event"] == "level_end"]
+
+
+assert rebuilt_levels() == []
+# a level compressed since is found whatever POLYOMINO_COMPRESSION is set to
+os.environ["POLYOMINO_COMPRESSION"] = "lzma"
+ancestors = load_ancestors_nk(SquarePoly, Lattice, 5, 2)
+SquarePoly.save_to_file(Lattice, Ancestor, 5, 2, ancestors)
+del os.environ["POLYOMINO_COMPRESSION"]
+assert SquarePoly.get_file_path(Lattice, Ancestor, 5, 2).endswith(".txt.xz")
+assert load_ancestors_nk(SquarePoly, Lattice, 5, 2) == ancestors
+assert rebuilt_levels() == []
+# a level regenerated the same leaves those from it alone
+os.remove(SquarePoly.get_file_path(Lattice, Ancestor, 5, 2))
+assert rebuilt_levels() == [(5, 2)]
+# a level saved in a different order is the same level so leaves those from it alone
+ancestors = load_ancestors_nk(SquarePoly, Lattice, 4, 2)
+reordered = dict(reversed(list(ancestors.items())))
+digest = LevelDigest.from_rows(ancestors.items()).to_dict()
+saved = get_storage().save(SquarePoly, Lattice, Ancestor, 4, 2, reordered)
+assert saved.to_dict() == digest
+assert rebuilt_levels() == []
+# a level saved with a row fewer changes those from it, and those from them
+# for as long as what they hold keeps changing
+fewer = dict(list(ancestors.items())[1:])
+get_storage().save(SquarePoly, Lattice, Ancestor, 4, 2, fewer)
+rebuilt = rebuilt_levels()
+assert rebuilt[:2] == [(5, 2), (5, 3)]
+assert all(2 <= k <= n - 2 for n, k in rebuilt)
+assert rebuilt_levels() == []
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp"
+
+
+# the largest polyominoes within a collinearity limit found by search
+# are those of the last level that is not empty
+from search import largest_polyominoes
+
+assert largest_polyominoes(HexagonPoly, Plane, 2, workers=1) == (
+    6,
+    sorted(load_ancestors_nk(HexagonPoly, Plane, 6, 2)),
+)
+assert largest_polyominoes(SquarePoly, Plane, 2, workers=2) == (
+    4,
+    sorted(load_ancestors_nk(SquarePoly, Plane, 4, 2)),
+)
+best, witnesses = largest_polyominoes(SquarePoly, Plane, 3, workers=2)
+assert best == 15 and len(witnesses) == 1
+# on the lattice there are staircases of any size so the search needs a limit
+try:
+    largest_polyominoes(SquarePoly, Lattice, 2, workers=1)
+    assert False
+except RuntimeError:
+    pass
+assert largest_polyominoes(SquarePoly, Lattice, 2, 6, workers=1)[0] == 6
+
+
+# generating with the parents shared between worker processes gives the same file
+file_path = HexagonPoly.get_file_path(Plane, Ancestor, max_n, 3)
+with open_data_file(file_path) as file_obj:
+    expected = file_obj.read()
+os.environ["POLYOMINO_WORKERS"] = "2"
+create_ancestors_nk(HexagonPoly, Plane, max_n, 3, overwrite=True)
+del os.environ["POLYOMINO_WORKERS"]
+with open_data_file(file_path) as file_obj:
+    assert file_obj.read() == expected
+
+
+# compact hex ids take out the zero bits of the doubled frame and expand back,
+# and a level written with them reads back the same
+for k in range(1, max_n + 1):
+    ancestors = load_ancestors_nk(HexagonPoly, Plane, max_n, k)
+    for id in ancestors:
+        compact_id = HexagonPoly.compact_id(id)
+        assert HexagonPoly.expand_id(compact_id) == id
+        assert len(compact_id) <= len(id)
+    assert SquarePoly.compact_id(id) == id
+    os.environ["POLYOMINO_COMPACT_IDS"] = "1"
+    HexagonPoly.save_to_file(Plane, Ancestor, max_n, k, ancestors)
+    del os.environ["POLYOMINO_COMPACT_IDS"]
+    assert load_ancestors_nk(HexagonPoly, Plane, max_n, k) == ancestors
+    HexagonPoly.save_to_file(Plane, Ancestor, max_n, k, ancestors)
+
+
+# classifying polyominoes given as ids, coordinates and ASCII art in any
+# orientation finds them in the levels with the k they were generated for
+from classify import classify, read_inputs
+
+lines = []
+expected = []
+for k in range(1, max_n + 1):
+    for id in load_ancestors_nk(HexagonPoly, Lattice, max_n, k):
+        points = HexagonPoly.decoder(encoding_str_to_tuple(id))
+        points = HexagonPoly.rotate_points(points)
+        lines.append(" ".join(str(p) for p in points))
+        expected.append((id, max_n, k))
+lines.append("1-2-1")
+lines.extend(["@.@", ".@.", "@.@", ""])
+expected.extend([("20-2", 3, 2), ("20-8-20", 5, 3)])
+rows = list(classify(HexagonPoly, read_inputs(HexagonPoly, lines), workers=2))
+assert [row[0] for row in rows[-2:]] == [len(lines) - 4, len(lines) - 3]
+assert [(id, n, lattice_k) for _, id, n, lattice_k, *_ in rows] == expected
+for _, id, n, _, plane_k, in_lattice, in_plane in rows:
+    assert in_lattice and in_plane
+    assert id in load_ancestors_nk(HexagonPoly, Plane, n, plane_k)
+# one larger than the levels created is classified but not looked up
+((_, id, n, lattice_k, plane_k, in_lattice, in_plane),) = classify(
+    HexagonPoly, read_inputs(HexagonPoly, [str(int("1" + "01" * max_n, 2))]), workers=1
+)
+assert (n, lattice_k, plane_k) == (max_n + 1, max_n + 1, max_n + 1)
+assert in_lattice is None and in_plane is None
+# a level created since the index was built is looked up in the level itself
+create_ancestors_nk(HexagonPoly, Plane, max_n + 1, 3)
+id = next(iter(load_ancestors_nk(HexagonPoly, Plane, max_n + 1, 3)))
+((*_, in_plane),) = classify(HexagonPoly, read_inputs(HexagonPoly, [id]), workers=1)
+assert in_plane
+os.remove(HexagonPoly.get_file_path(Plane, Ancestor, max_n + 1, 3))
+
+
+# the property tables of the levels agree with the levels, and counting each
+# polyomino once for each of its orientations gives the fixed polyominoes
+# A001168 and A001207
+from generation import save_level
+from properties import get_properties_path, load_properties, query_properties
+
+fixed = {
+    SquarePoly: [1, 2, 6, 19, 63, 216, 760],
+    HexagonPoly: [1, 3, 11, 44, 186, 814, 3652],
+}
+for poly_class, counts in fixed.items():
+    for collinearity in (Lattice, Plane):
+        fixed_counts = [0] * max_n
+        for n in range(1, max_n + 1):
+            for k in range(1, n + 1):
+                symmetry = load_properties(poly_class, collinearity, n, k)["symmetry"]
+                fixed_counts[n - 1] += int((2 * poly_class.symmetry // symmetry).sum())
+        assert fixed_counts == counts[:max_n]
+for k in range(1, max_n + 1):
+    table = load_properties(HexagonPoly, Lattice, max_n, k)
+    ancestors = load_ancestors_nk(HexagonPoly, Lattice, max_n, k)
+    assert table.ids() == list(ancestors)
+    assert table["parents"].tolist() == [len(parents) for parents in ancestors.values()]
+    assert set(table["lattice_k"].tolist()) <= {k}
+    for id, plane_k in zip(table.ids(), table["plane_k"].tolist()):
+        assert id in load_ancestors_nk(HexagonPoly, Plane, max_n, plane_k)
+assert query_properties(
+    HexagonPoly, Plane, max_n, lambda table: table["symmetry"] == 12
+) == [(1, 1, "1"), (6, 2, "20-34-20"), (7, 3, "20-42-20")]
+# the width of a hexagon's id counts the half cells from its first to its last
+table = load_properties(HexagonPoly, Lattice, 3, 2)
+assert dict(zip(table.ids(), table["width"].tolist())) == {"5-2": 3, "20-2": 4}
+# a table is written as the level is generated and built again when the level changes
+os.remove(get_properties_path(SquarePoly, Plane, 4, 2))
+os.environ["POLYOMINO_PROPERTIES"] = "1"
+create_ancestors_nk(SquarePoly, Plane, 4, 2, overwrite=True)
+del os.environ["POLYOMINO_PROPERTIES"]
+assert os.path.isfile(get_properties_path(SquarePoly, Plane, 4, 2))
+ancestors = load_ancestors_nk(SquarePoly, Plane, 4, 2)
+fewer = dict(list(ancestors.items())[1:])
+save_level(SquarePoly, Plane, 4, 2, fewer)
+assert load_properties(SquarePoly, Plane, 4, 2).ids() == list(fewer)
+save_level(SquarePoly, Plane, 4, 2, ancestors)
+
+
+# the digests of the levels do not depend on the order or form they were
+# written in, so comparing data folders finds only the level that differs
+from classes import get_digest_path, get_file_digest
+from compare import compare_folders
+from storage import get_data_folder_path
+
+folder_a = get_data_folder_path()
+levels = {
+    (n, k): load_ancestors_nk(HexagonPoly, Plane, n, k)
+    for n in range(1, max_n + 1)
+    for k in range(1, n + 1)
+}
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp/compare"
+os.environ["POLYOMINO_COMPRESSION"] = "gzip"
+os.environ["POLYOMINO_COMPACT_IDS"] = "1"
+create_folder_structure()
+for (n, k), ancestors in levels.items():
+    HexagonPoly.save_to_file(
+        Plane, Ancestor, n, k, dict(reversed(list(ancestors.items())))
+    )
+del os.environ["POLYOMINO_COMPACT_IDS"]
+file_path = HexagonPoly.get_file_path(Plane, Ancestor, max_n, 3)
+assert get_file_digest(file_path) == LevelDigest.from_file(file_path).to_dict()
+folder_b = get_data_folder_path()
+result = compare_folders(folder_a, folder_b)
+assert len(result["same"]) == max_n * (max_n + 1) // 2
+assert not result["different"] and not result["only_b"]
+ancestors = levels[max_n, max_n]
+# a level with one edge fewer, found by working out its digest again
+# as the file no longer matches the digest saved with it
+digest_path = get_digest_path(HexagonPoly.get_file_path(Plane, Ancestor, max_n, max_n))
+with open(digest_path) as file_obj:
+    saved_digest = file_obj.read()
+id, parents = next(iter(ancestors.items()))
+ancestors[id] = dict(list(parents.items())[1:])
+HexagonPoly.save_to_file(Plane, Ancestor, max_n, max_n, ancestors)
+with open(digest_path, "w") as file_obj:
+    file_obj.write(saved_digest)
+assert compare_folders(folder_a, folder_b)["different"] == [
+    ("hexagon", "plane", f"ancestor_{max_n:02d}_{max_n:02d}")
+]
+del os.environ["POLYOMINO_COMPRESSION"]
+os.environ["POLYOMINO_DATA_FOLDER"] = "temp"
+
+
+# generating within a region gives the levels as they are in full, in the same
+# order, less the polyominoes that do not fit, and searching within the region
+# finds the largest of them
+from classes import get_region
+
+for region, poly_class in (("3x4", SquarePoly), ("hexagon1", HexagonPoly)):
+    os.environ["POLYOMINO_REGION"] = region
+    create_folder_structure()
+    create_data(poly_class, Plane, 1, max_n)
+    os.environ["POLYOMINO_WORKERS"] = "2"
+    create_data(poly_class, Lattice, 1, max_n)
+    del os.environ["POLYOMINO_WORKERS"]
+    kernel = poly_class.kernel()
+    fits = lambda id: get_region().fits(
+        kernel, kernel.to_internal(poly_class.decoder(encoding_str_to_tuple(id)))
+    )
+    levels = {}
+    for collinearity in (Lattice, Plane):
+        for n in range(1, max_n + 1):
+            for k in range(1, n + 1):
+                restricted = load_ancestors_nk(poly_class, collinearity, n, k)
+                levels[collinearity, n, k] = restricted
+                del os.environ["POLYOMINO_REGION"]
+                full = load_ancestors_nk(poly_class, collinearity, n, k)
+                os.environ["POLYOMINO_REGION"] = region
+                assert list(restricted.items()) == [
+                    (id, ancestors) for id, ancestors in full.items() if fits(id)
+                ]
+    create_data_fused(poly_class, 1, max_n, overwrite=True)
+    for (collinearity, n, k), restricted in levels.items():
+        assert load_ancestors_nk(poly_class, collinearity, n, k) == restricted
+    largest = max(
+        n for (c, n, k), rows in levels.items() if c is Plane and k <= 2 and rows
+    )
+    assert largest_polyominoes(
+        poly_class, Plane, 2, max_n, workers=1, region=get_region()
+    )[0] == largest
+    del os.environ["POLYOMINO_REGION"]
+# a hexagon of radius 1 only holds the flower of 7 cells
+os.environ["POLYOMINO_REGION"] = "hexagon1"
+assert list(load_ancestors_nk(HexagonPoly, Plane, 7, 3)) == ["20-42-20"]
+del os.environ["POLYOMINO_REGION"]
@@ -9,7 +9,7 @@ from classes import (
     HexagonPoly,
     create_folder_structure,
 )
-from generation import create_ancestors_nk, create_data
+from generation import create_ancestors_nk, create_data, create_data_fused
 from reporting import output_table
 
 # default root folder for data
@@ -32,6 +32,12 @@ def example_all_sets_to_n(n):
     create_data(HexagonPoly, Plane, 1, n)
 
 
+def example_all_sets_to_n_fused(n):
+    """Create T(n,k) for all types up n, Lattice and Plane together for each shape"""
+    create_data_fused(SquarePoly, 1, n)
+    create_data_fused(HexagonPoly, 1, n)
+
+
 def example_output_result_tables_to_n(n):
     """Output result tables to n"""
     output_table(SquarePoly, Lattice, n)
@@ -75,4 +81,77 @@ def example_visual_using_matplotlib():
     # HexagonPoly.plot("162-21-32", to_file=False)
 
 
+def example_gallery_of_set():
+    """Render all of P(7,3) for the hexagon plane to PNG contact sheets"""
+    from plotting import render_gallery
+    from generation import load_data_file
+    from classes import Identifier
+
+    ids = load_data_file(HexagonPoly, Plane, Identifier, 7, 3)
+    render_gallery(
+        HexagonPoly, ids, "hexagon_plane_07_03", per_sheet=64, show_graph=True
+    )
+
+
+def example_estimates_beyond_exact():
+    """Estimate the square plane polyominoes with no more than 3 cells collinear
+    up to n=16 by sampling"""
+    from estimation import output_estimates
+
+    output_estimates(SquarePoly, Plane, 16, tours=2000, k_limit=3)
+
+
+def example_largest_within_collinearity():
+    """Find the largest square polyominoes with no more than 3 cells collinear
+    on the plane without creating every level"""
+    from search import output_largest
+
+    output_largest(SquarePoly, Plane, 3)
+
+
+def example_sqlite_storage():
+    """Create the data in a SQLite database and look up the parents and
+    children of a polyomino without loading its level"""
+    from storage import configure_storage
+
+    storage = configure_storage("sqlite")
+    create_data(HexagonPoly, Plane, 1, 7)
+    print(storage.get_level(HexagonPoly, Plane, "336-10-16"))
+    print(storage.get_parents(HexagonPoly, Plane, "336-10-16"))
+    print(storage.get_children(HexagonPoly, Plane, "336-10-16"))
+
+
+def example_classify_batch():
+    """Classify hexagon polyominoes given as an id, coordinates and ASCII art
+    against the levels created so far"""
+    from classify import classify, format_row, read_inputs
+
+    lines = ["1-2-1", "(0, 0, 0) (1, -1, 0) (1, 0, -1)", "", "@.@", ".@.", "@.@"]
+    for row in classify(HexagonPoly, read_inputs(HexagonPoly, lines)):
+        print(format_row(row))
+
+
+def example_property_queries():
+    """Find the hexagon polyominoes with full symmetry and the widest of
+    P(7,3) from the property tables rather than their patterns"""
+    from properties import load_properties, query_properties
+
+    print(query_properties(HexagonPoly, Plane, 7, lambda t: t["symmetry"] == 12))
+    table = load_properties(HexagonPoly, Plane, 7, 3)
+    print(table.ids(table.where(width=table["width"].max())))
+
+
+def example_within_region():
+    """Create only the square polyominoes that fit within a 4x4 window, kept in
+    data/region_4x4, and find the largest within it with no more than 2 cells
+    collinear on the plane"""
+    from classes import Window
+    from search import output_largest
+
+    os.environ["POLYOMINO_REGION"] = "4x4"
+    create_data(SquarePoly, Plane, 1, 16)
+    del os.environ["POLYOMINO_REGION"]
+    output_largest(SquarePoly, Plane, 2, region=Window(4, 4))
+
+
 example_visual_using_matplotlib()
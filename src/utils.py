@@ -1,6 +1,9 @@
 """Various utility functions"""
 
+import os
+import sys
 from collections import defaultdict
+from itertools import islice
 
 
 PROGRESS_BAR_FREQ = 2  # as %
@@ -84,3 +87,44 @@ def reverse_dag(g):
         for v, p in edges.items():
             rg[v][u] = p
     return rg
+
+
+def deep_size(obj) -> int:
+    """Return the bytes held by an object including the containers within it"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k) + deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, (tuple, list, set, frozenset)):
+        size += sum(deep_size(x) for x in obj)
+    return size
+
+
+def estimate_size(d: dict, sample=50) -> int:
+    """Estimate the bytes held by a dict by measuring a sample of its items"""
+    if hasattr(d, "nbytes"):
+        # array backed containers know their own size
+        return d.nbytes
+    size = sys.getsizeof(d)
+    items = list(islice(d.items(), sample))
+    if items:
+        item_size = sum(deep_size(k) + deep_size(v) for k, v in items)
+        size += item_size * len(d) // len(items)
+    return size
+
+
+def get_resident_memory() -> int:
+    """Return the resident memory of the process in bytes.
+    Where the current value is not available the peak is returned (0 if neither)"""
+    try:
+        with open("/proc/self/statm", "r") as file_obj:
+            pages = int(file_obj.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024